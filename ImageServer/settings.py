@@ -38,6 +38,114 @@ FIGMA_CLIENT_ID = os.getenv('FIGMA_CLIENT_ID')
 FIGMA_CLIENT_SECRET = os.getenv('FIGMA_CLIENT_SECRET')
 REDIRECT_URL = os.getenv('REDIRECT_URL')
 
+# Print the raw vision model output alongside the parsed attributes
+VISION_DEBUG = os.getenv('VISION_DEBUG', 'False') == 'True'
+
+# Cache of parsed vision attributes keyed by image content and prompt version.
+# Backend is one of: memory, django, filesystem, none
+VISION_CACHE_BACKEND = os.getenv('VISION_CACHE_BACKEND', 'memory')
+VISION_CACHE_TTL = int(os.getenv('VISION_CACHE_TTL', 60 * 60 * 24 * 7))
+VISION_CACHE_MAX_ENTRIES = int(os.getenv('VISION_CACHE_MAX_ENTRIES', 1024))
+VISION_CACHE_DIR = os.getenv('VISION_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'vision'))
+VISION_CACHE_ALIAS = os.getenv('VISION_CACHE_ALIAS', 'default')
+
+# Images are downscaled and re-encoded before the vision call (app.imaging). The defaults match the
+# size the model downsamples high detail images to. VISION_IMAGE_FORMAT is a Pillow format or auto
+# (smaller of JPEG and PNG); VISION_IMAGE_DETAIL is low, high or auto.
+VISION_IMAGE_MAX_EDGE = int(os.getenv('VISION_IMAGE_MAX_EDGE', 2048))
+VISION_IMAGE_SHORT_EDGE = int(os.getenv('VISION_IMAGE_SHORT_EDGE', 768))
+VISION_IMAGE_FORMAT = os.getenv('VISION_IMAGE_FORMAT', 'auto')
+VISION_IMAGE_QUALITY = int(os.getenv('VISION_IMAGE_QUALITY', 85))
+VISION_IMAGE_DETAIL = os.getenv('VISION_IMAGE_DETAIL', 'auto')
+# Largest image body read from a remote URL; larger downloads are aborted while streaming
+REMOTE_IMAGE_MAX_BYTES = int(os.getenv('REMOTE_IMAGE_MAX_BYTES', 20 * 1024 * 1024))
+
+# Memoized query summaries of process_icons_query, keyed by the normalized attributes.
+# Same backends as the vision cache; filesystem or django persist across restarts.
+ICONS_QUERY_CACHE_BACKEND = os.getenv('ICONS_QUERY_CACHE_BACKEND', 'memory')
+ICONS_QUERY_CACHE_TTL = int(os.getenv('ICONS_QUERY_CACHE_TTL', 60 * 60 * 24 * 30))
+ICONS_QUERY_CACHE_MAX_ENTRIES = int(os.getenv('ICONS_QUERY_CACHE_MAX_ENTRIES', 4096))
+ICONS_QUERY_CACHE_DIR = os.getenv('ICONS_QUERY_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'icons_query'))
+
+# Color palette extracted from the image pixels (app.palette) instead of the vision model's guess
+PALETTE_EXTRACTION = os.getenv('PALETTE_EXTRACTION', 'True') == 'True'
+PALETTE_SIZE = int(os.getenv('PALETTE_SIZE', 5))
+PALETTE_SAMPLE_EDGE = int(os.getenv('PALETTE_SAMPLE_EDGE', 64))
+
+# Queries that are just a color or shape word are routed locally, without a model call
+QUERY_LOCAL_ROUTING = os.getenv('QUERY_LOCAL_ROUTING', 'True') == 'True'
+
+# Ask the LLM to map colors the local matcher (app.colors) can not resolve
+COLOR_MATCH_LLM_FALLBACK = os.getenv('COLOR_MATCH_LLM_FALLBACK', 'False') == 'True'
+
+# Unique icons fetch_icons returns, fetched as equal, non-overlapping Freepik pages
+FETCH_ICONS_TARGET = int(os.getenv('FETCH_ICONS_TARGET', 150))
+# Rounds of extra pages requested when icons repeated across pages leave fewer than the target; 0
+# accepts the shortfall
+FETCH_ICONS_MAX_TOPUPS = int(os.getenv('FETCH_ICONS_MAX_TOPUPS', 1))
+# Run the query summary and Freepik page requests of fetch_icons concurrently
+FETCH_ICONS_CONCURRENT = os.getenv('FETCH_ICONS_CONCURRENT', 'True') == 'True'
+FETCH_ICONS_MAX_WORKERS = int(os.getenv('FETCH_ICONS_MAX_WORKERS', 16))
+# Color/shape refinements reuse the project's previous search term and query summary
+FETCH_ICONS_INCREMENTAL = os.getenv('FETCH_ICONS_INCREMENTAL', 'True') == 'True'
+# Largest page_size the icon list endpoints serve (app.pagination). At least FETCH_ICONS_TARGET by
+# default, so a legacy page=1 request for a whole result set still gets every icon
+ICON_PAGE_MAX_SIZE = int(os.getenv('ICON_PAGE_MAX_SIZE', FETCH_ICONS_TARGET))
+
+# Per-user project retention (app.retention); 0 turns a limit off
+PROJECT_RETENTION_MAX_COUNT = int(os.getenv('PROJECT_RETENTION_MAX_COUNT', 5))
+PROJECT_RETENTION_MAX_AGE_DAYS = int(os.getenv('PROJECT_RETENTION_MAX_AGE_DAYS', 0))
+PROJECT_RETENTION_MAX_BYTES = int(os.getenv('PROJECT_RETENTION_MAX_BYTES', 0))
+# Historical versions kept per project by save_with_historical_record
+PROJECT_HISTORY_MAX_VERSIONS = int(os.getenv('PROJECT_HISTORY_MAX_VERSIONS', 5))
+
+# Shared Freepik API client (app.freepik)
+FREEPIK_CONNECT_TIMEOUT = float(os.getenv('FREEPIK_CONNECT_TIMEOUT', 5))
+FREEPIK_READ_TIMEOUT = float(os.getenv('FREEPIK_READ_TIMEOUT', 20))
+FREEPIK_MAX_RETRIES = int(os.getenv('FREEPIK_MAX_RETRIES', 3))
+FREEPIK_BACKOFF_FACTOR = float(os.getenv('FREEPIK_BACKOFF_FACTOR', 0.5))
+FREEPIK_MAX_CONCURRENCY = int(os.getenv('FREEPIK_MAX_CONCURRENCY', 10))
+FREEPIK_POOL_SIZE = int(os.getenv('FREEPIK_POOL_SIZE', 20))
+
+# Shared cache of Freepik icon search results, keyed by the canonical query parameters.
+# Entries older than the TTL are served for STALE_TTL more seconds while they are refreshed.
+FREEPIK_SEARCH_CACHE_BACKEND = os.getenv('FREEPIK_SEARCH_CACHE_BACKEND', 'memory')
+FREEPIK_SEARCH_CACHE_TTL = int(os.getenv('FREEPIK_SEARCH_CACHE_TTL', 60 * 15))
+FREEPIK_SEARCH_CACHE_STALE_TTL = int(os.getenv('FREEPIK_SEARCH_CACHE_STALE_TTL', 60 * 60 * 24))
+FREEPIK_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('FREEPIK_SEARCH_CACHE_MAX_ENTRIES', 2048))
+FREEPIK_SEARCH_CACHE_DIR = os.getenv('FREEPIK_SEARCH_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'freepik_search'))
+
+# Parallel icon downloads for the ZIP endpoints (app.downloads)
+ICON_DOWNLOAD_WORKERS = int(os.getenv('ICON_DOWNLOAD_WORKERS', 8))
+ICON_DOWNLOAD_TIMEOUT = float(os.getenv('ICON_DOWNLOAD_TIMEOUT', 10))
+# Client for icon assets and other hosts, kept apart from the Freepik API client so downloads
+# neither take its concurrency slots nor spend its retries (app.freepik.get_download_client)
+ICON_DOWNLOAD_MAX_CONCURRENCY = int(os.getenv('ICON_DOWNLOAD_MAX_CONCURRENCY', 16))
+ICON_DOWNLOAD_MAX_RETRIES = int(os.getenv('ICON_DOWNLOAD_MAX_RETRIES', 1))
+
+# On-disk icon blob cache shared by all download paths (app.icon_cache)
+ICON_CACHE_ENABLED = os.getenv('ICON_CACHE_ENABLED', 'True') == 'True'
+ICON_CACHE_DIR = os.getenv('ICON_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'icons'))
+ICON_CACHE_MAX_BYTES = int(os.getenv('ICON_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Seconds an entry is served without revalidating against the upstream
+ICON_CACHE_MAX_AGE = int(os.getenv('ICON_CACHE_MAX_AGE', 60 * 60 * 24))
+# Largest blob stored, as a fraction of ICON_CACHE_MAX_BYTES; bigger ones are passed through
+ICON_CACHE_MAX_ENTRY_FRACTION = float(os.getenv('ICON_CACHE_MAX_ENTRY_FRACTION', 0.01))
+# Comma separated hosts, with their subdomains, whose assets are stored; other URLs are downloaded
+# but not cached
+ICON_CACHE_HOSTS = [host.strip().lower() for host in os.getenv('ICON_CACHE_HOSTS', 'freepik.com,flaticon.com').split(',')
+                    if host.strip()]
+
+# Background generation jobs (app.jobs, run_generation_worker command)
+JOB_WORKER_POLL_INTERVAL = float(os.getenv('JOB_WORKER_POLL_INTERVAL', 1))
+# Seconds after which a running job is considered abandoned by its worker
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 60 * 10))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_CALLBACK_TIMEOUT = float(os.getenv('JOB_CALLBACK_TIMEOUT', 10))
+# Comma separated hosts callback_url may point at; empty allows any host with a public IP address
+JOB_CALLBACK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv('JOB_CALLBACK_ALLOWED_HOSTS', '').split(',')
+                              if host.strip()]
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -98,6 +206,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than the in-memory default, whose shared cache fails concurrent writers at
+        # once instead of waiting on the lock like the real database does
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -0,0 +1,295 @@
+import json
+import re
+
+import httpx
+import webcolors
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import IsAuthenticated, AllowAny
+
+from app.freepik import FreepikError, get_async_download_client
+from app.imaging import ImagePayload, ImageTooLarge
+from app.serializers import ProjectSerializer
+from app.utils import adescribe_image, afetch_icons, custom_error_message, find_closest_color, \
+    Color_Available_in_Filter, image_attributes, palette_color_source, remember_search
+from auth_app.token_auth import CustomTokenAuthentication
+
+FIGMA_KEY = settings.FIGMA_API_KEY
+FIGMA_CLIENT_ID = settings.FIGMA_CLIENT_ID
+REDIRECT_URL = settings.REDIRECT_URL
+FIGMA_OAUTH_URL = (f"https://www.figma.com/oauth?client_id={FIGMA_CLIENT_ID}&redirect_uri={REDIRECT_URL}"
+                   f"&scope=file_read&state=US&response_type=code")
+FIGMA_SCREEN_PATTERN = r'/design/([^/]+)/.*\?node-id=([^&]+)'
+
+
+class AsyncAPIView(View):
+    """
+    Async counterpart of rest_framework's APIView, which only supports sync handlers.
+
+    Handlers are coroutines that run on the ASGI event loop. Token authentication, permission
+    classes and request.data parsing follow APIView, and the handlers return JsonResponse.
+    """
+
+    authentication_classes = [CustomTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token authenticated API, exempt from CSRF like APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def authenticate(self, request):
+        for authentication_class in self.authentication_classes:
+            user_auth = authentication_class().authenticate(request)
+            if user_auth is not None:
+                return user_auth[0]
+        return AnonymousUser()
+
+    @staticmethod
+    def parse_data(request):
+        if request.content_type == 'application/json':
+            return json.loads(request.body or b'{}')
+        return request.POST
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user = await sync_to_async(self.authenticate)(request)
+        except AuthenticationFailed as e:
+            return JsonResponse(e.detail, status=status.HTTP_401_UNAUTHORIZED)
+
+        for permission_class in self.permission_classes:
+            if not permission_class().has_permission(request, self):
+                return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                                    status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            request.data = await sync_to_async(self.parse_data)(request)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+@sync_to_async
+def save_project(project_data, user):
+    project_serializer_obj = ProjectSerializer(data=project_data)
+    if project_serializer_obj.is_valid():
+        project_serializer_obj.save(user=user)
+        return project_serializer_obj.data, None
+    return project_serializer_obj.data, custom_error_message(project_serializer_obj.errors)
+
+
+async def icons_for_attributes(attributes, icon_color_name, icon_style, color_filter, style_filter):
+    f_icons_list, result, error = await afetch_icons(
+        color_filter, style_filter, palette_color_source(attributes), attributes['iconography'],
+        attributes['brand_style'], attributes['gradient_usage'], attributes['imagery'],
+        attributes['shadow_and_depth'], attributes['line_thickness'], attributes['corner_rounding'],
+        attributes['description'], icon_color_name, icon_style
+    )
+    # Same attributes as the sync pipeline, so refinements of these projects stay incremental
+    remember_search(attributes, result)
+    return f_icons_list, error
+
+
+def color_from_hex(icon_color_hex):
+    try:
+        color_name = webcolors.hex_to_name(icon_color_hex)
+        return Color_Available_in_Filter(color_name)
+    except ValueError:
+        return False, None
+
+
+async def download_image(url):
+    # Streamed, so an oversized body is abandoned while it arrives instead of being read whole
+    try:
+        async with get_async_download_client().client.stream('GET', url) as response:
+            if response.status_code != 200:
+                return None
+            return await ImagePayload.afrom_response(response)
+    except httpx.HTTPError:
+        return None
+
+
+class AsyncImageProcessView(AsyncAPIView):
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            image_file = request.FILES.get('image')
+            icon_color_hex, icon_color_name = request.data.get('icon_color'), None
+            icon_style = request.data.get('icon_style')
+            color_filter, style_filter = False, True if icon_style else False
+            if not image_file:
+                return JsonResponse({"error": "No image file provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+            attributes = image_attributes(await adescribe_image(ImagePayload.from_file(image_file)))
+
+            # Local match first; the optional LLM fallback is blocking, so it runs off the event loop
+            color_source = icon_color_hex or palette_color_source(attributes)
+            color_filter, icon_color_name = await sync_to_async(find_closest_color, thread_sensitive=False)(
+                color_source)
+
+            f_icons_list, error = await icons_for_attributes(attributes, icon_color_name, icon_style,
+                                                             color_filter, style_filter)
+            if error:
+                return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+            data, errors = await save_project({'attributes': attributes, 'f_icons': f_icons_list}, request.user)
+            if errors:
+                return JsonResponse(errors, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse(data, status=status.HTTP_200_OK)
+        except Exception as e:
+            print(str(e))
+            return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AsyncFigmaLinkProcessAPI(AsyncAPIView):
+    permission_classes = [AllowAny]
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            client = get_async_download_client()
+            image_data, image_url = None, None
+            figma_token = await request.session.aget('figma_token')
+            headers = {
+                'X-Figma-Token': FIGMA_KEY or figma_token
+            }
+
+            screen_link = request.data.get('screen_link')
+            figma_link = request.data.get('figma_link')
+            icon_color_hex, icon_color_name = request.data.get('icon_color'), None
+            icon_style = request.data.get('icon_style')
+            color_filter, style_filter = False, True if icon_style else False
+
+            if not (screen_link or figma_link):
+                return JsonResponse({"error": "No link provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+            if figma_link:
+                match = re.search(FIGMA_SCREEN_PATTERN, figma_link)
+                if match:
+                    figma_api_url = f'https://api.figma.com/v1/files/{match.group(1)}'
+                    response = await client.request('GET', figma_api_url, headers=headers)
+                    if response.status_code == 200:
+                        return JsonResponse({'figma_url': figma_api_url, 'figma_response': response.json()},
+                                            status=status.HTTP_200_OK)
+
+            if screen_link:
+                match = re.search(FIGMA_SCREEN_PATTERN, screen_link)
+                if not match:
+                    return JsonResponse({"error": "Invalid Figma link format. Please provide a valid link."},
+                                        status=status.HTTP_400_BAD_REQUEST)
+
+                file_key, node_id = match.group(1), match.group(2)
+                figma_api_url = f'https://api.figma.com/v1/images/{file_key}?ids={node_id}&format=png'
+                response = await client.request('GET', figma_api_url, headers=headers)
+                if response.status_code != 200:
+                    return JsonResponse({"error": "Invalid file key or node-id. Please provide a valid link."},
+                                        status=status.HTTP_400_BAD_REQUEST)
+
+                image_url = response.json()['images'][node_id.replace('-', ':')]
+                if image_url is None:
+                    return JsonResponse({
+                        "error": "The link appears to be private. Please authorize access to your Figma files.",
+                        "oauth_url": FIGMA_OAUTH_URL,
+                    }, status=status.HTTP_403_FORBIDDEN)
+                image_data = await download_image(image_url)
+
+            if image_data is None:
+                return JsonResponse({"error": "Failed to retrieve the image from the URL."},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+            attributes = image_attributes(await adescribe_image(image_data))
+            if icon_color_hex:
+                color_filter, icon_color_name = color_from_hex(icon_color_hex)
+
+            f_icons_list, error = await icons_for_attributes(attributes, icon_color_name, icon_style,
+                                                             color_filter, style_filter)
+            if error:
+                return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+            data, errors = await save_project(
+                {'attributes': attributes, 'f_icons': f_icons_list, 'screen_link': image_url}, request.user)
+            return JsonResponse(data, status=status.HTTP_200_OK)
+        except ImageTooLarge as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            print(str(e))
+            return JsonResponse({"error": "Internal Server Error"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncImageLinkProcessAPI(AsyncAPIView):
+    permission_classes = [AllowAny]
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            client = get_async_download_client()
+            image_data = None
+            image_url = request.data.get('screen_link')
+            icon_color_hex, icon_color_name = request.data.get('icon_color'), None
+            icon_style = request.data.get('icon_style')
+            color_filter, style_filter = False, True if icon_style else False
+            figma_access_token = request.data.get('figma_token')
+
+            if not image_url:
+                return JsonResponse({"error": "No URL provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+            is_figma_screen = re.search(FIGMA_SCREEN_PATTERN, image_url)
+            is_image = await self.is_image_url(image_url)
+            if not is_image and not is_figma_screen:
+                return JsonResponse({"error": "Invalid URL provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+            if is_figma_screen:
+                headers = {
+                    'Authorization': f"Bearer {figma_access_token}" if figma_access_token else f"X-Figma-Token {FIGMA_KEY}"
+                }
+                file_key, node_id = is_figma_screen.group(1), is_figma_screen.group(2)
+                figma_api_url = f'https://api.figma.com/v1/images/{file_key}?ids={node_id}&format=png'
+                response = await client.request('GET', figma_api_url, headers=headers)
+
+                if response.status_code == 403:
+                    return JsonResponse({
+                        "error": "The figma screen link is private. Please re-upload the screen link after authorizing access. If this still occurs after authorizing access, Make sure the screen owner has shared the screen with you or you are the owner of the screen.",
+                        "oauth_url": FIGMA_OAUTH_URL,
+                    }, status=status.HTTP_403_FORBIDDEN)
+
+                if response.status_code == 200:
+                    image_url = response.json()['images'][node_id.replace('-', ':')]
+                    image_data = await download_image(image_url)
+
+            if is_image:
+                image_data = await download_image(image_url)
+                if image_data is None:
+                    return JsonResponse({"error": "Failed to retrieve the image from the URL."},
+                                        status=status.HTTP_400_BAD_REQUEST)
+
+            if image_data is None:
+                return JsonResponse({"error": "Failed to retrieve the image from the URL."},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+            attributes = image_attributes(await adescribe_image(image_data))
+            if icon_color_hex:
+                color_filter, icon_color_name = color_from_hex(icon_color_hex)
+
+            f_icons_list, error = await icons_for_attributes(attributes, icon_color_name, icon_style,
+                                                             color_filter, style_filter)
+            if error:
+                return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+            data, errors = await save_project({'attributes': attributes, 'f_icons': f_icons_list}, request.user)
+            return JsonResponse(data, status=status.HTTP_200_OK)
+        except ImageTooLarge as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            print(str(e))
+            return JsonResponse({"error": "Internal Server Error"}, status=status.HTTP_400_BAD_REQUEST)
+
+    async def is_image_url(self, url: str) -> bool:
+        try:
+            # Send a HEAD request to the URL to fetch only the headers
+            response = await get_async_download_client().request('HEAD', url)
+            return 'image' in response.headers.get('Content-Type', '')
+        except FreepikError:
+            return False
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+
+def content_hash(*parts) -> str:
+    """
+    Build a stable sha256 digest over the given parts.
+
+    Args:
+        *parts: bytes or str values (e.g. image bytes and a prompt version).
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(part)
+        # Separator so ("ab", "c") and ("a", "bc") never collide
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class CacheBackend:
+    """
+    Base of the backends below. The async methods run the blocking ones in a worker thread, so
+    callers on the event loop never touch a database or the filesystem directly.
+
+    There is deliberately no clear(): a django cache alias is shared with other keys and can not
+    list this backend's, so entries are invalidated through their key (e.g. a prompt version) or
+    expire with their ttl.
+    """
+
+    async def aget(self, key):
+        return await sync_to_async(self.get, thread_sensitive=False)(key)
+
+    async def aset(self, key, value, ttl=None):
+        await sync_to_async(self.set, thread_sensitive=False)(key, value, ttl)
+
+    async def adelete(self, key):
+        await sync_to_async(self.delete, thread_sensitive=False)(key)
+
+
+class LocMemCacheBackend(CacheBackend):
+    """
+    In-process cache with TTL and LRU eviction. Entries are kept per worker process.
+    """
+
+    def __init__(self, ttl=None, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    # Nothing here blocks, so there is no point in a thread hop
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value, ttl=None):
+        self.set(key, value, ttl)
+
+    async def adelete(self, key):
+        self.delete(key)
+
+
+class DjangoCacheBackend(CacheBackend):
+    """
+    Delegates to one of the caches configured in settings.CACHES. Eviction is left to that backend.
+    """
+
+    def __init__(self, ttl=None, alias='default', key_prefix=''):
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._cache = caches[alias]
+
+    def _key(self, key):
+        return f"{self.key_prefix}{key}"
+
+    def get(self, key):
+        return self._cache.get(self._key(key))
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(self._key(key), value, timeout=self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        self._cache.delete(self._key(key))
+
+    async def aget(self, key):
+        return await self._cache.aget(self._key(key))
+
+    async def aset(self, key, value, ttl=None):
+        await self._cache.aset(self._key(key), value, timeout=self.ttl if ttl is None else ttl)
+
+    async def adelete(self, key):
+        await self._cache.adelete(self._key(key))
+
+
+class FileSystemCacheBackend(CacheBackend):
+    """
+    Stores one JSON file per key. The file mtime records the last access, which drives LRU eviction
+    once the directory holds more than max_entries files.
+    """
+
+    def __init__(self, directory, ttl=None, max_entries=1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        expires_at = entry.get('expires_at')
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            return None
+        self._touch(path)
+        return entry.get('value')
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        entry = {
+            'expires_at': time.time() + ttl if ttl else None,
+            'value': value,
+        }
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as fp:
+            json.dump(entry, fp)
+        os.replace(tmp_path, path)
+        self._touch(path)
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _touch(self, path):
+        # Explicit nanosecond timestamps; filesystem clocks are too coarse to order back-to-back accesses
+        now = time.time_ns()
+        try:
+            os.utime(path, ns=(now, now))
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.json'):
+                        try:
+                            entries.append((entry.stat().st_mtime_ns, entry.path))
+                        except OSError:
+                            continue
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+class NullCacheBackend(CacheBackend):
+    """
+    Disables caching while keeping the same interface.
+    """
+
+    def get(self, key):
+        return None
+
+    async def aget(self, key):
+        return None
+
+    async def aset(self, key, value, ttl=None):
+        pass
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+def get_cache_backend(backend, ttl=None, max_entries=1024, directory=None, alias='default', key_prefix=''):
+    """
+    Build a cache backend by name.
+
+    Args:
+        backend (str): One of "memory", "django", "filesystem" or "none".
+        ttl (int): Default time to live in seconds, None to never expire.
+        max_entries (int): LRU bound for the memory and filesystem backends.
+        directory (str): Storage directory for the filesystem backend.
+        alias (str): Entry of settings.CACHES used by the django backend.
+        key_prefix (str): Namespace for keys stored in a shared django cache.
+
+    Returns:
+        A backend exposing get, set and delete, and aget, aset and adelete for async code.
+    """
+    if backend == 'memory':
+        return LocMemCacheBackend(ttl=ttl, max_entries=max_entries)
+    if backend == 'django':
+        return DjangoCacheBackend(ttl=ttl, alias=alias, key_prefix=key_prefix)
+    if backend == 'filesystem':
+        return FileSystemCacheBackend(directory, ttl=ttl, max_entries=max_entries)
+    if backend in ('none', '', None):
+        return NullCacheBackend()
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,66 @@
+import threading
+
+
+class ChainRegistry:
+    """
+    Named LLM chains, each compiled once and shared by every request.
+
+    A builder registers under a name and runs on the first get(). Its prompt template,
+    structured-output schema and model binding are then reused for the life of the process.
+    Runnables are stateless, so one instance serves concurrent requests.
+    """
+
+    def __init__(self):
+        self._builders = {}
+        self._chains = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, builder=None):
+        """
+        Register a chain builder, as a call or as a decorator:
+
+            @chains.register('identify_query')
+            def build_identify_query_chain():
+                return prompt | structured_llm
+        """
+        def decorator(func):
+            if name in self._builders and self._builders[name] is not func:
+                raise ValueError(f"Chain '{name}' is already registered")
+            self._builders[name] = func
+            return func
+
+        return decorator(builder) if builder is not None else decorator
+
+    def get(self, name):
+        chain = self._chains.get(name)
+        if chain is None:
+            with self._lock:
+                chain = self._chains.get(name)
+                if chain is None:
+                    chain = self._chains[name] = self._builders[name]()
+        return chain
+
+    def build(self, name):
+        """
+        Run the builder without caching the result, e.g. to measure construction cost.
+        """
+        return self._builders[name]()
+
+    def warm_up(self):
+        for name in self.names():
+            self.get(name)
+
+    def reset(self, name=None):
+        with self._lock:
+            if name is None:
+                self._chains.clear()
+            else:
+                self._chains.pop(name, None)
+
+    def names(self):
+        return sorted(self._builders)
+
+
+chains = ChainRegistry()
+register_chain = chains.register
+get_chain = chains.get
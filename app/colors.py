@@ -0,0 +1,204 @@
+import re
+from functools import lru_cache
+
+import webcolors
+
+# Freepik color filters that are not a single hue; they can only be reached by name
+KEYWORD_COLORS = {
+    'gradient': 'gradient',
+    'gradients': 'gradient',
+    'multicolor': 'multicolor',
+    'multicolour': 'multicolor',
+    'multi-color': 'multicolor',
+    'rainbow': 'multicolor',
+    'colorful': 'multicolor',
+    'colourful': 'multicolor',
+    'solid-black': 'solid-black',
+    'solid black': 'solid-black',
+    'monochrome': 'solid-black',
+}
+
+# Common names that are not CSS colors or that Lab distance would place in the wrong bucket. Bare
+# tone words ("dark", "light") are left out: on their own they ask for a theme, not a color
+COLOR_SYNONYMS = {
+    'gold': 'yellow',
+    'golden': 'yellow',
+    'lemon': 'yellow',
+    'mustard': 'yellow',
+    'amber': 'orange',
+    'brown': 'orange',
+    'bronze': 'orange',
+    'copper': 'orange',
+    'peach': 'orange',
+    'rust': 'orange',
+    'pink': 'rose',
+    'magenta': 'rose',
+    'fuchsia': 'rose',
+    'blush': 'rose',
+    'crimson': 'red',
+    'scarlet': 'red',
+    'maroon': 'red',
+    'burgundy': 'red',
+    'wine': 'red',
+    'purple': 'violet',
+    'indigo': 'violet',
+    'lavender': 'violet',
+    'lilac': 'violet',
+    'plum': 'violet',
+    'mauve': 'violet',
+    'navy': 'blue',
+    'cobalt': 'blue',
+    'sapphire': 'blue',
+    'royal blue': 'blue',
+    'sky blue': 'azure',
+    'light blue': 'azure',
+    'baby blue': 'azure',
+    'teal': 'cyan',
+    'turquoise': 'cyan',
+    'aqua': 'cyan',
+    'lime': 'chartreuse',
+    'olive': 'green',
+    'emerald': 'green',
+    'forest green': 'green',
+    'mint': 'spring-green',
+    'spring green': 'spring-green',
+    'silver': 'gray',
+    'grey': 'gray',
+    'charcoal': 'gray',
+    'slate': 'gray',
+    'cream': 'white',
+    'ivory': 'white',
+    'off-white': 'white',
+    'beige': 'white',
+    'jet black': 'black',
+}
+
+# Reference colors per Freepik hue filter. Several points per bucket keep dark and pastel shades
+# from drifting into a neighbouring bucket.
+PALETTE_CENTROIDS = {
+    'red': [(255, 0, 0), (200, 30, 30), (139, 0, 0)],
+    'orange': [(255, 127, 0), (255, 165, 0), (210, 105, 30), (255, 127, 80)],
+    'yellow': [(255, 255, 0), (255, 215, 0), (240, 230, 140)],
+    'chartreuse': [(127, 255, 0), (154, 205, 50), (173, 255, 47)],
+    'green': [(0, 255, 0), (0, 128, 0), (34, 139, 34), (107, 142, 35)],
+    'spring-green': [(0, 255, 127), (60, 179, 113), (152, 251, 152)],
+    'cyan': [(0, 255, 255), (64, 224, 208), (0, 128, 128)],
+    'azure': [(0, 127, 255), (30, 144, 255), (135, 206, 235), (70, 130, 180)],
+    'blue': [(0, 0, 255), (0, 0, 128), (65, 105, 225), (25, 25, 112)],
+    'violet': [(127, 0, 255), (128, 0, 128), (238, 130, 238), (75, 0, 130)],
+    'rose': [(255, 0, 127), (255, 192, 203), (255, 105, 180), (255, 0, 255)],
+    'white': [(255, 255, 255), (245, 245, 245)],
+    'gray': [(128, 128, 128), (192, 192, 192), (90, 90, 90)],
+    'black': [(0, 0, 0), (35, 35, 35)],
+}
+
+HEX_PATTERN = re.compile(r'#([0-9a-f]{6}|[0-9a-f]{3})\b')
+# A whole value that is a hex code. Without the # it needs a digit, so words spelled with a-f only
+# ("facade", "decade") are not read as colors
+HEX_VALUE_PATTERN = re.compile(r'#[0-9a-f]{3}|#[0-9a-f]{6}|(?=[a-f]*[0-9])[0-9a-f]{6}')
+
+
+def _srgb_to_linear(channel):
+    channel = channel / 255
+    if channel <= 0.04045:
+        return channel / 12.92
+    return ((channel + 0.055) / 1.055) ** 2.4
+
+
+def rgb_to_lab(rgb):
+    """
+    Convert an sRGB triple (0-255) to CIELAB under a D65 white point.
+    """
+    r, g, b = (_srgb_to_linear(c) for c in rgb)
+    x = (r * 0.4124564 + g * 0.3575761 + b * 0.1804375) / 0.95047
+    y = (r * 0.2126729 + g * 0.7151522 + b * 0.0721750) / 1.00000
+    z = (r * 0.0193339 + g * 0.1191920 + b * 0.9503041) / 1.08883
+
+    def f(t):
+        return t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116
+
+    fx, fy, fz = f(x), f(y), f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def delta_e(lab1, lab2):
+    """CIE76 color difference."""
+    return ((lab1[0] - lab2[0]) ** 2 + (lab1[1] - lab2[1]) ** 2 + (lab1[2] - lab2[2]) ** 2) ** 0.5
+
+
+# Precomputed once at import: (Lab, filter name) for every reference color
+PALETTE_LAB = [
+    (rgb_to_lab(rgb), name)
+    for name, centroids in PALETTE_CENTROIDS.items()
+    for rgb in centroids
+]
+
+
+def match_rgb(rgb) -> str:
+    """
+    Map an sRGB triple onto the Freepik color filter with the smallest perceptual distance.
+    """
+    lab = rgb_to_lab(rgb)
+    return min(PALETTE_LAB, key=lambda item: delta_e(lab, item[0]))[1]
+
+
+def resolve_color_phrase(phrase):
+    """
+    Resolve a single color phrase ("navy", "sky blue", "solid black") to a Freepik color filter.
+    Unlike match_color the whole phrase has to name a color, so "red cow" resolves to None.
+    """
+    phrase = phrase.strip(" .-_'\"()")
+    if not phrase:
+        return None
+    if phrase in PALETTE_CENTROIDS:
+        return phrase
+    if phrase in KEYWORD_COLORS:
+        return KEYWORD_COLORS[phrase]
+    if phrase in COLOR_SYNONYMS:
+        return COLOR_SYNONYMS[phrase]
+    dashed = phrase.replace(' ', '-')
+    if dashed in PALETTE_CENTROIDS or dashed in KEYWORD_COLORS:
+        return KEYWORD_COLORS.get(dashed, dashed)
+    try:
+        return match_rgb(tuple(webcolors.name_to_rgb(phrase.replace(' ', '').replace('-', ''))))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def match_color(value: str):
+    """
+    Resolve a hex code, CSS color name or common color word to a Freepik color filter without any
+    network call.
+
+    Args:
+        value (str): e.g. "#1E90FF", "navy", "Dark Blue", "Blue, Yellow, White".
+
+    Returns:
+        str or None: The matching Freepik color filter, None if the input can not be resolved.
+    """
+    if not value:
+        return None
+    value = value.strip().lower()
+
+    if HEX_VALUE_PATTERN.fullmatch(value):
+        return match_rgb(tuple(webcolors.hex_to_rgb(f"#{value.lstrip('#')}")))
+
+    # Palettes come back as lists ("Blue, Yellow, White"); the first entry is the primary color
+    for candidate in re.split(r',|/|;|\band\b|\n', value):
+        candidate = candidate.strip()
+        if not candidate:
+            continue
+        hex_match = HEX_PATTERN.search(candidate)
+        if hex_match:
+            return match_rgb(tuple(webcolors.hex_to_rgb(f"#{hex_match.group(1)}")))
+        resolved = resolve_color_phrase(candidate)
+        if resolved:
+            return resolved
+        # Fall back to the trailing words, so "dark navy" resolves through "navy"
+        words = candidate.split()
+        for i in range(1, len(words)):
+            resolved = resolve_color_phrase(' '.join(words[i:]))
+            if resolved:
+                return resolved
+    return None
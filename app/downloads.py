@@ -0,0 +1,82 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+import requests
+from django.conf import settings
+
+from app.freepik import FreepikError
+from app.icon_cache import get_icon_cache
+from app.imaging import ImageTooLarge
+
+ON_ERROR_SKIP = 'skip'
+ON_ERROR_ABORT = 'abort'
+
+
+class IconDownloadError(Exception):
+    def __init__(self, icon_id, url, reason):
+        super().__init__(f"Failed to download {url}: {reason}")
+        self.icon_id = icon_id
+        self.url = url
+        self.reason = reason
+
+
+def download_icon_content(icon_id, url) -> bytes:
+    """
+    Download a single icon thumbnail, reading through the icon blob cache.
+
+    Raises:
+        requests.RequestException, FreepikError or ImageTooLarge: When the icon can not be downloaded.
+    """
+    # The thumbnail URL encodes its size and is part of the key, so a client-supplied URL can never
+    # overwrite the cached bytes of another asset with the same icon ID.
+    return get_icon_cache().fetch(icon_id, url, variant=f"thumbnail:{url}")
+
+
+def fetch_icons_concurrently(icons, max_workers=None, on_error=ON_ERROR_SKIP, failures=None):
+    """
+    Download icons in parallel and yield them as soon as each one arrives.
+
+    At most max_workers * 2 downloads are in flight or waiting to be consumed; the next one is only
+    submitted as a finished one is handed out, so memory follows the window, not the selection.
+
+    Args:
+        icons (list): dicts with 'id' and 'url'.
+        max_workers (int): Number of parallel downloads, settings.ICON_DOWNLOAD_WORKERS by default.
+        on_error (str): "skip" to leave failed icons out, "abort" to stop at the first failure.
+        failures (list): Optional list collecting an IconDownloadError for every skipped icon.
+
+    Yields:
+        tuple: (icon, bytes) in completion order.
+
+    Raises:
+        IconDownloadError: On the first failure when on_error is "abort".
+    """
+    max_workers = max_workers or settings.ICON_DOWNLOAD_WORKERS
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='icon_download')
+    remaining = iter(icons)
+
+    def submit(batch):
+        return {executor.submit(download_icon_content, icon['id'], icon['url']): icon for icon in batch}
+
+    try:
+        futures = submit(islice(remaining, max_workers * 2))
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                # Dropping the future releases its bytes once they have been handed out
+                icon = futures.pop(future)
+                futures.update(submit(islice(remaining, 1)))
+                try:
+                    content = future.result()
+                except (requests.RequestException, FreepikError, ImageTooLarge) as e:
+                    error = IconDownloadError(icon['id'], icon['url'], str(e))
+                    if on_error == ON_ERROR_ABORT:
+                        raise error
+                    print(f"Error while downloading icon {icon['id']}: {e}")
+                    if failures is not None:
+                        failures.append(error)
+                    continue
+                yield icon, content
+    finally:
+        # Pending downloads are pointless once the caller stopped consuming
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,614 @@
+import asyncio
+import json
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from app.cache import content_hash, get_cache_backend
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Largest per_page the /icons endpoint accepts
+MAX_PER_PAGE = 100
+
+
+class FreepikError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def decode_json(response):
+    """
+    Body of a requests or httpx response as JSON, raising FreepikError when it is not valid JSON.
+    """
+    try:
+        return response.json()
+    except ValueError as e:
+        raise FreepikError(f"Freepik API returned invalid JSON: {e}", response.status_code) from e
+
+
+@dataclass
+class FreepikIcon:
+    id: int
+    url: str
+    name: str = None
+    family_id: int = None
+
+    @classmethod
+    def from_json(cls, data):
+        thumbnails = data.get('thumbnails') or [{}]
+        return cls(
+            id=data.get('id'),
+            url=thumbnails[0].get('url', ''),
+            name=data.get('name'),
+            family_id=(data.get('family') or {}).get('id'),
+        )
+
+    def as_dict(self):
+        return {'id': self.id, 'url': self.url}
+
+
+@dataclass
+class IconSearchResult:
+    icons: list = field(default_factory=list)
+    total: int = 0
+    page: int = 1
+    per_page: int = 0
+
+    @classmethod
+    def from_json(cls, data):
+        pagination = (data.get('meta') or {}).get('pagination') or {}
+        return cls(
+            # Icons without thumbnails can not be shown or zipped, so they are dropped here
+            icons=[FreepikIcon.from_json(icon) for icon in data.get('data', []) if icon.get('thumbnails')],
+            total=pagination.get('total') or 0,
+            page=pagination.get('current_page') or 1,
+            per_page=pagination.get('per_page') or 0,
+        )
+
+    def as_cache_entry(self):
+        # Only the fields the app uses, so a cached page is a fraction of the API response
+        return asdict(self)
+
+    @classmethod
+    def from_cache_entry(cls, data):
+        return cls(**{**data, 'icons': [FreepikIcon(**icon) for icon in data['icons']]})
+
+
+def page_windows(target, max_per_page=MAX_PER_PAGE):
+    """
+    Split a target result count into pages that all share one per_page, so they never overlap.
+
+    The page size is the smallest one that still covers the target in the fewest requests, e.g.
+    150 icons are fetched as 2 pages of 75 rather than 100 + 50 (whose page 2 would repeat
+    icons 51-100 of the first page).
+
+    Args:
+        target (int): Number of results wanted.
+        max_per_page (int): Largest page size the API accepts.
+
+    Returns:
+        list: (page, per_page) tuples, page numbers starting at 1.
+    """
+    if target <= 0:
+        return []
+    pages = -(-target // max_per_page)
+    per_page = -(-target // pages)
+    return [(page, per_page) for page in range(1, pages + 1)]
+
+
+def last_page(total, per_page):
+    return -(-total // per_page)
+
+
+def merge_search_results(results, target=None) -> IconSearchResult:
+    """
+    Concatenate search pages in page order, dropping icons already seen and anything past target.
+    """
+    seen = set()
+    merged = IconSearchResult(total=max((result.total for result in results), default=0),
+                              per_page=sum(result.per_page for result in results))
+    for result in results:
+        for icon in result.icons:
+            if icon.id in seen:
+                continue
+            seen.add(icon.id)
+            merged.icons.append(icon)
+    if target is not None:
+        del merged.icons[target:]
+    return merged
+
+
+@dataclass
+class IconDetail:
+    id: int
+    related_style: list = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, data):
+        data = data.get('data', {})
+        related = data.get('related', {}).get('style', [])
+        return cls(id=data.get('id'), related_style=[FreepikIcon.from_json(icon) for icon in related])
+
+
+@dataclass
+class IconDownload:
+    filename: str
+    url: str
+
+
+class SearchResultCache:
+    """
+    Shared cache of /icons search results, keyed by the canonical query parameters.
+
+    Results younger than ttl are served as they are. Older ones are still served for stale_ttl
+    more seconds while a single background request refreshes them, so popular searches never wait
+    on Freepik. Storage is one of the app.cache backends; the memory backend is LRU bounded by
+    max_entries. Hit/miss counters are kept per process, see stats().
+    """
+
+    def __init__(self, backend, ttl, stale_ttl=0):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._refreshing = set()
+        self._refresh_tasks = set()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='freepik_refresh')
+
+    @staticmethod
+    def canonical_params(params):
+        """
+        Normalize a querystring so equivalent searches share an entry: keys are sorted, values are
+        strings, empty values are dropped and the term is lowercased with collapsed whitespace.
+        """
+        canonical = {}
+        for key, value in (params or {}).items():
+            if value is None or value == '':
+                continue
+            value = ' '.join(str(value).split())
+            if key == 'term' or key.startswith('filters['):
+                value = value.lower()
+            canonical[key] = value
+        return sorted(canonical.items())
+
+    def key(self, params):
+        return content_hash('icons', json.dumps(self.canonical_params(params)))
+
+    def total_key(self, params):
+        # Without page and per_page, so any page of a search tells how many results it has
+        return content_hash('icons-total', json.dumps([item for item in self.canonical_params(params)
+                                                       if item[0] not in ('page', 'per_page')]))
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['hits'] + stats['stale_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def lookup(self, key):
+        """
+        Returns:
+            tuple: (IconSearchResult or None, stale) - stale results should be refreshed.
+        """
+        return self._lookup_result(self.backend.get(key))
+
+    async def alookup(self, key):
+        """
+        Async variant of lookup; blocking backends are read off the event loop.
+        """
+        return self._lookup_result(await self.backend.aget(key))
+
+    def _lookup_result(self, entry):
+        if entry is None:
+            self._count('misses')
+            return None, False
+        stale = time.time() - entry['fetched_at'] >= self.ttl
+        self._count('stale_hits' if stale else 'hits')
+        return IconSearchResult.from_cache_entry(entry['result']), stale
+
+    def _entry(self, result):
+        return {'fetched_at': time.time(), 'result': result.as_cache_entry()}
+
+    def store(self, key, result):
+        # Kept past ttl for the stale window; the backend drops it after that
+        self.backend.set(key, self._entry(result), ttl=self.ttl + self.stale_ttl)
+
+    async def astore(self, key, result):
+        await self.backend.aset(key, self._entry(result), ttl=self.ttl + self.stale_ttl)
+
+    def known_total(self, params):
+        """
+        Result count of a search, remembered from any page of it fetched before, or None.
+        """
+        return self.backend.get(self.total_key(params))
+
+    async def aknown_total(self, params):
+        return await self.backend.aget(self.total_key(params))
+
+    def store_total(self, params, total):
+        self.backend.set(self.total_key(params), total, ttl=self.ttl + self.stale_ttl)
+
+    async def astore_total(self, params, total):
+        await self.backend.aset(self.total_key(params), total, ttl=self.ttl + self.stale_ttl)
+
+    def _claim_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _release_refresh(self, key, error=None):
+        with self._lock:
+            self._refreshing.discard(key)
+        if error is not None:
+            print("Freepik search refresh failed:", error)
+            self._count('refresh_errors')
+        else:
+            self._count('refreshes')
+
+    def refresh(self, key, params, fetch):
+        """
+        Re-fetch a stale entry on a background thread, at most once at a time per key. The result
+        count of the search is updated along with the page, since page windows are sized from it.
+        """
+        if not self._claim_refresh(key):
+            return
+
+        def run():
+            try:
+                result = fetch()
+                self.store(key, result)
+                self.store_total(params, result.total)
+            except Exception as e:
+                self._release_refresh(key, e)
+            else:
+                self._release_refresh(key)
+
+        self._executor.submit(run)
+
+    def arefresh(self, key, params, fetch):
+        """
+        Async variant of refresh; fetch is a coroutine function run as a task on the current loop.
+        """
+        if not self._claim_refresh(key):
+            return
+
+        async def run():
+            try:
+                result = await fetch()
+                await self.astore(key, result)
+                await self.astore_total(params, result.total)
+            except Exception as e:
+                self._release_refresh(key, e)
+            else:
+                self._release_refresh(key)
+
+        task = asyncio.get_running_loop().create_task(run())
+        # The loop only keeps weak references to tasks
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+
+class FreepikClient:
+    """
+    Thin client over the Freepik REST API.
+
+    A single pooled keep-alive session is shared by all threads. A semaphore bounds the number of
+    in-flight requests. Every call has a connect/read timeout, and 429/5xx responses are retried
+    with exponential backoff, honouring Retry-After when Freepik sends it. Icon searches go through
+    the optional SearchResultCache.
+    """
+
+    base_url = "https://api.freepik.com/v1"
+
+    def __init__(self, api_key, timeout=(5, 20), max_retries=3, backoff_factor=0.5,
+                 max_concurrency=10, pool_size=20, search_cache=None):
+        self.api_key = api_key
+        self.search_cache = search_cache
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), 30)
+        return self.backoff_factor * (2 ** attempt)
+
+    def request(self, method, url, headers=None, timeout=None, **kwargs) -> requests.Response:
+        """
+        Send a request through the shared session, retrying transient failures.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Absolute URL, or a path relative to the Freepik API.
+            headers (dict): Extra headers; the API key is added for Freepik API URLs.
+            timeout: Per-call timeout overriding the client default.
+
+        Returns:
+            requests.Response: The final response, which may still be a non-2xx status.
+
+        Raises:
+            FreepikError: When the request could not be completed after all retries.
+        """
+        if not url.startswith('http'):
+            url = f"{self.base_url}/{url.lstrip('/')}"
+        headers = dict(headers or {})
+        if self.api_key and url.startswith(self.base_url):
+            headers.setdefault('x-freepik-api-key', self.api_key)
+
+        attempt = 0
+        while True:
+            response, error = None, None
+            try:
+                with self._semaphore:
+                    response = self.session.request(method, url, headers=headers,
+                                                    timeout=timeout or self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except requests.RequestException as e:
+                # Redirect loops, broken chunked bodies, invalid URLs: retrying will not help
+                raise FreepikError(f"Freepik request failed: {e}") from e
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                return response
+            if attempt >= self.max_retries:
+                if response is not None:
+                    return response
+                raise FreepikError(f"Freepik request failed: {error}")
+            delay = self._backoff(attempt, response)
+            if response is not None:
+                # Hand the connection back to the pool before waiting
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def get_json(self, path, params=None, timeout=None):
+        response = self.request('GET', path, params=params, timeout=timeout)
+        if response.status_code != 200:
+            raise FreepikError(f"Freepik API returned {response.status_code}", response.status_code)
+        return decode_json(response)
+
+    def _search_icons(self, params, timeout=None) -> IconSearchResult:
+        return IconSearchResult.from_json(self.get_json('icons', params=params, timeout=timeout))
+
+    def search_icons(self, params, timeout=None) -> IconSearchResult:
+        if self.search_cache is None:
+            return self._search_icons(params, timeout)
+        key = self.search_cache.key(params)
+        result, stale = self.search_cache.lookup(key)
+        if result is not None:
+            if stale:
+                self.search_cache.refresh(key, params, partial(self._search_icons, params, timeout))
+            return result
+        result = self._search_icons(params, timeout)
+        self.search_cache.store(key, result)
+        self.search_cache.store_total(params, result.total)
+        return result
+
+    def known_total(self, params):
+        """
+        Result count of a search from an earlier page of it, None when unknown or uncached.
+        """
+        return self.search_cache.known_total(params) if self.search_cache is not None else None
+
+    def get_icon(self, icon_id, timeout=None) -> IconDetail:
+        return IconDetail.from_json(self.get_json(f'icons/{icon_id}', timeout=timeout))
+
+    def download_icon(self, icon_id, format='svg', timeout=None) -> IconDownload:
+        data = self.get_json(f'icons/{icon_id}/download', params={'format': format}, timeout=timeout)
+        return IconDownload(filename=data['filename'], url=data['url'])
+
+
+class AsyncFreepikClient:
+    """
+    asyncio counterpart of FreepikClient built on httpx, with the same timeouts, retry policy and
+    typed responses. Requests are awaited on the event loop instead of holding a worker thread.
+    """
+
+    base_url = FreepikClient.base_url
+
+    def __init__(self, api_key, timeout=(5, 20), max_retries=3, backoff_factor=0.5,
+                 max_concurrency=10, pool_size=20, search_cache=None):
+        self.api_key = api_key
+        self.search_cache = search_cache
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            follow_redirects=True,
+        )
+
+    _backoff = FreepikClient._backoff
+
+    async def request(self, method, url, headers=None, timeout=None, **kwargs) -> httpx.Response:
+        """
+        Send a request through the shared async client, retrying transient failures.
+
+        Raises:
+            FreepikError: When the request could not be completed after all retries.
+        """
+        if not url.startswith('http'):
+            url = f"{self.base_url}/{url.lstrip('/')}"
+        headers = dict(headers or {})
+        if self.api_key and url.startswith(self.base_url):
+            headers.setdefault('x-freepik-api-key', self.api_key)
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+        attempt = 0
+        while True:
+            response, error = None, None
+            try:
+                async with self._semaphore:
+                    response = await self.client.request(method, url, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            except httpx.HTTPError as e:
+                raise FreepikError(f"Freepik request failed: {e}") from e
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                return response
+            if attempt >= self.max_retries:
+                if response is not None:
+                    return response
+                raise FreepikError(f"Freepik request failed: {error}")
+            await asyncio.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    async def get_json(self, path, params=None, timeout=None):
+        response = await self.request('GET', path, params=params, timeout=timeout)
+        if response.status_code != 200:
+            raise FreepikError(f"Freepik API returned {response.status_code}", response.status_code)
+        return decode_json(response)
+
+    async def _search_icons(self, params, timeout=None) -> IconSearchResult:
+        return IconSearchResult.from_json(await self.get_json('icons', params=params, timeout=timeout))
+
+    async def search_icons(self, params, timeout=None) -> IconSearchResult:
+        if self.search_cache is None:
+            return await self._search_icons(params, timeout)
+        key = self.search_cache.key(params)
+        result, stale = await self.search_cache.alookup(key)
+        if result is not None:
+            if stale:
+                self.search_cache.arefresh(key, params, partial(self._search_icons, params, timeout))
+            return result
+        result = await self._search_icons(params, timeout)
+        await self.search_cache.astore(key, result)
+        await self.search_cache.astore_total(params, result.total)
+        return result
+
+    async def known_total(self, params):
+        return await self.search_cache.aknown_total(params) if self.search_cache is not None else None
+
+    async def get_icon(self, icon_id, timeout=None) -> IconDetail:
+        return IconDetail.from_json(await self.get_json(f'icons/{icon_id}', timeout=timeout))
+
+    async def download_icon(self, icon_id, format='svg', timeout=None) -> IconDownload:
+        data = await self.get_json(f'icons/{icon_id}/download', params={'format': format}, timeout=timeout)
+        return IconDownload(filename=data['filename'], url=data['url'])
+
+
+_client = None
+_client_lock = threading.Lock()
+_download_client = None
+_download_client_lock = threading.Lock()
+_search_cache = None
+_search_cache_lock = threading.Lock()
+# httpx async clients are bound to the event loop they were first used on
+_async_clients = weakref.WeakKeyDictionary()
+_async_download_clients = weakref.WeakKeyDictionary()
+
+
+def get_search_cache():
+    """
+    Return the process-wide SearchResultCache shared by the sync and async clients, or None when
+    FREEPIK_SEARCH_CACHE_BACKEND is "none".
+    """
+    global _search_cache
+    if _search_cache is None and settings.FREEPIK_SEARCH_CACHE_BACKEND not in ('none', ''):
+        with _search_cache_lock:
+            if _search_cache is None:
+                backend = get_cache_backend(
+                    settings.FREEPIK_SEARCH_CACHE_BACKEND,
+                    max_entries=settings.FREEPIK_SEARCH_CACHE_MAX_ENTRIES,
+                    directory=settings.FREEPIK_SEARCH_CACHE_DIR,
+                    alias=settings.VISION_CACHE_ALIAS,
+                    key_prefix='freepik_search:',
+                )
+                _search_cache = SearchResultCache(backend, settings.FREEPIK_SEARCH_CACHE_TTL,
+                                                  settings.FREEPIK_SEARCH_CACHE_STALE_TTL)
+    return _search_cache
+
+
+def _client_options():
+    return {
+        'timeout': (settings.FREEPIK_CONNECT_TIMEOUT, settings.FREEPIK_READ_TIMEOUT),
+        'max_retries': settings.FREEPIK_MAX_RETRIES,
+        'backoff_factor': settings.FREEPIK_BACKOFF_FACTOR,
+        'max_concurrency': settings.FREEPIK_MAX_CONCURRENCY,
+        'pool_size': settings.FREEPIK_POOL_SIZE,
+        'search_cache': get_search_cache(),
+    }
+
+
+def get_freepik_client() -> FreepikClient:
+    """
+    Return the process-wide FreepikClient, creating it from settings on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = FreepikClient(settings.FREE_PICK_API_KEY, **_client_options())
+    return _client
+
+
+def get_async_freepik_client() -> AsyncFreepikClient:
+    """
+    Return the AsyncFreepikClient of the running event loop, creating it on first use.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncFreepikClient(settings.FREE_PICK_API_KEY, **_client_options())
+    return client
+
+
+def _download_client_options():
+    return {
+        'timeout': (settings.FREEPIK_CONNECT_TIMEOUT, settings.ICON_DOWNLOAD_TIMEOUT),
+        'max_retries': settings.ICON_DOWNLOAD_MAX_RETRIES,
+        'backoff_factor': settings.FREEPIK_BACKOFF_FACTOR,
+        'max_concurrency': settings.ICON_DOWNLOAD_MAX_CONCURRENCY,
+        'pool_size': settings.ICON_DOWNLOAD_MAX_CONCURRENCY,
+    }
+
+
+def get_download_client() -> FreepikClient:
+    """
+    Return the process-wide client for icon assets and other hosts (CDN thumbnails and downloads,
+    Figma, user supplied links). It has its own connection pool, concurrency slots and retry budget
+    and no API key, so a large ZIP download never holds the slots of the API client and
+    third-party 429s are not retried against the Freepik API budget.
+    """
+    global _download_client
+    if _download_client is None:
+        with _download_client_lock:
+            if _download_client is None:
+                _download_client = FreepikClient(None, **_download_client_options())
+    return _download_client
+
+
+def get_async_download_client() -> AsyncFreepikClient:
+    """
+    Async counterpart of get_download_client for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_download_clients.get(loop)
+    if client is None:
+        client = _async_download_clients[loop] = AsyncFreepikClient(None, **_download_client_options())
+    return client
@@ -0,0 +1,209 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from app.freepik import get_download_client
+from app.imaging import ImagePayload
+
+
+def cacheable_host(url):
+    """
+    Whether url is on one of settings.ICON_CACHE_HOSTS (or a subdomain of one). Only assets from
+    those hosts are kept on disk; any other URL a client passes in is downloaded but not stored.
+    """
+    host = (urlsplit(url).hostname or '').lower()
+    return any(host == allowed or host.endswith(f".{allowed}") for allowed in settings.ICON_CACHE_HOSTS)
+
+
+def download(url, headers=None):
+    """
+    GET an icon asset with its body streamed and capped at settings.REMOTE_IMAGE_MAX_BYTES.
+
+    Returns:
+        tuple: (response, bytes); the bytes are None for a 304 to a conditional request.
+
+    Raises:
+        requests.HTTPError: For a non-2xx status other than 304.
+        ImageTooLarge: As soon as the body is over the cap.
+        requests.RequestException or FreepikError: When the download fails.
+    """
+    response = get_download_client().request('GET', url, headers=headers,
+                                             timeout=settings.ICON_DOWNLOAD_TIMEOUT, stream=True)
+    try:
+        if response.status_code == 304 and {'If-None-Match', 'If-Modified-Since'} & set(headers or {}):
+            return response, None
+        response.raise_for_status()
+        return response, bytes(ImagePayload.from_response(response).view)
+    finally:
+        response.close()
+
+
+class IconBlobCache:
+    """
+    Disk cache for icon bytes keyed by icon ID (or URL) and variant (format/size).
+
+    Blobs live in files next to a SQLite index that records their size, validators (ETag and
+    Last-Modified) and last access. Entries younger than max_age are served without any upstream
+    traffic; older ones are revalidated with a conditional GET, so an unchanged icon costs a 304
+    instead of a full download. The total size is bounded by evicting the least recently used blobs;
+    blobs over max_entry_fraction of it, and assets outside ICON_CACHE_HOSTS, are passed through
+    without being stored.
+    """
+
+    def __init__(self, directory, max_bytes, max_age, max_entry_fraction=0.01):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_entry_bytes = int(max_bytes * max_entry_fraction)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, 'index.sqlite3')
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS blobs ('
+                'key TEXT PRIMARY KEY, size INTEGER NOT NULL, etag TEXT, last_modified TEXT, '
+                'fetched_at REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self._index_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(identifier, variant=''):
+        return hashlib.sha256(f"{identifier}\x00{variant}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'rb') as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    def _write(self, key, content):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as fp:
+            fp.write(content)
+        os.replace(tmp_path, path)
+
+    def fetch(self, identifier, url, variant='', headers=None) -> bytes:
+        """
+        Return the icon bytes, reading through the cache.
+
+        Args:
+            identifier: Icon ID, or the URL itself when no ID is known.
+            url (str): Upstream URL of the asset.
+            variant (str): Format/size of the asset, e.g. "thumbnail" or "svg".
+            headers (dict): Extra upstream headers such as Authorization.
+
+        Raises:
+            requests.RequestException or FreepikError: When the upstream download fails and no
+            cached copy can be used.
+            ImageTooLarge: When the asset is over settings.REMOTE_IMAGE_MAX_BYTES.
+        """
+        if not cacheable_host(url):
+            return download(url, headers)[1]
+
+        key = self.make_key(identifier, variant)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT etag, last_modified, fetched_at FROM blobs WHERE key = ?', (key,)
+            ).fetchone()
+
+        cached = self._read(key) if row else None
+        if cached is not None and now - row[2] < self.max_age:
+            with self._connect() as conn:
+                conn.execute('UPDATE blobs SET last_access = ? WHERE key = ?', (now, key))
+            return cached
+
+        request_headers = dict(headers or {})
+        if cached is not None:
+            if row[0]:
+                request_headers['If-None-Match'] = row[0]
+            if row[1]:
+                request_headers['If-Modified-Since'] = row[1]
+
+        response, content = download(url, request_headers)
+        if content is None:
+            with self._connect() as conn:
+                conn.execute('UPDATE blobs SET fetched_at = ?, last_access = ? WHERE key = ?', (now, now, key))
+            return cached
+
+        if len(content) > self.max_entry_bytes:
+            # Storing it would evict a large share of the other entries for a single blob
+            return content
+        self._write(key, content)
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO blobs (key, size, etag, last_modified, fetched_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, len(content), response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now),
+            )
+        self._evict()
+        return content
+
+    def _evict(self):
+        with self._lock, self._connect() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for key, size in conn.execute('SELECT key, size FROM blobs ORDER BY last_access'):
+                if total <= self.max_bytes:
+                    break
+                evicted.append(key)
+                total -= size
+            conn.executemany('DELETE FROM blobs WHERE key = ?', [(key,) for key in evicted])
+        for key in evicted:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+class _UncachedIcons:
+    """
+    Stand-in used when ICON_CACHE_ENABLED is off; always downloads.
+    """
+
+    def fetch(self, identifier, url, variant='', headers=None) -> bytes:
+        return download(url, headers)[1]
+
+
+_icon_cache = None
+_icon_cache_lock = threading.Lock()
+
+
+def get_icon_cache():
+    """
+    Return the process-wide icon cache, creating it from settings on first use.
+    """
+    global _icon_cache
+    if _icon_cache is None:
+        with _icon_cache_lock:
+            if _icon_cache is None:
+                if settings.ICON_CACHE_ENABLED:
+                    _icon_cache = IconBlobCache(settings.ICON_CACHE_DIR, settings.ICON_CACHE_MAX_BYTES,
+                                                settings.ICON_CACHE_MAX_AGE, settings.ICON_CACHE_MAX_ENTRY_FRACTION)
+                else:
+                    _icon_cache = _UncachedIcons()
+    return _icon_cache
@@ -0,0 +1,326 @@
+import binascii
+import hashlib
+import io
+import mmap
+from dataclasses import dataclass
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Formats the vision API accepts as data URLs
+SUPPORTED_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+}
+
+# Images whose long edge fits in one low detail tile gain nothing from high detail
+LOW_DETAIL_MAX_EDGE = 512
+# Size limits the vision model applies to high detail images on its side
+MODEL_MAX_EDGE = 2048
+MODEL_SHORT_EDGE = 768
+
+READ_CHUNK_SIZE = 64 * 1024
+# Multiple of 3, so every chunk encodes to base64 without padding
+ENCODE_CHUNK_SIZE = 3 * 64 * 1024
+
+
+class _MemoryReader(io.RawIOBase):
+    """
+    Seekable read-only file over a memoryview; unlike BytesIO it does not copy the buffer.
+    """
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = max(0, min(len(buffer), len(self._view) - self._pos))
+        buffer[:size] = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class ImageTooLarge(ValueError):
+    def __init__(self, max_bytes):
+        super().__init__(f"Image is larger than {max_bytes // (1024 * 1024)} MB")
+        self.max_bytes = max_bytes
+
+
+def content_length(response):
+    size = response.headers.get('Content-Length')
+    return int(size) if size and size.isdigit() else None
+
+
+class _BodyBuffer:
+    """
+    Buffer a body arrives into chunk by chunk. The size hint comes from the sender, so it never
+    reserves more than max_bytes, and the body is abandoned as soon as it grows past max_bytes.
+    """
+
+    def __init__(self, size=None, max_bytes=None):
+        if max_bytes and size and size > max_bytes:
+            raise ImageTooLarge(max_bytes)
+        self.max_bytes = max_bytes
+        self.buffer = bytearray(size or 0)
+        self.position = 0
+
+    def write(self, chunk):
+        end = self.position + len(chunk)
+        if self.max_bytes and end > self.max_bytes:
+            raise ImageTooLarge(self.max_bytes)
+        # Grows the buffer when the size hint was short (e.g. a compressed Content-Length)
+        self.buffer[self.position:end] = chunk
+        self.position = end
+
+    def getvalue(self):
+        del self.buffer[self.position:]
+        return self.buffer
+
+
+class ImagePayload:
+    """
+    Image bytes held once for the whole request.
+
+    Uploads are used in place (see from_file) and downloads are read in chunks into one
+    preallocated buffer. Every consumer (Pillow, the cache key, the data URL) works on a memoryview
+    of it. The base64 data URL is encoded chunk by chunk straight into its final buffer, so no
+    intermediate base64 bytes or formatted copies of the payload are made.
+    """
+
+    def __init__(self, data=b''):
+        self._buffer = data
+        self.view = memoryview(data).cast('B')
+
+    @classmethod
+    def from_file(cls, file_obj, chunk_size=READ_CHUNK_SIZE):
+        """
+        Wrap a Django File/UploadedFile or any binary file object.
+
+        In-memory uploads share their BytesIO bytes and uploads spooled to disk are memory mapped,
+        so neither is copied onto the heap. Other file objects are read in chunks.
+        """
+        raw = file_obj
+        while not isinstance(raw, io.BytesIO) and hasattr(raw, 'file'):
+            raw = raw.file
+        if isinstance(raw, io.BytesIO):
+            # getvalue shares the BytesIO's bytes object; unlike getbuffer it does not pin the upload open
+            return cls(raw.getvalue())
+        try:
+            return cls(mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ))
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            # No real file descriptor, or an empty file which can not be mapped
+            pass
+
+        if hasattr(file_obj, 'chunks'):
+            chunks = file_obj.chunks(chunk_size)
+        else:
+            chunks = iter(partial(file_obj.read, chunk_size), b'')
+        return cls._collect(chunks, getattr(file_obj, 'size', None))
+
+    @classmethod
+    def from_response(cls, response, chunk_size=READ_CHUNK_SIZE, max_bytes=None):
+        """
+        Read a requests response body, ideally one requested with stream=True.
+
+        Args:
+            max_bytes (int): Largest body accepted, settings.REMOTE_IMAGE_MAX_BYTES by default.
+
+        Raises:
+            ImageTooLarge: As soon as the body, or its Content-Length, is over max_bytes. The
+                response is closed without reading the rest.
+        """
+        try:
+            return cls._collect(response.iter_content(chunk_size), content_length(response),
+                                max_bytes or settings.REMOTE_IMAGE_MAX_BYTES)
+        except ImageTooLarge:
+            response.close()
+            raise
+
+    @classmethod
+    async def afrom_response(cls, response, max_bytes=None):
+        """
+        Async variant of from_response for an httpx response opened with client.stream().
+        """
+        body = _BodyBuffer(content_length(response), max_bytes or settings.REMOTE_IMAGE_MAX_BYTES)
+        async for chunk in response.aiter_bytes(READ_CHUNK_SIZE):
+            body.write(chunk)
+        return cls(body.getvalue())
+
+    @classmethod
+    def wrap(cls, data):
+        return data if isinstance(data, cls) else cls(data)
+
+    @classmethod
+    def _collect(cls, chunks, size=None, max_bytes=None):
+        body = _BodyBuffer(size, max_bytes)
+        for chunk in chunks:
+            body.write(chunk)
+        return cls(body.getvalue())
+
+    @property
+    def nbytes(self):
+        return self.view.nbytes
+
+    def open(self):
+        return io.BufferedReader(_MemoryReader(self.view))
+
+    def digest(self):
+        return hashlib.sha256(self.view).hexdigest()
+
+    def data_url(self, mime_type='image/jpeg'):
+        """
+        Build the "data:<mime>;base64,..." URL with a single full-size allocation for the encoding.
+        """
+        prefix = f"data:{mime_type};base64,".encode('ascii')
+        encoded = bytearray(len(prefix) + 4 * ((self.nbytes + 2) // 3))
+        encoded[:len(prefix)] = prefix
+        position = len(prefix)
+        for start in range(0, self.nbytes, ENCODE_CHUNK_SIZE):
+            chunk = binascii.b2a_base64(self.view[start:start + ENCODE_CHUNK_SIZE], newline=False)
+            encoded[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        return encoded.decode('ascii')
+
+
+@dataclass
+class PreparedImage:
+    payload: ImagePayload
+    mime_type: str
+    detail: str
+    width: int
+    height: int
+    bytes_in: int
+
+    @property
+    def bytes_out(self):
+        return self.payload.nbytes
+
+    @property
+    def bytes_saved(self):
+        return self.bytes_in - self.bytes_out
+
+    def data_url(self):
+        return self.payload.data_url(self.mime_type)
+
+    def stats(self):
+        return {
+            'width': self.width,
+            'height': self.height,
+            'mime_type': self.mime_type,
+            'detail': self.detail,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_saved,
+        }
+
+
+def target_size(width, height, max_edge, short_edge):
+    """
+    Scale (width, height) down so the long edge fits max_edge and the short edge fits short_edge.
+    The vision model downsamples high detail images the same way, so nothing it would see is lost.
+    """
+    scale = min(1.0, max_edge / max(width, height), short_edge / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def choose_detail(width, height, detail=None):
+    detail = detail or settings.VISION_IMAGE_DETAIL
+    if detail != 'auto':
+        return detail
+    return 'low' if max(width, height) <= LOW_DETAIL_MAX_EDGE else 'high'
+
+
+def prepare_image(data, max_edge=None, short_edge=None, image_format=None, quality=None,
+                  detail=None) -> PreparedImage:
+    """
+    Downscale and re-encode an image before it is sent to the vision model.
+
+    The image is rotated according to its EXIF orientation, resized, flattened onto white when it
+    has transparency and re-encoded, which also drops EXIF/ICC/text metadata. The original bytes
+    are kept when they are in a supported format, are no larger than the re-encoded image and would
+    be downscaled by the model to the same size anyway.
+
+    Args:
+        data (ImagePayload or bytes): The uploaded image.
+        max_edge (int): Long edge limit, settings.VISION_IMAGE_MAX_EDGE by default.
+        short_edge (int): Short edge limit, settings.VISION_IMAGE_SHORT_EDGE by default.
+        image_format (str): Pillow format to encode to, or "auto" for the smaller of JPEG and PNG.
+            settings.VISION_IMAGE_FORMAT by default.
+        quality (int): Encoder quality for lossy formats, settings.VISION_IMAGE_QUALITY by default.
+        detail (str): "low", "high" or "auto" to pick from the final size.
+
+    Returns:
+        PreparedImage: Encoded bytes with their MIME type, detail level and size stats.
+    """
+    max_edge = max_edge or settings.VISION_IMAGE_MAX_EDGE
+    short_edge = short_edge or settings.VISION_IMAGE_SHORT_EDGE
+    image_format = (image_format or settings.VISION_IMAGE_FORMAT).upper()
+    quality = quality or settings.VISION_IMAGE_QUALITY
+
+    payload = ImagePayload.wrap(data)
+    try:
+        image = Image.open(payload.open())
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        # Not something Pillow can decode; hand it over untouched as before
+        return PreparedImage(payload, 'image/jpeg', detail or settings.VISION_IMAGE_DETAIL, 0, 0, payload.nbytes)
+
+    source_mime = SUPPORTED_MIME_TYPES.get(image.format)
+    # EXIF orientation only survives in the original bytes, so a rotated image is always re-encoded
+    oriented = image.getexif().get(0x0112, 1) == 1
+    image = ImageOps.exif_transpose(image)
+    width, height = target_size(image.width, image.height, max_edge, short_edge)
+    # The model would shrink the original to the same size, so sending it costs the same tokens
+    model_equivalent = (width, height) == target_size(image.width, image.height, MODEL_MAX_EDGE, MODEL_SHORT_EDGE)
+    if (width, height) != image.size:
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if has_alpha:
+        # Flattened so every format, JPEG included, encodes the same picture
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    # Photos compress best as JPEG, flat UI screenshots as PNG; "AUTO" keeps the smaller one
+    formats = ('JPEG', 'PNG') if image_format == 'AUTO' else (image_format,)
+    encoded, encoded_format = None, None
+    for candidate in formats:
+        output = BytesIO()
+        if candidate == 'PNG':
+            image.save(output, format='PNG', optimize=True)
+        else:
+            image.save(output, format=candidate, quality=quality, optimize=True)
+        if encoded is None or output.tell() < encoded.nbytes:
+            # getbuffer exposes the encoder output without copying it
+            encoded, encoded_format = ImagePayload(output.getbuffer()), candidate
+
+    if oriented and model_equivalent and source_mime and encoded.nbytes >= payload.nbytes:
+        return PreparedImage(payload, source_mime, choose_detail(width, height, detail), width, height,
+                             payload.nbytes)
+    return PreparedImage(encoded, SUPPORTED_MIME_TYPES.get(encoded_format, 'image/jpeg'),
+                         choose_detail(width, height, detail), width, height, payload.nbytes)
@@ -0,0 +1,175 @@
+import ipaddress
+import socket
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from app.imaging import ImagePayload
+from app.models import GenerationJob
+from app.pipeline import generate_project
+from app.serializers import GenerationJobSerializer
+
+
+class InvalidCallbackURL(ValueError):
+    pass
+
+
+def validate_callback_url(url):
+    """
+    Check that a job callback can not be aimed at the server's own network.
+
+    The URL must be http(s). Its host must be in settings.JOB_CALLBACK_ALLOWED_HOSTS when that is
+    set, and every address it resolves to must be public: loopback, private, link-local, reserved
+    and multicast targets are refused.
+
+    Raises:
+        InvalidCallbackURL: When the URL is not allowed.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if parts.scheme not in ('http', 'https') or not host:
+        raise InvalidCallbackURL("callback_url must be an http(s) URL")
+    if settings.JOB_CALLBACK_ALLOWED_HOSTS and host not in settings.JOB_CALLBACK_ALLOWED_HOSTS:
+        raise InvalidCallbackURL("callback_url host is not allowed")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError) as e:
+        raise InvalidCallbackURL(f"callback_url host can not be resolved: {e}")
+    for address in addresses:
+        # Scoped IPv6 addresses carry a %interface suffix
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            raise InvalidCallbackURL("callback_url must not point at a private or local address")
+
+
+def enqueue_generation_job(user, image_file, icon_color=None, icon_style=None, callback_url='', idempotency_key=''):
+    """
+    Queue an icon generation job for the user.
+
+    Args:
+        user: Owner of the job and of the resulting project.
+        image_file: Uploaded image.
+        icon_color (str): Optional icon color hex.
+        icon_style (str): Optional Freepik icon style.
+        callback_url (str): Optional URL that receives the job as JSON once it finishes.
+        idempotency_key (str): Optional client key; retries with the same key return the first job.
+
+    Returns:
+        tuple: (job, created). created is False when the idempotency key matched an existing job.
+    """
+    if idempotency_key:
+        job = GenerationJob.objects.filter(user=user, idempotency_key=idempotency_key).first()
+        if job:
+            return job, False
+
+    job = GenerationJob(user=user, idempotency_key=idempotency_key or '', icon_color=icon_color or '',
+                        icon_style=icon_style or '', callback_url=callback_url or '')
+    job.image.save(f"{job.id}", image_file, save=False)
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        # A concurrent retry with the same key won the race
+        job.image.delete(save=False)
+        return GenerationJob.objects.get(user=user, idempotency_key=idempotency_key), False
+    return job, True
+
+
+def claim_next_job():
+    """
+    Claim the oldest pending job for this worker.
+
+    The claim is a conditional UPDATE, so when several workers pick the same candidate only one of
+    them flips it from pending to running.
+
+    Returns:
+        GenerationJob or None when the queue is empty.
+    """
+    while True:
+        job_id = GenerationJob.objects.filter(status=GenerationJob.STATUS_PENDING).values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        claimed = GenerationJob.objects.filter(id=job_id, status=GenerationJob.STATUS_PENDING).update(
+            status=GenerationJob.STATUS_RUNNING, locked_at=timezone.now(), attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return GenerationJob.objects.select_related('user').get(id=job_id)
+
+
+def requeue_stale_jobs():
+    """
+    Put running jobs whose worker died back in the queue, or fail them after JOB_MAX_ATTEMPTS.
+
+    Returns:
+        int: Number of jobs requeued or failed.
+    """
+    stale = GenerationJob.objects.filter(
+        status=GenerationJob.STATUS_RUNNING,
+        locked_at__lt=timezone.now() - timedelta(seconds=settings.JOB_STALE_AFTER),
+    )
+    expired = list(stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).values_list('id', flat=True))
+    failed = stale.filter(id__in=expired).update(
+        status=GenerationJob.STATUS_FAILED, error={'error': 'Job timed out'}, finished_at=timezone.now(),
+    )
+    requeued = stale.update(status=GenerationJob.STATUS_PENDING, locked_at=None)
+
+    # Clients waiting on a callback are told about the timeout like about any other failure
+    timed_out = GenerationJob.objects.filter(id__in=expired, status=GenerationJob.STATUS_FAILED,
+                                             callback_status__isnull=True).exclude(callback_url='')
+    for job in timed_out:
+        send_callback(job)
+    return failed + requeued
+
+
+def run_job(job):
+    """
+    Run the generation pipeline for a claimed job, store the outcome and fire its callback.
+    """
+    try:
+        with job.image.open('rb') as image_file:
+            image = ImagePayload.from_file(image_file)
+        data, error = generate_project(image, job.user, job.icon_color or None, job.icon_style or None)
+    except Exception as e:
+        print(f"Job {job.id} failed: {e}")
+        data, error = None, {'error': str(e)}
+
+    job.status = GenerationJob.STATUS_FAILED if error else GenerationJob.STATUS_SUCCEEDED
+    job.result, job.error = data, error
+    job.project_id = data['id'] if data else None
+    job.finished_at = timezone.now()
+    # The upload is only needed to run the pipeline
+    job.image.delete(save=False)
+    job.save(update_fields=['status', 'result', 'error', 'project', 'finished_at', 'image', 'updated_at'])
+
+    if job.callback_url:
+        send_callback(job)
+    return job
+
+
+def send_callback(job):
+    """
+    POST the job status to its callback URL. Delivery is best effort; the response status is kept on
+    the job and clients can always fall back to polling.
+
+    The URL is validated again right before sending, since its DNS may have changed since the job
+    was queued, and redirects are not followed.
+    """
+    try:
+        validate_callback_url(job.callback_url)
+        response = requests.post(job.callback_url, data=JSONRenderer().render(GenerationJobSerializer(job).data),
+                                 headers={'Content-Type': 'application/json'}, timeout=settings.JOB_CALLBACK_TIMEOUT,
+                                 allow_redirects=False)
+        job.callback_status = response.status_code
+    except InvalidCallbackURL as e:
+        print(f"Callback for job {job.id} refused: {e}")
+        job.callback_status = 0
+    except requests.RequestException as e:
+        print(f"Callback for job {job.id} failed: {e}")
+        job.callback_status = 0
+    job.save(update_fields=['callback_status'])
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+# Importing the modules registers their chains
+import app.utils  # noqa: F401
+import query.utils  # noqa: F401
+from app.chains import chains
+
+
+def per_call(name, iterations):
+    # Previous request path: every call built its prompt, schema and structured-output binding
+    started = time.perf_counter()
+    for _ in range(iterations):
+        chains.build(name)
+    return time.perf_counter() - started
+
+
+def registry(name, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        chains.get(name)
+    return time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = "Compare building each LLM chain per request with the shared chain registry. No model is called."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--chain', action='append', dest='names',
+                            help="Chain to measure, all registered chains by default. Repeatable.")
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        names = options['names'] or chains.names()
+        chains.reset()
+
+        started = time.perf_counter()
+        chains.warm_up()
+        self.stdout.write(f"Warm up of {len(chains.names())} chains: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        for name in names:
+            built = per_call(name, iterations)
+            cached = registry(name, iterations)
+            self.stdout.write(f"{name:>16}: per call {built / iterations * 1e6:9.1f} us, "
+                              f"registry {cached / iterations * 1e6:6.2f} us, "
+                              f"{built / max(cached, 1e-9):,.0f}x faster")
@@ -0,0 +1,59 @@
+import base64
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from app.cache import content_hash
+from app.imaging import ImagePayload
+
+
+def legacy_flow(file_obj):
+    # Previous upload path: read, base64 encode, hash the base64 text, format the data URL
+    image_data = file_obj.read()
+    image_base64 = base64.b64encode(image_data).decode('utf-8')
+    cache_key = content_hash(image_base64)
+    return cache_key, f"data:image/jpeg;base64,{image_base64}"
+
+
+def payload_flow(file_obj):
+    image = ImagePayload.from_file(file_obj)
+    cache_key = content_hash(image.view)
+    return cache_key, image.data_url('image/jpeg')
+
+
+class Command(BaseCommand):
+    help = "Compare the peak memory of the legacy base64 upload path with ImagePayload."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=float, default=8, help="Size of the synthetic upload.")
+        parser.add_argument('--runs', type=int, default=3)
+
+    def handle(self, *args, **options):
+        size = int(options['size_mb'] * 1024 * 1024)
+        with tempfile.NamedTemporaryFile() as upload:
+            upload.write(os.urandom(size))
+            upload.flush()
+
+            results = {}
+            for name, flow in (('legacy', legacy_flow), ('payload', payload_flow)):
+                peaks, durations = [], []
+                for _ in range(options['runs']):
+                    upload.seek(0)
+                    file_obj = File(upload)
+                    tracemalloc.start()
+                    started = time.perf_counter()
+                    output = flow(file_obj)
+                    durations.append(time.perf_counter() - started)
+                    peaks.append(tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+                    del output
+                results[name] = (min(peaks), min(durations))
+                self.stdout.write(f"{name:>8}: peak {min(peaks) / size:.2f}x upload "
+                                  f"({min(peaks) / 1024 / 1024:.1f} MiB), {min(durations) * 1000:.1f} ms")
+
+        self.stdout.write(f"Peak memory reduced {results['legacy'][0] / results['payload'][0]:.2f}x "
+                          f"for a {options['size_mb']} MiB upload")
@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from app.models import Project
+from app.retention import delete_orphan_result_sets, excess_history
+
+
+class Command(BaseCommand):
+    help = ("Trim existing project history to the newest versions. Projects are handled in small "
+            "batches, each in its own short transaction, so the database is never locked for long.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=settings.PROJECT_HISTORY_MAX_VERSIONS,
+                            help="Versions kept per project.")
+        parser.add_argument('--batch-size', type=int, default=200, help="Projects per delete.")
+        parser.add_argument('--sleep', type=float, default=0.05,
+                            help="Seconds to pause between batches so other writers get the lock.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted.")
+
+    def handle(self, *args, **options):
+        history_model = Project.history.model
+        keep, batch_size = max(options['keep'], 1), options['batch_size']
+        project_ids = list(
+            history_model.objects.values('id').annotate(versions=Count('history_id'))
+            .filter(versions__gt=keep).order_by('id').values_list('id', flat=True)
+        )
+        self.stdout.write(f"{len(project_ids)} projects have more than {keep} versions")
+
+        deleted = 0
+        started = time.perf_counter()
+        for start in range(0, len(project_ids), batch_size):
+            batch = project_ids[start:start + batch_size]
+            excess = excess_history(history_model, batch, keep)
+            if options['dry_run']:
+                deleted += excess.count()
+                continue
+            with transaction.atomic():
+                # Materialized first: some databases can not delete from a table they select from
+                history_ids = list(excess.values_list('history_id', flat=True))
+                batch_deleted = history_model.objects.filter(history_id__in=history_ids).delete()[0]
+            deleted += batch_deleted
+            self.stdout.write(f"Batch {start // batch_size + 1}: {len(batch)} projects, {batch_deleted} records deleted")
+            time.sleep(options['sleep'])
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(f"{verb} {deleted} historical records in {time.perf_counter() - started:.2f}s")
+
+        if not options['dry_run']:
+            with transaction.atomic():
+                orphans = delete_orphan_result_sets()
+            self.stdout.write(f"Deleted {orphans} icon result sets no version points at")
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.models import IconResultSet, Project
+
+
+class Command(BaseCommand):
+    help = ("Move the f_icons lists of existing projects and historical versions into icon result sets. "
+            "Versions of a project with the same icons end up sharing one set.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Rows per transaction.")
+        parser.add_argument('--sleep', type=float, default=0.05,
+                            help="Seconds to pause between batches so other writers get the lock.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        for model, pk_name in ((Project, 'id'), (Project.history.model, 'history_id')):
+            moved = 0
+            while True:
+                # Rows leave the filter once they are moved, so every batch starts from the top
+                batch = list(model.objects.filter(icon_result_set__isnull=True).exclude(f_icons=[])
+                             .order_by(pk_name).values_list(pk_name, 'id', 'f_icons')[:options['batch_size']])
+                if not batch:
+                    break
+                # History outlives projects deleted by retention; their sets belong to no project
+                live = set(Project.objects.filter(pk__in={row[1] for row in batch}).values_list('pk', flat=True))
+                with transaction.atomic():
+                    for pk, project_id, icons in batch:
+                        result_set = IconResultSet.for_icons(project_id if project_id in live else None, icons or [])
+                        # update() skips save(), so no retention, history or timestamps are touched
+                        model.objects.filter(**{pk_name: pk}).update(icon_result_set=result_set, f_icons=[])
+                moved += len(batch)
+                time.sleep(options['sleep'])
+            self.stdout.write(f"{model.__name__}: moved {moved} icon lists")
+        self.stdout.write(f"Done in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.jobs import claim_next_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Process queued icon generation jobs. Run several instances to scale out."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+        parser.add_argument('--poll-interval', type=float, default=settings.JOB_WORKER_POLL_INTERVAL,
+                            help="Seconds to sleep when the queue is empty.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Generation worker started")
+        while True:
+            stale = requeue_stale_jobs()
+            if stale:
+                self.stdout.write(f"Recovered {stale} stale job(s)")
+
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            started = time.perf_counter()
+            job = run_job(job)
+            self.stdout.write(f"Job {job.id} {job.status} in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,80 @@
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from app.models import Project
+from app.retention import RetentionPolicy
+
+
+class Command(BaseCommand):
+    help = ("Create projects for one user from many threads at once and check that retention never "
+            "overshoots the cap, deletes twice or hands out a project name twice.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--projects', type=int, default=10, help="Projects created per thread.")
+        parser.add_argument('--keep', action='store_true', help="Keep the stress user and its projects.")
+
+    def handle(self, *args, **options):
+        policy = RetentionPolicy.from_settings()
+        if policy.max_count is None:
+            raise CommandError("PROJECT_RETENTION_MAX_COUNT is off; there is no cap to check")
+
+        user = get_user_model().objects.create(username=f"retention-stress-{uuid.uuid4().hex[:12]}",
+                                               email=f"{uuid.uuid4().hex[:12]}@retention-stress.local")
+        start = threading.Barrier(options['threads'])
+        errors, names, observed = [], Counter(), []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(options['projects']):
+                    project = Project(user=user, attributes={'stress': True})
+                    project.save()
+                    count = Project.objects.filter(user=user).count()
+                    with lock:
+                        names[project.name] += 1
+                        observed.append(count)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        remaining = Project.objects.filter(user=user).count()
+        duplicates = [name for name, seen in names.items() if seen > 1]
+        saves = sum(names.values())
+        self.stdout.write(f"{saves} saves from {options['threads']} threads in {elapsed:.2f}s "
+                          f"({saves / elapsed:.0f}/s)")
+        self.stdout.write(f"Projects left: {remaining} (cap {policy.max_count}), "
+                          f"max observed: {max(observed, default=0)}")
+
+        if not options['keep']:
+            Project.objects.filter(user=user).delete()
+            user.delete()
+
+        problems = []
+        if errors:
+            problems.append(f"{len(errors)} failed saves, e.g. {errors[0]}")
+        if remaining > policy.max_count or max(observed, default=0) > policy.max_count:
+            problems.append("the project cap was overshot")
+        if duplicates:
+            problems.append(f"{len(duplicates)} project names were handed out twice, e.g. {duplicates[0]}")
+        if problems:
+            raise CommandError("; ".join(problems))
+        self.stdout.write(self.style.SUCCESS("Retention held under concurrency"))
@@ -1,8 +1,18 @@
+import json
+
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Case, Count, IntegerField, Max, Value, When
+from django.db.models.functions import Cast, Substr
 import uuid
 from simple_history.models import HistoricalRecords
 
+from app.cache import content_hash
+from app.retention import enforce_retention, owner_transaction, prune_history
+
+# Base of the generated project names
+UNTITLED_NAME = 'Untitled'
+
 
 class TimeStampedModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -12,61 +22,196 @@ class TimeStampedModel(models.Model):
         abstract = True
 
 
+class IconResultSet(TimeStampedModel):
+    """
+    One ordered list of icon search results, stored as IconResult rows.
+
+    A project points at the set it shows and its historical versions keep pointing at theirs, so
+    versions with the same icons share one set instead of each copying the whole list.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    project = models.ForeignKey('Project', on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='icon_result_sets')
+    content_hash = models.CharField(max_length=64, db_index=True)
+    count = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def for_icons(cls, project_id, icons):
+        """
+        The project's set holding exactly these icons, created with one bulk insert if it does not
+        exist yet.
+
+        Args:
+            project_id: The project the icons were found for, None when it no longer exists.
+            icons (list): {id, url} dicts in display order.
+        """
+        icons_hash = content_hash(json.dumps([[icon.get('id'), icon.get('url')] for icon in icons]))
+        result_set = cls.objects.filter(project_id=project_id, content_hash=icons_hash).first()
+        if result_set is None:
+            result_set = cls.objects.create(project_id=project_id, content_hash=icons_hash, count=len(icons))
+            IconResult.objects.bulk_create([
+                IconResult(result_set=result_set, position=position, icon_id=icon.get('id'), url=icon.get('url', ''))
+                for position, icon in enumerate(icons)
+            ], batch_size=500)
+        return result_set
+
+
+class IconResult(models.Model):
+    result_set = models.ForeignKey(IconResultSet, on_delete=models.CASCADE, related_name='icons')
+    position = models.PositiveIntegerField()
+    icon_id = models.BigIntegerField(null=True)
+    url = models.URLField(max_length=500, blank=True)
+
+    class Meta:
+        ordering = ['position']
+        constraints = [
+            models.UniqueConstraint(fields=['result_set', 'position'], name='unique_icon_result_position'),
+        ]
+
+
+def project_icons(obj, offset=0, limit=None):
+    """
+    A page of the icons of a project or historical version, read with LIMIT/OFFSET from its
+    IconResultSet. Versions saved before result sets existed fall back to their f_icons blob.
+
+    Args:
+        obj: Project or historical project.
+        offset (int): Icons to skip.
+        limit (int): Page size, None for every icon.
+
+    Returns:
+        tuple: (list of {id, url} dicts, total count)
+    """
+    if not obj.icon_result_set_id:
+        icons = obj.f_icons or []
+        return icons[offset:None if limit is None else offset + limit], len(icons)
+    rows = IconResult.objects.filter(result_set_id=obj.icon_result_set_id).order_by('position')
+    rows = rows[offset:] if limit is None else rows[offset:offset + limit]
+    count = IconResultSet.objects.filter(pk=obj.icon_result_set_id).values_list('count', flat=True).first() or 0
+    return [{'id': icon_id, 'url': url} for icon_id, url in rows.values_list('icon_id', 'url')], count
+
+
+def load_icon_lists(result_set_ids):
+    """
+    Every icon of the given result sets in one query, as {result_set_id: [{id, url}, ...]}.
+    """
+    icon_lists = {result_set_id: [] for result_set_id in result_set_ids}
+    rows = IconResult.objects.filter(result_set_id__in=icon_lists).order_by('result_set_id', 'position')
+    for result_set_id, icon_id, url in rows.values_list('result_set_id', 'icon_id', 'url'):
+        icon_lists[result_set_id].append({'id': icon_id, 'url': url})
+    return icon_lists
+
+
 class Project(TimeStampedModel):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=100, blank=True)
     attributes = models.JSONField(default=dict, blank=True)
+    # Only written by callers; save() moves the list into icon_result_set and empties it
     f_icons = models.JSONField(default=list, blank=True)
+    icon_result_set = models.ForeignKey(IconResultSet, on_delete=models.SET_NULL, null=True, blank=True,
+                                        related_name='+')
     screen_link = models.URLField(blank=True)
     history = HistoricalRecords()
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, null=True, blank=True)
 
+    def allocate_name(self):
+        """
+        Next free "Untitled N" name of the user, from one aggregate over the names already taken.
+        The sequence is "Untitled", "Untitled 1", "Untitled 2", ...
+        """
+        taken = Project.objects.filter(
+            user=self.user, name__regex=rf'^{UNTITLED_NAME}( [0-9]+)?$'
+        ).aggregate(
+            count=Count('pk'),
+            suffix=Max(Case(
+                When(name=UNTITLED_NAME, then=Value(0)),
+                default=Cast(Substr('name', len(UNTITLED_NAME) + 2), IntegerField()),
+            )),
+        )
+        if not taken['count']:
+            return UNTITLED_NAME
+        return f"{UNTITLED_NAME} {taken['suffix'] + 1}"
+
+    def store_icon_results(self):
+        """
+        Move newly assigned f_icons into a shared IconResultSet, so neither the project row nor its
+        historical copies hold the list.
+        """
+        if self.f_icons:
+            self.icon_result_set = IconResultSet.for_icons(self.pk, self.f_icons)
+            self.f_icons = []
+
     def save(self, *args, **kwargs):
         print("without history")
         self.skip_history_when_saving = True
 
-        # Generate a unique name
-        base_name = 'Untitled'
-        count = 1
-        unique_name = base_name
+        with owner_transaction(self.user):
+            # Generate a unique name; ensure user is not None before checking uniqueness
+            if not self.name and self.user:
+                self.name = self.allocate_name()
+
+            # Per-user project retention (app.retention), only when a project is added
+            if self._state.adding:
+                enforce_retention(self)
 
-        if not self.name:
-            # Ensure user is not None before checking uniqueness
-            if self.user:
-                while Project.objects.filter(name=unique_name, user=self.user).exists():
-                    unique_name = f'{base_name} {count}'
-                    count += 1
+            self.store_icon_results()
+            super(Project, self).save(*args, **kwargs)
 
-                self.name = unique_name
+    def save_with_historical_record(self, *args, **kwargs):
+        with owner_transaction(self.user):
+            if not self.name:
+                self.name = self.allocate_name()
 
-        # limit Records to Five
-        if Project.objects.filter(user=self.user).count() >= 5:
-            oldest_project = Project.objects.filter(user=self.user).order_by('created_at').first()
-            if oldest_project:
-                oldest_project.delete()
+            print("with history")
+            # Per-user project retention (app.retention), only when a project is added
+            if self._state.adding:
+                enforce_retention(self)
 
-        super(Project, self).save(*args, **kwargs)
+            self.store_icon_results()
+            # Bounded history: the save below records one more version
+            prune_history(self)
 
-    def save_with_historical_record(self, *args, **kwargs):
-        if not self.name:
-            count = Project.objects.filter(name__startswith='Untitled').count() + 1
-            self.name = f'Untitled{count}'
-
-        print("with history")
-        #  limit Records to Five
-        if Project.objects.filter(user=self.user).count() >= 5:
-            oldest_project = Project.objects.filter(user=self.user).order_by('created_at').first()  # or 'created_at' if you have a timestamp
-            if oldest_project:
-                oldest_project.delete()
-
-        # limits History Records to five versions
-        historical_records = self.history.all()
-        excess_records = historical_records.count()
-        if excess_records >= 5:
-            # Get the IDs of the excess records
-            oldest_record = historical_records.order_by('history_date').first()
-            if oldest_record:
-                oldest_record.delete()
-            # Delete the excess historical records
-
-        super(Project, self).save(*args, **kwargs)
\ No newline at end of file
+            super(Project, self).save(*args, **kwargs)
+
+
+class GenerationJob(TimeStampedModel):
+    """
+    Icon generation request processed in the background by the run_generation_worker command.
+
+    The table doubles as the queue: workers claim pending jobs with an atomic status update, so a
+    job is only ever run by one worker. A client supplied idempotency key maps retried uploads onto
+    the job that already exists instead of queueing the pipeline again.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='generation_jobs')
+    idempotency_key = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    image = models.FileField(upload_to='jobs/', blank=True)
+    icon_color = models.CharField(max_length=50, blank=True)
+    icon_style = models.CharField(max_length=50, blank=True)
+    callback_url = models.URLField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.JSONField(null=True, blank=True)
+    project = models.ForeignKey(Project, on_delete=models.SET_NULL, null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    callback_status = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], condition=~models.Q(idempotency_key=''),
+                                    name='unique_generation_job_idempotency_key'),
+        ]
@@ -0,0 +1,130 @@
+import base64
+import binascii
+import json
+import uuid
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db.models import Q
+
+from app.models import IconResult, IconResultSet, Project
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(result_set_id, position):
+    """
+    Opaque cursor pointing just after position in a result set.
+
+    Args:
+        result_set_id: The IconResultSet paged through, None for a legacy f_icons list.
+        position (int): Position of the last icon already returned.
+
+    Returns:
+        str: URL safe cursor.
+    """
+    payload = json.dumps({'s': str(result_set_id) if result_set_id else None, 'p': position}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of encode_cursor.
+
+    Returns:
+        tuple: (result_set_id or None, position)
+
+    Raises:
+        InvalidCursor: The cursor was not made by encode_cursor.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        result_set_id, position = payload['s'], payload['p']
+        if isinstance(position, bool) or not isinstance(position, int) or position < -1:
+            raise InvalidCursor("Invalid cursor")
+        return (str(uuid.UUID(result_set_id)) if result_set_id is not None else None), position
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError, AttributeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+
+@dataclass
+class IconPage:
+    results: list = field(default_factory=list)
+    count: int = 0
+    next_cursor: str = None
+    has_more: bool = False
+
+    def as_response(self):
+        return {
+            "count": self.count,
+            "results": self.results,
+            "next_cursor": self.next_cursor,
+            "has_more": self.has_more,
+        }
+
+
+def page_size_param(value, default=10):
+    """
+    page_size request parameter as an int between 1 and settings.ICON_PAGE_MAX_SIZE.
+    """
+    page_size = int(value) if value else default
+    return min(max(page_size, 1), settings.ICON_PAGE_MAX_SIZE)
+
+
+def paginate_icons(obj, cursor=None, page_size=10, page=None):
+    """
+    A page of the icons of a project or historical version, in position order.
+
+    Pages are read with a range query on the (result_set, position) index, so the last page costs
+    the same as the first. A cursor stays on the result set it was issued for, so paging through a
+    project is not disturbed when its icons are replaced in between. page is the old page number
+    parameter and maps to the same range query, since positions of a set have no gaps.
+
+    Args:
+        obj: Project or historical project.
+        cursor (str): next_cursor of the previous page, None for the first page.
+        page_size (int): Icons per page.
+        page (int): 1-based page number, used when no cursor is given.
+
+    Returns:
+        IconPage: The page, its next_cursor and whether there are more icons.
+
+    Raises:
+        InvalidCursor: The cursor is malformed or belongs to another project.
+    """
+    result_set_id, after = obj.icon_result_set_id, -1
+    sets = IconResultSet.objects.all()
+    if cursor:
+        cursor_set_id, after = decode_cursor(cursor)
+        if cursor_set_id is not None and cursor_set_id != str(result_set_id):
+            # Another set of the same project, e.g. its icons were replaced since the first page.
+            # Sets of projects deleted by retention have no project left, only history pointing at them
+            result_set_id = cursor_set_id
+            sets = sets.filter(Q(project_id=obj.id) | Q(
+                pk__in=Project.history.filter(id=obj.id).values('icon_result_set')))
+    elif page:
+        after = (max(int(page), 1) - 1) * page_size - 1
+
+    if not result_set_id:
+        # Saved before result sets existed: the position is an index into the f_icons blob
+        icons = obj.f_icons or []
+        results = icons[after + 1:after + 1 + page_size]
+        has_more = len(icons) > after + 1 + page_size
+        return IconPage(results, len(icons), encode_cursor(None, after + len(results)) if has_more else None, has_more)
+
+    count = sets.filter(pk=result_set_id).values_list('count', flat=True).first()
+    if count is None:
+        raise InvalidCursor("Cursor does not belong to this project")
+    # One row past the page tells whether there is a next one
+    rows = list(IconResult.objects.filter(result_set_id=result_set_id, position__gt=after)
+                .order_by('position').values_list('position', 'icon_id', 'url')[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    return IconPage(
+        results=[{'id': icon_id, 'url': url} for _, icon_id, url in rows],
+        count=count,
+        next_cursor=encode_cursor(result_set_id, rows[-1][0]) if has_more else None,
+        has_more=has_more,
+    )
@@ -0,0 +1,237 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+
+from app.colors import match_rgb
+from app.imaging import ImagePayload
+
+# sRGB (linear) to XYZ, rows scaled by the D65 white point so white maps to (1, 1, 1)
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+]) / np.array([[0.95047], [1.00000], [1.08883]])
+
+# Colors below this Lab chroma read as white/gray/black
+ACHROMATIC_CHROMA = 12
+# Clusters smaller than this share of the image are noise, not part of the palette
+MIN_SHARE = 0.03
+# A multicolor image has at least this many hue filters, each covering MULTICOLOR_SHARE of it
+MULTICOLOR_HUES = 3
+MULTICOLOR_SHARE = 0.08
+# Share of neighbouring pixel pairs that must change smoothly and monotonically for a gradient
+GRADIENT_SMOOTH_RATIO = 0.25
+# Minimum Lab distance between palette colors for the smooth steps to count as a gradient
+GRADIENT_MIN_SPREAD = 20
+# Pixel distance of the steps compared by the gradient check, on the sampled image
+GRADIENT_STRIDE = 4
+# Colors are quantized to this many levels per channel before clustering
+QUANTIZE_LEVELS = 32
+
+
+def rgb_to_lab(pixels):
+    """
+    Vectorised app.colors.rgb_to_lab for an (..., 3) array of sRGB values in 0-255.
+    """
+    channels = np.asarray(pixels, dtype=np.float64) / 255
+    linear = np.where(channels <= 0.04045, channels / 12.92, ((channels + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _RGB_TO_XYZ.T
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def kmeans(points, k, weights=None, iterations=12, seed=0):
+    """
+    Deterministic weighted k-means with k-means++ seeding.
+
+    Args:
+        points (ndarray): (N, D) points.
+        k (int): Number of clusters.
+        weights (ndarray): Optional (N,) point weights, e.g. pixel counts of unique colors.
+
+    Returns:
+        tuple: (centers, labels) as NumPy arrays.
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.ones(len(points)) if weights is None else np.asarray(weights, dtype=np.float64)
+    k = min(k, len(points))
+    centers = [points[rng.choice(len(points), p=weights / weights.sum())]]
+    distances = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        probabilities = distances * weights
+        if probabilities.sum() == 0:
+            break
+        centers.append(points[rng.choice(len(points), p=probabilities / probabilities.sum())])
+        distances = np.minimum(distances, ((points - centers[-1]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = ((points[:, None, :] - centers[None]) ** 2).sum(axis=-1).argmin(axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        totals = np.bincount(labels, weights=weights, minlength=len(centers))
+        for dim in range(points.shape[1]):
+            sums = np.bincount(labels, weights=weights * points[:, dim], minlength=len(centers))
+            centers[:, dim] = np.where(totals > 0, sums / np.maximum(totals, 1e-12), centers[:, dim])
+    return centers, labels
+
+
+@dataclass
+class PaletteColor:
+    rgb: tuple
+    share: float
+    chroma: float
+    filter: str
+
+    @property
+    def hex(self):
+        return '#{:02x}{:02x}{:02x}'.format(*self.rgb)
+
+    @property
+    def is_chromatic(self):
+        return self.chroma >= ACHROMATIC_CHROMA
+
+
+@dataclass
+class Palette:
+    colors: list = field(default_factory=list)
+    dominant: PaletteColor = None
+    accent: PaletteColor = None
+    is_gradient: bool = False
+    is_multicolor: bool = False
+
+    @property
+    def freepik_color(self):
+        """
+        The Freepik color filter for the image: gradient, multicolor or the hue of the accent.
+        """
+        if self.is_gradient:
+            return 'gradient'
+        if self.is_multicolor:
+            return 'multicolor'
+        if self.accent:
+            return self.accent.filter
+        return self.dominant.filter if self.dominant else None
+
+    @property
+    def summary(self):
+        """
+        Palette text for the project attributes, e.g. "#1e88e5 azure, #ffffff white". The entry that
+        decides the Freepik filter comes first, so app.colors.match_color resolves it back.
+        """
+        ordered = sorted(self.colors, key=lambda color: color is not self.accent)
+        entries = [f"{color.hex} {color.filter}" for color in ordered]
+        if self.is_gradient or self.is_multicolor:
+            entries.insert(0, self.freepik_color)
+        return ', '.join(entries)
+
+
+def _load_pixels(image, sample_edge):
+    if isinstance(image, Image.Image):
+        # thumbnail works in place; leave the caller's image alone
+        image = image.copy()
+    else:
+        image = Image.open(ImagePayload.wrap(image).open())
+        # JPEG decoders can downscale while decoding, which skips most of the work
+        image.draft('RGB', (sample_edge * 2, sample_edge * 2))
+    image.thumbnail((sample_edge, sample_edge), Image.Resampling.BOX)
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    return np.asarray(image.convert('RGB'), dtype=np.float64)
+
+
+def _smooth_ratio(lab, stride=GRADIENT_STRIDE):
+    """
+    Share of pixels where the color changes by a small, steady step, measured along both axes.
+    Flat fills have no steps, edges have a large second difference and gradients have a constant,
+    non-zero first difference. Steps are taken over a few pixels so 8-bit rounding does not read
+    as noise.
+    """
+    ratios = []
+    for axis in (0, 1):
+        length = lab.shape[axis]
+        if length < 2 * stride + 1:
+            continue
+        head = lab.take(range(0, length - 2 * stride), axis=axis)
+        middle = lab.take(range(stride, length - stride), axis=axis)
+        tail = lab.take(range(2 * stride, length), axis=axis)
+        step = np.linalg.norm(middle - head, axis=-1)
+        second = np.linalg.norm(tail - 2 * middle + head, axis=-1)
+        smooth = (step > 1) & (step < 6 * stride) & (second < 0.35 * step)
+        ratios.append(smooth.mean())
+    return max(ratios, default=0.0)
+
+
+def extract_palette(image, size=None, sample_edge=None) -> Palette:
+    """
+    Extract the dominant and accent colors of an image without any model call.
+
+    The image is downsampled to sample_edge pixels and clustered with k-means in CIELAB. Each
+    cluster is mapped onto its Freepik color filter (app.colors.match_rgb), and the image is
+    flagged as a gradient when most neighbouring pixels change smoothly between distinct colors.
+
+    Args:
+        image (ImagePayload, bytes or PIL.Image.Image): The image.
+        size (int): Number of clusters, settings.PALETTE_SIZE by default.
+        sample_edge (int): Long edge of the sampled image, settings.PALETTE_SAMPLE_EDGE by default.
+
+    Returns:
+        Palette: Colors by share, or an empty palette when the image can not be decoded.
+    """
+    size = size or settings.PALETTE_SIZE
+    sample_edge = sample_edge or settings.PALETTE_SAMPLE_EDGE
+    try:
+        pixels = _load_pixels(image, sample_edge)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return Palette()
+
+    lab = rgb_to_lab(pixels)
+    flat_rgb = pixels.reshape(-1, 3)
+    # Cluster the distinct quantized colors weighted by their pixel counts instead of every pixel
+    step = 256 // QUANTIZE_LEVELS
+    quantized = (flat_rgb // step).astype(np.int64)
+    codes = (quantized[:, 0] * QUANTIZE_LEVELS + quantized[:, 1]) * QUANTIZE_LEVELS + quantized[:, 2]
+    unique_codes, inverse, unique_counts = np.unique(codes, return_inverse=True, return_counts=True)
+    unique_rgb = np.stack([
+        unique_codes // (QUANTIZE_LEVELS * QUANTIZE_LEVELS),
+        unique_codes // QUANTIZE_LEVELS % QUANTIZE_LEVELS,
+        unique_codes % QUANTIZE_LEVELS,
+    ], axis=1) * step + step / 2
+    centers, unique_labels = kmeans(rgb_to_lab(unique_rgb), size, weights=unique_counts)
+    labels = unique_labels[inverse.reshape(-1)]
+    counts = np.bincount(labels, minlength=len(centers))
+
+    colors = []
+    for index in np.argsort(-counts):
+        share = counts[index] / len(labels)
+        if share < MIN_SHARE:
+            continue
+        rgb = tuple(int(round(channel)) for channel in flat_rgb[labels == index].mean(axis=0))
+        chroma = float(np.hypot(centers[index][1], centers[index][2]))
+        colors.append(PaletteColor(rgb=rgb, share=float(share), chroma=chroma, filter=match_rgb(rgb)))
+    if not colors:
+        return Palette()
+
+    palette = Palette(colors=colors, dominant=colors[0])
+    chromatic = [color for color in colors if color.is_chromatic]
+    if chromatic:
+        palette.accent = chromatic[0]
+    elif len(colors) > 1 and colors[0].filter == 'white':
+        # Dark marks on a white canvas: the marks carry the icon color, not the background
+        palette.accent = colors[1]
+
+    hues = {color.filter for color in chromatic if color.share >= MULTICOLOR_SHARE}
+    palette.is_multicolor = len(hues) >= MULTICOLOR_HUES
+
+    spread = max((float(np.linalg.norm(a - b)) for a in centers[counts > 0] for b in centers[counts > 0]),
+                 default=0.0)
+    palette.is_gradient = bool(chromatic) and spread >= GRADIENT_MIN_SPREAD \
+        and _smooth_ratio(lab) >= GRADIENT_SMOOTH_RATIO
+    return palette
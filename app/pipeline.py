@@ -0,0 +1,46 @@
+from app.serializers import ProjectSerializer
+from app.utils import (
+    describe_image, custom_error_message, fetch_icons, find_closest_color, image_attributes, palette_color_source,
+    remember_search
+)
+
+
+def generate_project(image, user, icon_color_hex=None, icon_style=None):
+    """
+    Run the icon generation pipeline for an uploaded image and save the resulting project.
+
+    The image is described by the vision model, the icon color is matched to a Freepik filter, the
+    icons are searched and the project is stored for the user. Used by ImageProcessView and by the
+    background job worker.
+
+    Args:
+        image (ImagePayload or bytes): The uploaded image.
+        user: Owner of the new project.
+        icon_color_hex (str): Optional icon color, the image color palette is used otherwise.
+        icon_style (str): Optional Freepik icon style.
+
+    Returns:
+        tuple: (project data, None) on success or (None, error dict) on failure.
+    """
+    style_filter = True if icon_style else False
+    attributes = image_attributes(describe_image(image))
+
+    # Resolved locally by perceptual distance, so any hex maps onto a Freepik color
+    color_filter, icon_color_name = find_closest_color(icon_color_hex or palette_color_source(attributes))
+
+    f_icons_list, result, error = fetch_icons(
+        color_filter, style_filter, palette_color_source(attributes), attributes['iconography'],
+        attributes['brand_style'], attributes['gradient_usage'], attributes['imagery'],
+        attributes['shadow_and_depth'], attributes['line_thickness'], attributes['corner_rounding'],
+        attributes['description'], icon_color_name, icon_style
+    )
+    if error:
+        return None, {"error": error}
+    # Kept so color/shape refinements can search again without the LLM
+    remember_search(attributes, result)
+
+    project_serializer_obj = ProjectSerializer(data={'attributes': attributes, 'f_icons': f_icons_list})
+    if project_serializer_obj.is_valid():
+        project_serializer_obj.save(user=user)
+        return project_serializer_obj.data, None
+    return None, custom_error_message(project_serializer_obj.errors)
@@ -0,0 +1,193 @@
+import json
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum, TextField, Window
+from django.db.models.functions import Cast, Coalesce, Length, RowNumber
+from django.utils import timezone
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Per-user project caps. Each limit is off when None; a project is deleted when it breaks any of
+    them.
+
+    Attributes:
+        max_count (int): Projects kept per user.
+        max_age (timedelta): Projects older than this are deleted.
+        max_bytes (int): project_size kept per user, newest first.
+    """
+    max_count: int = None
+    max_age: timedelta = None
+    max_bytes: int = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_count=settings.PROJECT_RETENTION_MAX_COUNT or None,
+            max_age=timedelta(days=settings.PROJECT_RETENTION_MAX_AGE_DAYS)
+            if settings.PROJECT_RETENTION_MAX_AGE_DAYS else None,
+            max_bytes=settings.PROJECT_RETENTION_MAX_BYTES or None,
+        )
+
+
+def icon_size(icon_id, url):
+    # Bytes one icon counts for: its id and url as text
+    return (len(str(icon_id)) if icon_id is not None else 0) + len(url or '')
+
+
+def icon_result_size():
+    # icon_size of an IconResult row, as a database expression
+    return Coalesce(Length(Cast('icon_id', TextField())), 0) + Length('url')
+
+
+def project_size(project=None):
+    """
+    Bytes a project counts for against RetentionPolicy.max_bytes: its serialized attributes plus
+    icon_size of each of its icons.
+
+    Args:
+        project (Project): Measured in Python, including icons still in f_icons that save() has not
+            moved into a result set yet. None for the same measure as a database expression over
+            saved projects, which keep their icons only in result sets.
+
+    Returns:
+        int or Expression: The size of project, or the expression when project is None.
+    """
+    icon_results = apps.get_model('app', 'IconResult').objects
+    if project is None:
+        icons = icon_results.filter(result_set=OuterRef('icon_result_set')).values('result_set').annotate(
+            size=Sum(icon_result_size())
+        ).values('size')
+        return Length(Cast('attributes', TextField())) + Coalesce(Subquery(icons), 0)
+    if project.f_icons:
+        icons = sum(icon_size(icon.get('id'), icon.get('url')) for icon in project.f_icons)
+    else:
+        icons = icon_results.filter(result_set_id=project.icon_result_set_id).aggregate(
+            size=Sum(icon_result_size()))['size'] if project.icon_result_set_id else 0
+    return len(json.dumps(project.attributes)) + (icons or 0)
+
+
+@contextmanager
+def owner_transaction(user):
+    """
+    Transaction holding a lock on the user's row, so name allocation, retention and the insert they
+    make room for run one at a time per user. SQLite ignores select_for_update, so there the
+    transaction opens with a no-op write instead, which takes the database write lock up front: a
+    read transaction upgraded to a write one later fails under concurrency instead of waiting. That
+    lock is database wide, so saves of different users queue behind each other on SQLite, while
+    every other atomic block keeps SQLite's default deferred locking.
+    """
+    with transaction.atomic():
+        users = get_user_model().objects.filter(pk=user.pk if user is not None else None)
+        if connection.vendor == 'sqlite':
+            pk_name = users.model._meta.pk.attname
+            users.update(**{pk_name: F(pk_name)})
+        elif user is not None:
+            list(users.select_for_update().values_list('pk'))
+        yield
+
+
+def enforce_retention(project, policy=None):
+    """
+    Delete the projects of project.user that break the retention policy, leaving room for project
+    when it is about to be added.
+
+    Must run inside the owner_transaction that saves project: the owner row stays locked until it
+    commits, so concurrent saves for the same user can neither overshoot the cap nor delete the same
+    projects twice. Every limit is folded into one delete.
+
+    Args:
+        project (Project): The project being saved.
+        policy (RetentionPolicy): Limits to apply, RetentionPolicy.from_settings() by default.
+
+    Returns:
+        int: Number of projects deleted.
+    """
+    policy = policy or RetentionPolicy.from_settings()
+    model = type(project)
+    owned = model.objects.filter(user=project.user).exclude(pk=project.pk)
+    # The project being added takes one of the slots
+    reserve = 1 if project._state.adding else 0
+
+    expired = Q()
+    if policy.max_count is not None:
+        keep = policy.max_count - reserve
+        if keep > 0:
+            expired |= ~Q(pk__in=owned.order_by('-created_at').values('pk')[:keep])
+        else:
+            expired |= Q(pk__isnull=False)
+    if policy.max_age is not None:
+        expired |= Q(created_at__lt=timezone.now() - policy.max_age)
+    if policy.max_bytes is not None:
+        incoming = project_size(project) if reserve else 0
+        over_budget = owned.annotate(
+            running_size=Window(Sum(project_size()), order_by=F('created_at').desc())
+        ).filter(running_size__gt=policy.max_bytes - incoming).values('pk')
+        expired |= Q(pk__in=over_budget)
+    if not expired:
+        return 0
+
+    deleted, per_model = owned.filter(expired).delete()
+    return per_model.get(model._meta.label, 0)
+
+
+
+def prune_history(project, keep=None, reserve=1):
+    """
+    Trim the historical records of project to its newest versions in one bulk delete.
+
+    Args:
+        project (Project): The project whose history is pruned.
+        keep (int): Versions kept, settings.PROJECT_HISTORY_MAX_VERSIONS by default.
+        reserve (int): Slots left for records the caller is about to add, e.g. 1 before a save that
+            records a new version, so the history ends at exactly keep versions.
+
+    Returns:
+        int: Number of historical records deleted.
+    """
+    keep = (keep or settings.PROJECT_HISTORY_MAX_VERSIONS) - reserve
+    history = project.history.all()
+    if keep > 0:
+        newest = history.order_by('-history_date', '-history_id').values('history_id')[:keep]
+        history = history.exclude(history_id__in=newest)
+    deleted = history.delete()[0]
+    if deleted:
+        # Result sets only the pruned versions pointed at
+        delete_orphan_result_sets(apps.get_model('app', 'IconResultSet').objects.filter(project_id=project.pk)
+                                  .exclude(pk=project.icon_result_set_id))
+    return deleted
+
+
+def delete_orphan_result_sets(result_sets=None):
+    """
+    Delete the icon result sets, out of result_sets (all by default), that neither a project nor a
+    historical version points at any more.
+
+    Returns:
+        int: Number of result sets deleted.
+    """
+    project_model = apps.get_model('app', 'Project')
+    if result_sets is None:
+        result_sets = apps.get_model('app', 'IconResultSet').objects.all()
+    for model in (project_model, project_model.history.model):
+        # NOT IN over a column with NULLs matches nothing, so the NULLs are filtered out
+        result_sets = result_sets.exclude(
+            pk__in=model.objects.filter(icon_result_set__isnull=False).values('icon_result_set')
+        )
+    return result_sets.delete()[1].get('app.IconResultSet', 0)
+
+
+def excess_history(history_model, project_ids, keep):
+    """
+    Historical records of the given projects beyond their newest keep versions, ranked per project.
+    """
+    return history_model.objects.filter(id__in=project_ids).annotate(
+        version=Window(RowNumber(), partition_by=F('id'), order_by=[F('history_date').desc(), F('history_id').desc()])
+    ).filter(version__gt=keep).values('history_id')
@@ -1,11 +1,37 @@
 from rest_framework import serializers
-from app.models import Project
+from app.models import Project, GenerationJob, project_icons
+
+
+class IconListField(serializers.Field):
+    """
+    The icons of a project or historical version as a list of {id, url}. Read from the icon result
+    set, or from icon_lists in the serializer context when a view preloaded them; written to
+    f_icons, which Project.save moves into a result set.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs.setdefault('required', False)
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        preloaded = self.context.get('icon_lists') or {}
+        if instance.icon_result_set_id in preloaded:
+            return preloaded[instance.icon_result_set_id]
+        return project_icons(instance)[0]
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError("Expected a list of icons.")
+        return {'f_icons': data}
 
 
 class ProjectSerializer(serializers.ModelSerializer):
+    f_icons = IconListField()
+
     class Meta:
         model = Project
-        exclude = ['created_at', 'updated_at']
+        exclude = ['created_at', 'updated_at', 'icon_result_set']
         
     # def create(self, validated_data):
     #     user = validated_data.pop('user', None)
@@ -19,7 +45,7 @@ class ProjectSerializer(serializers.ModelSerializer):
 class ProjectWithHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Project
-        exclude = ['created_at', 'updated_at']
+        exclude = ['created_at', 'updated_at', 'icon_result_set']
         
     # def create(self, validated_data):
     #     user = validated_data.pop('user', None)
@@ -41,6 +67,8 @@ class ProjectListSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 class ProjectIconListSerializer(serializers.ModelSerializer):
+    f_icons = IconListField()
+
     class Meta:
         model = Project
         fields = ['f_icons']
@@ -52,12 +80,16 @@ class ProjectIconAttributesSerializer(serializers.ModelSerializer):
 
 
 class ProjectHistorySerializer(serializers.ModelSerializer):
+    f_icons = IconListField()
+
     class Meta:
         model = Project.history.model
         fields = ['history_id', 'name', 'f_icons', 'history_date', 'id']
 
 
 class ProjectUpdateSerializer(serializers.ModelSerializer):
+    f_icons = IconListField()
+
     class Meta:
         model = Project
         fields = ['f_icons', 'attributes']
@@ -70,4 +102,9 @@ class ProjectUpdateSerializer(serializers.ModelSerializer):
 
 class IconSerializer(serializers.Serializer):
     id = serializers.IntegerField()
-    url = serializers.URLField()
\ No newline at end of file
+    url = serializers.URLField()
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GenerationJob
+        fields = ['id', 'status', 'project', 'result', 'error', 'attempts', 'created_at', 'finished_at']
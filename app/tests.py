@@ -1,3 +1,994 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from app.archive import ArchiveBuilder, choose_compression
+from app.cache import DjangoCacheBackend, FileSystemCacheBackend, LocMemCacheBackend, NullCacheBackend
+from app.chains import ChainRegistry
+from app.colors import delta_e, match_color, resolve_color_phrase, rgb_to_lab
+from app.downloads import ON_ERROR_ABORT, ON_ERROR_SKIP, IconDownloadError, fetch_icons_concurrently
+from app.freepik import (AsyncFreepikClient, FreepikClient, FreepikError, FreepikIcon, IconSearchResult, SearchResultCache,
+                         get_download_client, get_freepik_client)
+from app.icon_cache import IconBlobCache
+from app.imaging import ImagePayload, ImageTooLarge, prepare_image, target_size
+from app.jobs import InvalidCallbackURL, requeue_stale_jobs, validate_callback_url
+from app.pagination import InvalidCursor, encode_cursor, page_size_param, paginate_icons
+from app.retention import project_size
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DjangoCacheBackendTests(SimpleTestCase):
+    def test_keys_are_namespaced_by_prefix(self):
+        backend = DjangoCacheBackend(key_prefix='vision:')
+        backend.set('a', 1)
+        caches['default'].set('a', 'other-app')
+
+        self.assertEqual(caches['default'].get('vision:a'), 1)
+        backend.delete('a')
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(caches['default'].get('a'), 'other-app')
+
+    def test_shared_alias_can_not_be_cleared(self):
+        for backend in (DjangoCacheBackend(key_prefix='vision:'), LocMemCacheBackend(), NullCacheBackend()):
+            self.assertFalse(hasattr(backend, 'clear'))
+
+
+class FreepikErrorTests(SimpleTestCase):
+    def test_non_transient_request_errors_become_freepik_errors(self):
+        client = FreepikClient('key', max_retries=0)
+        with mock.patch.object(client.session, 'request', side_effect=requests.TooManyRedirects("loop")):
+            with self.assertRaises(FreepikError):
+                client.get_json('icons')
+
+    def test_invalid_json_becomes_freepik_error(self):
+        client = FreepikClient('key', max_retries=0)
+        response = requests.Response()
+        response.status_code, response._content = 200, b'<html>'
+        with mock.patch.object(client.session, 'request', return_value=response):
+            with self.assertRaises(FreepikError):
+                client.get_json('icons')
+
+    def test_async_client_wraps_the_same_errors(self):
+        async def run(handler):
+            client = AsyncFreepikClient('key', max_retries=0)
+            client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            try:
+                return await client.get_json('icons')
+            finally:
+                await client.client.aclose()
+
+        def redirect_loop(request):
+            raise httpx.TooManyRedirects("loop", request=request)
+
+        for handler in (redirect_loop, lambda request: httpx.Response(200, content=b'<html>')):
+            with self.assertRaises(FreepikError):
+                asyncio.run(run(handler))
+
+
+class ArchiveBuilderTests(SimpleTestCase):
+    png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 200
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg">' + b'<path d="M0 0h24v24H0z"/>' * 50 + b'</svg>'
+
+    def test_compression_follows_the_content(self):
+        self.assertEqual(choose_compression('1.png', self.png), zipfile.ZIP_STORED)
+        self.assertEqual(choose_compression('1.svg', self.svg), zipfile.ZIP_DEFLATED)
+        # The bytes win over a misleading name, and the name decides when the bytes say nothing
+        self.assertEqual(choose_compression('1.svg', self.png), zipfile.ZIP_STORED)
+        self.assertEqual(choose_compression('1.jpg', b'unknown'), zipfile.ZIP_STORED)
+        self.assertEqual(choose_compression('notes.txt', b'unknown'), zipfile.ZIP_DEFLATED)
+
+    def test_streamed_archive_is_valid_and_counted(self):
+        builder = ArchiveBuilder()
+        data = b''.join(builder.stream(iter([('1.png', self.png), ('2.svg', self.svg), ('failed.txt', 'none')])))
+
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read('2.svg'), self.svg)
+        self.assertEqual([member.compression for member in builder.members], ['stored', 'deflated', 'deflated'])
+        stats = builder.stats
+        self.assertEqual((stats['members'], stats['stored'], stats['deflated']), (3, 1, 2))
+        self.assertLess(stats['bytes_out'], stats['bytes_in'])
+
+
+class CacheBackendTests(SimpleTestCase):
+    def test_memory_backend_evicts_the_least_recently_used_entry(self):
+        backend = LocMemCacheBackend(max_entries=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertEqual((backend.get('a'), backend.get('b'), backend.get('c')), (1, None, 3))
+
+    def test_entries_expire_with_their_ttl(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for backend in (LocMemCacheBackend(ttl=60), FileSystemCacheBackend(directory, ttl=60)):
+                backend.set('a', {'style': 'line'})
+                with mock.patch('app.cache.time.time', return_value=time.time() + 61):
+                    self.assertIsNone(backend.get('a'))
+
+    def test_filesystem_backend_keeps_max_entries_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = FileSystemCacheBackend(directory, max_entries=2)
+            for key in 'abc':
+                backend.set(key, key)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertIsNone(backend.get('a'))
+            self.assertEqual(backend.get('c'), 'c')
+
+
+class VisionCacheTests(SimpleTestCase):
+    def process(self, image, detail='auto'):
+        from app import utils
+
+        return utils.process_image_data(image, detail=detail)
+
+    def test_same_image_and_prompt_call_the_model_once(self):
+        from app import utils
+
+        with mock.patch.object(utils, 'vision_cache', LocMemCacheBackend()), \
+                mock.patch.object(utils, 'run_vision_chain', return_value=('', {'style': 'line'})) as run:
+            self.assertEqual(self.process(b'image bytes'), {'style': 'line'})
+            self.assertEqual(self.process(bytearray(b'image bytes')), {'style': 'line'})
+            self.assertEqual(run.call_count, 1)
+            # Another image, detail level or prompt is a different entry
+            self.process(b'other bytes')
+            self.process(b'image bytes', detail='low')
+            with mock.patch.object(utils, 'VISION_PROMPT_VERSION', 'next'):
+                self.process(b'image bytes')
+            self.assertEqual(run.call_count, 4)
+
+
+class IconsQueryCacheTests(SimpleTestCase):
+    def test_equivalent_attributes_normalize_alike(self):
+        from app.utils import normalize_icons_query
+
+        self.assertEqual(normalize_icons_query(('Flat, Modern!', ' Thin ')), ('flat, modern', 'thin'))
+        self.assertEqual(normalize_icons_query(('modern;flat', 'thin')), normalize_icons_query(('Flat, Modern', 'THIN')))
+        self.assertEqual(normalize_icons_query('Line/ Outline'), ('line, outline',))
+
+    def test_equivalent_combinations_call_the_model_once(self):
+        from app import utils
+
+        chain = mock.Mock()
+        chain.invoke.return_value = mock.Mock(query='flat modern icon')
+        with mock.patch.object(utils, 'icons_query_cache', LocMemCacheBackend()), \
+                mock.patch.object(utils, 'get_chain', return_value=chain):
+            self.assertEqual(utils.process_icons_query(('Flat, Modern', 'thin')), 'flat modern icon')
+            self.assertEqual(utils.process_icons_query(('modern,flat', 'Thin.')), 'flat modern icon')
+            self.assertEqual(chain.invoke.call_count, 1)
+            # A different combination or prompt is a different entry
+            utils.process_icons_query(('flat', 'thin'))
+            with mock.patch.object(utils, 'ICONS_QUERY_PROMPT_VERSION', 'next'):
+                utils.process_icons_query(('flat, modern', 'thin'))
+            self.assertEqual(chain.invoke.call_count, 3)
+
+
+class ChainRegistryTests(SimpleTestCase):
+    def test_chains_are_built_once_and_shared_across_threads(self):
+        registry = ChainRegistry()
+        builder = mock.Mock(side_effect=lambda: object())
+        registry.register('query', builder)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            built = set(map(id, executor.map(lambda _: registry.get('query'), range(32))))
+        self.assertEqual((len(built), builder.call_count), (1, 1))
+        # reset drops the compiled chain, the builder stays registered
+        registry.reset('query')
+        self.assertIsNot(registry.get('query'), registry.build('query'))
+        self.assertEqual(builder.call_count, 3)
+
+    def test_a_name_can_not_be_taken_by_another_builder(self):
+        registry = ChainRegistry()
+
+        @registry.register('query')
+        def build():
+            return object()
+
+        registry.register('query', build)
+        with self.assertRaises(ValueError):
+            registry.register('query', lambda: object())
+        self.assertEqual(registry.names(), ['query'])
+
+
+class ColorMatchTests(SimpleTestCase):
+    def test_hex_codes_and_names_resolve_by_perceptual_distance(self):
+        cases = {
+            '#1E90FF': 'azure', '1e90ff': 'azure', '#f00': 'red', 'navy': 'blue', 'Dark Blue': 'blue',
+            'sky blue': 'azure', 'Blue, Yellow, White': 'blue', 'dark navy': 'blue', 'solid black': 'solid-black',
+            'rainbow': 'multicolor', 'primary #2e8b57 accents': 'spring-green',
+        }
+        for value, expected in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(match_color(value), expected)
+
+    def test_lab_conversion(self):
+        white, black = rgb_to_lab((255, 255, 255)), rgb_to_lab((0, 0, 0))
+        self.assertAlmostEqual(white[0], 100, places=2)
+        self.assertAlmostEqual(black[0], 0, places=2)
+        self.assertLess(delta_e(white, rgb_to_lab((245, 245, 245))), delta_e(white, rgb_to_lab((128, 128, 128))))
+
+    def test_words_that_are_not_colors_resolve_to_nothing(self):
+        for value in ('dark', 'facade', 'decade'):
+            with self.subTest(value=value):
+                self.assertIsNone(match_color(value))
+        # A phrase has to name a color as a whole
+        self.assertIsNone(resolve_color_phrase('red cow'))
+
+
+class DownloadClientTests(SimpleTestCase):
+    @override_settings(FREE_PICK_API_KEY='key', FREEPIK_MAX_CONCURRENCY=1, ICON_DOWNLOAD_MAX_CONCURRENCY=1)
+    def test_downloads_do_not_take_the_api_client_slots(self):
+        with mock.patch('app.freepik._client', None), mock.patch('app.freepik._download_client', None):
+            api, downloads = get_freepik_client(), get_download_client()
+            self.assertIsNot(api, downloads)
+            sent = []
+            with mock.patch.object(downloads.session, 'request',
+                                   side_effect=lambda method, url, headers=None, **kwargs: sent.append(headers)
+                                   or mock.Mock(status_code=200)):
+                # A download holding every download slot leaves the API slot free
+                with downloads._semaphore:
+                    self.assertTrue(api._semaphore.acquire(blocking=False))
+                    api._semaphore.release()
+                downloads.request('GET', f'{FreepikClient.base_url}/icons')
+        # The API key is never sent to asset or third-party hosts
+        self.assertEqual(sent, [{}])
+
+
+class FetchIconsConcurrentlyTests(SimpleTestCase):
+    icons = [{'id': i, 'url': f'https://img.example/{i}.png'} for i in range(6)]
+
+    @staticmethod
+    def download(icon_id, url):
+        if icon_id == 3:
+            raise requests.HTTPError("404")
+        return str(icon_id).encode()
+
+    def test_downloads_run_in_parallel(self):
+        both_started = threading.Barrier(2, timeout=5)
+
+        def download(icon_id, url):
+            # Only returns once another download is running at the same time
+            both_started.wait()
+            return b'png'
+
+        with mock.patch('app.downloads.download_icon_content', side_effect=download):
+            self.assertEqual(len(list(fetch_icons_concurrently(self.icons[:2], max_workers=2))), 2)
+
+    def test_failed_icons_are_skipped_and_reported(self):
+        failures = []
+        with mock.patch('app.downloads.download_icon_content', side_effect=self.download):
+            results = dict((icon['id'], content) for icon, content in
+                           fetch_icons_concurrently(self.icons, max_workers=3, failures=failures))
+        self.assertEqual(sorted(results), [0, 1, 2, 4, 5])
+        self.assertEqual([failure.icon_id for failure in failures], [3])
+
+    def test_abort_stops_at_the_first_failure(self):
+        with mock.patch('app.downloads.download_icon_content', side_effect=self.download):
+            with self.assertRaises(IconDownloadError) as raised:
+                list(fetch_icons_concurrently(self.icons, max_workers=1, on_error=ON_ERROR_ABORT))
+        self.assertEqual(raised.exception.icon_id, 3)
+
+    def test_zip_lists_skipped_icons_and_abort_on_the_first_icon_is_a_400(self):
+        from app.views import icon_zip_response
+
+        with mock.patch('app.downloads.download_icon_content', side_effect=self.download):
+            response = icon_zip_response(self.icons, ON_ERROR_SKIP)
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(archive.read('failed_icons.txt'), b'3: 404')
+            self.assertEqual(len(archive.namelist()), 6)
+
+            # Only the failing icon, so it is certainly the first to arrive
+            self.assertEqual(icon_zip_response(self.icons[3:4], ON_ERROR_ABORT).status_code, 400)
+
+    def test_downloads_stay_within_the_window(self):
+        icons = [{'id': i, 'url': f'https://img.example/{i}.png'} for i in range(40)]
+        started, lock = [], threading.Lock()
+
+        def download(icon_id, url):
+            with lock:
+                started.append(icon_id)
+            return b'png'
+
+        consumed = 0
+        with mock.patch('app.downloads.download_icon_content', side_effect=download):
+            for _ in fetch_icons_concurrently(icons, max_workers=2):
+                consumed += 1
+                # 2 workers keep at most 4 downloads ahead of the consumer
+                self.assertLessEqual(len(started), consumed + 4)
+        self.assertEqual(consumed, 40)
+
+
+class IncrementalSearchTests(SimpleTestCase):
+    attributes = {'color_palette': 'red', 'iconography': '', 'brand_style': '', 'gradient_usage': '',
+                  'imagery': 'nature', 'shadow_and_depth': '', 'line_thickness': '', 'corner_rounding': '',
+                  'description': 'leaf'}
+
+    def test_async_views_store_the_search_for_refinements(self):
+        from app import async_views
+
+        attributes = dict(self.attributes)
+        with mock.patch.object(async_views, 'afetch_icons', mock.AsyncMock(return_value=([], 'leaf summary', None))):
+            asyncio.run(async_views.icons_for_attributes(attributes, 'red', None, True, False))
+        self.assertEqual(attributes['query_by_llm'], 'leaf summary')
+        self.assertEqual(attributes['search_term'], 'leaf minimalist, UI icon')
+
+    def test_shape_refinement_is_one_search_without_the_llm(self):
+        from app import utils
+
+        attributes = {**self.attributes, 'query_by_llm': 'leaf summary', 'search_term': 'leaf minimalist, UI icon'}
+        client = mock.Mock()
+        client.search_icons.return_value = IconSearchResult(icons=[FreepikIcon(id=1, url='https://img.example/1.png')])
+        with mock.patch.object(utils, 'get_freepik_client', return_value=client), \
+                mock.patch.object(utils, 'get_chain') as get_chain:
+            icons, result, error = utils.fetch_icons_incremental(attributes, True, 'red', 'outline')
+
+        self.assertEqual((icons, result, error), ([{'id': 1, 'url': 'https://img.example/1.png'}], 'leaf summary', None))
+        client.search_icons.assert_called_once()
+        querystring = client.search_icons.call_args.args[0]
+        self.assertTrue(querystring['term'].startswith('leaf minimalist, UI icon'))
+        self.assertEqual(querystring['filters[shape]'], 'outline')
+        get_chain.assert_not_called()
+
+    def test_projects_without_a_previous_search_need_a_full_fetch(self):
+        from app.utils import build_incremental_icon_search
+
+        self.assertIsNone(build_incremental_icon_search(dict(self.attributes), True, None, 'outline'))
+
+
+def search_page(total):
+    return {'data': [{'id': 1, 'thumbnails': [{'url': 'https://img.example/1.png'}]}],
+            'meta': {'pagination': {'total': total}}}
+
+
+class SearchResultCacheTests(SimpleTestCase):
+    params = {'term': 'cat', 'page': '1'}
+
+    def sync_client(self, totals, ttl=60):
+        client = FreepikClient('key', search_cache=SearchResultCache(LocMemCacheBackend(), ttl=ttl, stale_ttl=600))
+        responses = []
+        for total in totals:
+            response = requests.Response()
+            response.status_code, response._content = 200, json.dumps(search_page(total)).encode()
+            responses.append(response)
+        client.session = mock.Mock()
+        client.session.request.side_effect = responses
+        return client
+
+    def test_equivalent_searches_share_an_entry(self):
+        client = self.sync_client([100])
+        client.search_icons({'term': 'Cat ', 'page': '1', 'filters[color]': ''})
+        client.search_icons({'page': 1, 'term': 'cat'})
+        self.assertEqual(client.session.request.call_count, 1)
+
+    def test_stale_entry_is_served_while_one_refresh_runs(self):
+        client = self.sync_client([100, 40], ttl=0)
+        self.assertEqual(client.search_icons(self.params).total, 100)
+        # Stale straight away: both lookups are answered from the cache, with a single refresh
+        self.assertEqual(client.search_icons(self.params).total, 100)
+        client.search_cache._executor.shutdown(wait=True)
+        self.assertEqual(client.session.request.call_count, 2)
+
+    def test_refresh_updates_the_known_total(self):
+        client = self.sync_client([100, 40], ttl=0)
+        client.search_icons(self.params)
+        client.search_icons(self.params)
+        client.search_cache._executor.shutdown(wait=True)
+        self.assertEqual(client.known_total({'term': 'cat', 'page': '3'}), 40)
+
+    def test_async_refresh_updates_the_known_total(self):
+        totals = iter([100, 40])
+
+        async def run():
+            client = AsyncFreepikClient('key', search_cache=SearchResultCache(LocMemCacheBackend(), ttl=0, stale_ttl=600))
+            client.client = httpx.AsyncClient(transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, json=search_page(next(totals)))))
+            try:
+                await client.search_icons(self.params)
+                await client.search_icons(self.params)
+                await asyncio.gather(*client.search_cache._refresh_tasks)
+                return await client.known_total(self.params)
+            finally:
+                await client.client.aclose()
+
+        self.assertEqual(asyncio.run(run()), 40)
+
+
+class SyncOnlyBackend(LocMemCacheBackend):
+    # Stands in for the DB cache, whose sync methods raise SynchronousOnlyOperation on the loop
+    def get(self, key):
+        raise AssertionError("sync get called from async code")
+
+    def set(self, key, value, ttl=None):
+        raise AssertionError("sync set called from async code")
+
+    async def aget(self, key):
+        return super().get(key)
+
+    async def aset(self, key, value, ttl=None):
+        super().set(key, value, ttl)
+
+
+class AsyncCacheTests(SimpleTestCase):
+    def test_filesystem_backend_does_its_io_off_the_event_loop(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = FileSystemCacheBackend(directory)
+            threads = []
+            original_get = backend.get
+
+            def get(key):
+                threads.append(threading.get_ident())
+                return original_get(key)
+
+            async def run():
+                await backend.aset('a', [1, 2])
+                with mock.patch.object(backend, 'get', side_effect=get):
+                    return await backend.aget('a'), threading.get_ident()
+
+            value, loop_thread = asyncio.run(run())
+        self.assertEqual(value, [1, 2])
+        self.assertNotIn(loop_thread, threads)
+
+    def test_async_search_reads_and_writes_through_the_async_cache_api(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request.url)
+            return httpx.Response(200, json={'data': [{'id': 1, 'thumbnails': [{'url': 'https://img.example/1.png'}]}],
+                                             'meta': {'pagination': {'total': 1}}})
+
+        async def run():
+            client = AsyncFreepikClient('key', search_cache=SearchResultCache(SyncOnlyBackend(), ttl=60))
+            client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            try:
+                first = await client.search_icons({'term': 'cat', 'page': '1'})
+                second = await client.search_icons({'term': 'cat', 'page': '1'})
+                # Any page of the search now knows its total
+                total = await client.known_total({'term': 'cat', 'page': '2'})
+            finally:
+                await client.client.aclose()
+            return first, second, total
+
+        first, second, total = asyncio.run(run())
+        self.assertEqual(total, 1)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([icon.id for icon in second.icons], [icon.id for icon in first.icons])
+
+    def test_async_vision_and_icons_query_use_the_async_cache_api(self):
+        from app import utils
+
+        chain = mock.Mock()
+        chain.ainvoke = mock.AsyncMock(return_value=mock.Mock(query='cat line icon'))
+        with mock.patch.object(utils, 'vision_cache', SyncOnlyBackend()), \
+                mock.patch.object(utils, 'icons_query_cache', SyncOnlyBackend()), \
+                mock.patch.object(utils, 'arun_vision_chain', mock.AsyncMock(return_value=('', {'style': 'line'}))), \
+                mock.patch.object(utils, 'get_chain', return_value=chain):
+            for _ in range(2):
+                self.assertEqual(asyncio.run(utils.aprocess_image_data(b'image bytes')), {'style': 'line'})
+                self.assertEqual(asyncio.run(utils.aprocess_icons_query('cat')), 'cat line icon')
+            self.assertEqual(utils.arun_vision_chain.await_count, 1)
+            self.assertEqual(chain.ainvoke.await_count, 1)
+
+
+def resolves_to(address):
+    return mock.patch('app.jobs.socket.getaddrinfo', return_value=[(2, 1, 6, '', (address, 443))])
+
+
+class CallbackURLTests(SimpleTestCase):
+    def test_internal_targets_are_refused(self):
+        for address in ('127.0.0.1', '10.0.0.5', '169.254.169.254', '::1', '::ffff:192.168.1.1', '224.0.0.1'):
+            with resolves_to(address), self.assertRaises(InvalidCallbackURL):
+                validate_callback_url('https://hooks.example.com/done')
+
+    def test_public_targets_are_allowed(self):
+        with resolves_to('93.184.216.34'):
+            validate_callback_url('https://hooks.example.com/done')
+
+    def test_only_http_urls_are_allowed(self):
+        with self.assertRaises(InvalidCallbackURL):
+            validate_callback_url('file:///etc/passwd')
+
+    @override_settings(JOB_CALLBACK_ALLOWED_HOSTS=['hooks.example.com'])
+    def test_allowlist(self):
+        with resolves_to('93.184.216.34'):
+            validate_callback_url('https://hooks.example.com/done')
+            with self.assertRaises(InvalidCallbackURL):
+                validate_callback_url('https://other.example.com/done')
+
+
+@override_settings(JOB_STALE_AFTER=60, JOB_MAX_ATTEMPTS=1)
+class StaleJobCallbackTests(TestCase):
+    def test_timed_out_job_fires_its_callback(self):
+        from app.models import GenerationJob
+
+        user = get_user_model().objects.create(username='jobs', email='jobs@example.com')
+        job = GenerationJob.objects.create(user=user, status=GenerationJob.STATUS_RUNNING, attempts=1,
+                                           locked_at=timezone.now() - timedelta(minutes=5),
+                                           callback_url='https://hooks.example.com/done')
+
+        with resolves_to('93.184.216.34'), mock.patch('app.jobs.requests.post') as post:
+            post.return_value.status_code = 204
+            self.assertEqual(requeue_stale_jobs(), 1)
+            # The job is no longer running, so the next sweep leaves it alone
+            requeue_stale_jobs()
+
+        post.assert_called_once()
+        self.assertEqual(post.call_args.args[0], 'https://hooks.example.com/done')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.callback_status), (GenerationJob.STATUS_FAILED, 204))
+
+
+class RetentionTests(TestCase):
+    icons = [{'id': 1234, 'url': 'https://cdn.example.com/1234.png'}, {'id': 7, 'url': 'https://cdn.example.com/7.png'}]
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='retention', email='retention@example.com')
+
+    def add_project(self):
+        from app.models import Project
+
+        project = Project(user=self.user, attributes={'shape': 'round'}, f_icons=list(self.icons))
+        project.save()
+        return project
+
+    def test_size_is_the_same_before_and_after_save(self):
+        from app.models import Project
+
+        project = Project(user=self.user, attributes={'shape': 'round'}, f_icons=list(self.icons))
+        expected = len('{"shape": "round"}') + sum(len(str(icon['id'])) + len(icon['url']) for icon in self.icons)
+        self.assertEqual(project_size(project), expected)
+        project.save()
+        self.assertEqual(project.f_icons, [])
+        self.assertEqual(project_size(project), expected)
+        self.assertEqual(Project.objects.annotate(size=project_size()).get(pk=project.pk).size, expected)
+
+    def test_byte_limit_keeps_the_projects_that_fit_exactly(self):
+        from app.models import Project
+
+        size = project_size(Project(attributes={'shape': 'round'}, f_icons=list(self.icons)))
+        for max_bytes, kept in ((3 * size, 3), (3 * size - 1, 2)):
+            with self.subTest(max_bytes=max_bytes), self.settings(
+                    PROJECT_RETENTION_MAX_COUNT=0, PROJECT_RETENTION_MAX_AGE_DAYS=0, PROJECT_RETENTION_MAX_BYTES=max_bytes):
+                Project.objects.filter(user=self.user).delete()
+                projects = [self.add_project() for _ in range(5)]
+                self.assertEqual(set(Project.objects.filter(user=self.user).values_list('pk', flat=True)),
+                                 {project.pk for project in projects[-kept:]})
+
+
+@override_settings(PROJECT_HISTORY_MAX_VERSIONS=2)
+class HistoryPruningTests(TestCase):
+    def icons(self, first_id):
+        return [{'id': icon_id, 'url': f'https://cdn.example.com/{icon_id}.png'} for icon_id in (first_id, first_id + 1)]
+
+    def test_old_versions_and_the_result_sets_only_they_used_are_deleted(self):
+        from app.models import IconResultSet, Project
+
+        user = get_user_model().objects.create(username='history', email='history@example.com')
+        project = Project(user=user, attributes={'shape': 'round'})
+        result_sets = {}
+        for version, first_id in enumerate((10, 20, 30, 20)):
+            project.f_icons = self.icons(first_id)
+            project.save_with_historical_record()
+            result_sets.setdefault(first_id, project.icon_result_set_id)
+            self.assertEqual(project.history.count(), min(version + 1, 2))
+
+        # The set of the 20s is current again after being pruned with its first version, the 30s
+        # belong to the kept version, and the 10s were only referenced by a pruned one
+        self.assertEqual(project.icon_result_set_id, result_sets[20])
+        kept = {result_sets[20], result_sets[30]}
+        self.assertEqual(set(project.history.values_list('icon_result_set', flat=True)), kept)
+        self.assertEqual(set(IconResultSet.objects.values_list('pk', flat=True)), kept)
+
+
+class ProjectNameTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='names', email='names@example.com')
+
+    def next_name(self, *taken, user=None):
+        from app.models import Project
+
+        for name in taken:
+            Project(user=user or self.user, name=name).save()
+        return Project(user=self.user).allocate_name()
+
+    def test_first_project_is_untitled(self):
+        self.assertEqual(self.next_name(), 'Untitled')
+
+    def test_numbering_continues_after_the_highest_suffix(self):
+        # Gaps are not reused, and suffixes compare as numbers
+        self.assertEqual(self.next_name('Untitled 3'), 'Untitled 4')
+        self.assertEqual(self.next_name('Untitled', 'Untitled 9', 'Untitled 10'), 'Untitled 11')
+
+    def test_other_names_and_other_users_are_ignored(self):
+        other = get_user_model().objects.create(username='other', email='other@example.com')
+        self.next_name('Untitled 7', user=other)
+        self.assertEqual(self.next_name('Untitled draft', 'My Untitled 5', 'Untitled 2b'), 'Untitled')
+
+
+@override_settings(PROJECT_RETENTION_MAX_COUNT=3, PROJECT_RETENTION_MAX_AGE_DAYS=0, PROJECT_RETENTION_MAX_BYTES=0)
+class RetentionConcurrencyTests(TransactionTestCase):
+    threads = 6
+    projects = 4
+
+    def test_concurrent_saves_keep_the_cap_and_unique_names(self):
+        from app.models import Project
+
+        user = get_user_model().objects.create(username='retention', email='retention@example.com')
+        start = threading.Barrier(self.threads)
+        errors, names, observed = [], Counter(), []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.projects):
+                    project = Project(user=user, attributes={'stress': True})
+                    project.save()
+                    count = Project.objects.filter(user=user).count()
+                    with lock:
+                        names[project.name] += 1
+                        observed.append(count)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(names.values()), self.threads * self.projects)
+        self.assertEqual([name for name, seen in names.items() if seen > 1], [])
+        self.assertLessEqual(max(observed), 3)
+        self.assertEqual(Project.objects.filter(user=user).count(), 3)
+
+
+@override_settings(VISION_IMAGE_MAX_EDGE=2048)
+class DescribeImageCacheTests(SimpleTestCase):
+    def test_cache_hit_skips_preprocessing(self):
+        from app import utils
+
+        prepared = mock.Mock(payload=b'prepared', mime_type='image/jpeg', detail='low')
+        with mock.patch.object(utils, 'vision_cache', LocMemCacheBackend()), \
+                mock.patch.object(utils, 'prepare_vision_image', return_value=prepared) as prepare, \
+                mock.patch.object(utils, 'process_image_data', return_value={'style': 'line'}), \
+                mock.patch.object(utils, 'with_palette', side_effect=lambda info, image: info):
+            self.assertEqual(utils.describe_image(b'upload'), {'style': 'line'})
+            self.assertEqual(asyncio.run(utils.adescribe_image(b'upload')), {'style': 'line'})
+            self.assertEqual(prepare.call_count, 1)
+
+            # Other preprocessing settings describe the image anew
+            with override_settings(VISION_IMAGE_MAX_EDGE=1024):
+                utils.describe_image(b'upload')
+            self.assertEqual(prepare.call_count, 2)
+
+
+def encode_image(size, mode='RGB', image_format='PNG', color=(200, 30, 30)):
+    output = io.BytesIO()
+    Image.new(mode, size, color).save(output, format=image_format)
+    return output.getvalue()
+
+
+@override_settings(VISION_IMAGE_MAX_EDGE=2048, VISION_IMAGE_SHORT_EDGE=768, VISION_IMAGE_FORMAT='auto',
+                   VISION_IMAGE_QUALITY=85, VISION_IMAGE_DETAIL='auto')
+class PrepareImageTests(SimpleTestCase):
+    def test_large_screenshots_are_downscaled_to_what_the_model_sees(self):
+        prepared = prepare_image(encode_image((4000, 3000)))
+        self.assertEqual((prepared.width, prepared.height, prepared.detail), (1024, 768, 'high'))
+        self.assertEqual(Image.open(prepared.payload.open()).size, (1024, 768))
+        self.assertLess(prepared.bytes_out, prepared.bytes_in)
+
+    def test_small_images_use_low_detail(self):
+        prepared = prepare_image(encode_image((300, 200)))
+        self.assertEqual((prepared.width, prepared.height, prepared.detail), (300, 200, 'low'))
+
+    def test_original_bytes_are_kept_when_reencoding_does_not_help(self):
+        original = encode_image((300, 200), mode='L', color=0)
+        prepared = prepare_image(original)
+        self.assertEqual((bytes(prepared.payload.view), prepared.mime_type), (original, 'image/png'))
+
+    def test_transparency_is_flattened_onto_white(self):
+        prepared = prepare_image(encode_image((3000, 3000), mode='RGBA', color=(0, 0, 0, 0)), image_format='JPEG')
+        image = Image.open(prepared.payload.open())
+        self.assertEqual((prepared.mime_type, image.mode), ('image/jpeg', 'RGB'))
+        self.assertGreater(min(image.getpixel((10, 10))), 250)
+
+    def test_undecodable_bytes_are_passed_through(self):
+        prepared = prepare_image(b'not an image')
+        self.assertEqual((bytes(prepared.payload.view), prepared.width), (b'not an image', 0))
+
+    def test_target_size_respects_both_edges(self):
+        self.assertEqual(target_size(4000, 1000, 2048, 768), (2048, 512))
+        self.assertEqual(target_size(500, 400, 2048, 768), (500, 400))
+
+
+class FakeResponse:
+    def __init__(self, chunks, content_length=None, status_code=200, headers=None):
+        self.headers = {'Content-Length': str(content_length)} if content_length is not None else {}
+        self.headers.update(headers or {})
+        self.status_code = status_code
+        self.chunks = chunks
+        self.read = 0
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}", response=self)
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+@override_settings(REMOTE_IMAGE_MAX_BYTES=1024, ICON_CACHE_HOSTS=['freepik.com'])
+class IconBlobCacheTests(SimpleTestCase):
+    url = 'https://cdn-icons-png.freepik.com/128/1.png'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = IconBlobCache(directory.name, max_bytes=1000, max_age=60, max_entry_fraction=0.5)
+        self.requests = []
+
+    def fetch(self, url, *responses, identifier=1):
+        responses = list(responses)
+
+        def request(method, url, headers=None, **kwargs):
+            self.requests.append(dict(headers or {}))
+            return responses.pop(0)
+
+        with mock.patch('app.icon_cache.get_download_client') as client:
+            client.return_value.request.side_effect = request
+            return self.cache.fetch(identifier, url, variant='thumbnail')
+
+    def stored(self):
+        with self.cache._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+
+    def test_fresh_entry_is_served_without_a_request(self):
+        self.assertEqual(self.fetch(self.url, FakeResponse([b'icon'])), b'icon')
+        self.assertEqual(self.fetch(self.url), b'icon')
+        self.assertEqual(len(self.requests), 1)
+
+    def test_stale_entry_is_revalidated_with_its_etag(self):
+        self.fetch(self.url, FakeResponse([b'icon'], headers={'ETag': '"v1"'}))
+        self.cache.max_age = 0
+        self.assertEqual(self.fetch(self.url, FakeResponse([], status_code=304)), b'icon')
+        self.assertEqual(self.requests[-1]['If-None-Match'], '"v1"')
+
+    def test_least_recently_used_blobs_are_evicted(self):
+        for identifier in range(4):
+            self.fetch(self.url, FakeResponse([bytes([identifier]) * 300]), identifier=identifier)
+        # 1200 bytes written into a 1000 byte cache: only the oldest blob had to go
+        self.assertEqual(self.stored(), 3)
+        self.assertEqual(self.fetch(self.url, FakeResponse([b'again']), identifier=0), b'again')
+
+    def test_other_hosts_are_downloaded_but_not_stored(self):
+        self.assertEqual(self.fetch('https://attacker.example/big.png', FakeResponse([b'x' * 400])), b'x' * 400)
+        self.assertEqual(self.stored(), 0)
+
+    def test_blobs_over_the_entry_limit_do_not_evict_the_others(self):
+        self.fetch(self.url, FakeResponse([b'a' * 400]), identifier=1)
+        self.assertEqual(self.fetch(self.url, FakeResponse([b'b' * 600]), identifier=2), b'b' * 600)
+        self.assertEqual(self.stored(), 1)
+        self.assertEqual(self.fetch(self.url, identifier=1), b'a' * 400)
+
+    def test_download_size_is_capped(self):
+        response = FakeResponse(iter([b'x' * 600] * 100))
+        with self.assertRaises(ImageTooLarge):
+            self.fetch(self.url, response)
+        self.assertTrue(response.closed)
+        self.assertEqual(self.stored(), 0)
+
+
+@override_settings(REMOTE_IMAGE_MAX_BYTES=1024)
+class RemoteImageLimitTests(SimpleTestCase):
+    def test_oversized_content_length_is_refused_before_reading(self):
+        response = FakeResponse([b'x' * 10], content_length=10 * 1024 ** 3)
+        with self.assertRaises(ImageTooLarge):
+            ImagePayload.from_response(response)
+        self.assertEqual(response.read, 0)
+        self.assertTrue(response.closed)
+
+    def test_body_is_abandoned_once_it_passes_the_limit(self):
+        # No Content-Length, so the limit is enforced while streaming
+        response = FakeResponse(iter([b'x' * 600] * 1000))
+        with self.assertRaises(ImageTooLarge):
+            ImagePayload.from_response(response)
+        self.assertEqual(response.read, 2)
+
+    def test_bodies_within_the_limit_are_read_whole(self):
+        response = FakeResponse([b'ab', b'cd'], content_length=4)
+        self.assertEqual(bytes(ImagePayload.from_response(response).view), b'abcd')
+
+    def test_async_download_is_limited_too(self):
+        async def run(body):
+            client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body)))
+            async with client.stream('GET', 'https://img.example/screen.png') as response:
+                return await ImagePayload.afrom_response(response)
+
+        self.assertEqual(bytes(asyncio.run(run(b'png')).view), b'png')
+        with self.assertRaises(ImageTooLarge):
+            asyncio.run(run(b'x' * 2048))
+
+
+class ExtractedPaletteTests(SimpleTestCase):
+    @override_settings(PALETTE_EXTRACTION=True)
+    def test_model_color_palette_is_kept(self):
+        from io import BytesIO
+
+        from PIL import Image
+
+        from app.utils import image_attributes, palette_color_source, with_palette
+
+        buffer = BytesIO()
+        Image.new('RGB', (32, 32), (200, 30, 30)).save(buffer, 'PNG')
+        described = with_palette({'color_palette': 'Warm reds with cream accents'}, buffer.getvalue())
+        attributes = image_attributes(described)
+
+        self.assertEqual(attributes['color_palette'], 'Warm reds with cream accents')
+        self.assertTrue(attributes['extracted_palette'].startswith('#'))
+        self.assertEqual(palette_color_source(attributes), attributes['extracted_palette'])
+        self.assertEqual(palette_color_source({'color_palette': 'blue'}), 'blue')
+
+
+class FakeSearchClient:
+    """
+    Freepik search stand-in: pages[n] is the list of icon IDs page n returns.
+    """
+
+    def __init__(self, total, pages, known_total=None):
+        self.total, self.pages, self._known_total = total, pages, known_total
+        self.requested = []
+
+    def search_icons(self, params):
+        page = int(params['page'])
+        self.requested.append(page)
+        icons = [FreepikIcon(id=icon_id, url=f'https://img.example/{icon_id}.png') for icon_id in self.pages.get(page, [])]
+        return IconSearchResult(icons=icons, total=self.total, page=page, per_page=int(params['per_page']))
+
+    def known_total(self, params):
+        return self._known_total
+
+
+class AsyncFakeSearchClient(FakeSearchClient):
+    async def search_icons(self, params):
+        return super().search_icons(params)
+
+    async def known_total(self, params):
+        return self._known_total
+
+
+@override_settings(FETCH_ICONS_TARGET=150, FETCH_ICONS_MAX_TOPUPS=1, FETCH_ICONS_CONCURRENT=True)
+class FetchIconsPagesTests(SimpleTestCase):
+    def fetch(self, client):
+        from app import utils
+
+        args = (False, False, 'red', 'flat', 'modern', 'none', 'nature', 'none', 'thin', 'round', 'leaf', 'red')
+        with mock.patch.object(utils, 'process_icons_query', return_value='leaf icon'), \
+                mock.patch.object(utils, 'aprocess_icons_query', mock.AsyncMock(return_value='leaf icon')):
+            if isinstance(client, AsyncFakeSearchClient):
+                with mock.patch.object(utils, 'get_async_freepik_client', return_value=client):
+                    icons, _, error = asyncio.run(utils.afetch_icons(*args))
+            else:
+                with mock.patch.object(utils, 'get_freepik_client', return_value=client):
+                    icons, _, error = utils.fetch_icons(*args)
+        self.assertIsNone(error)
+        return [icon['id'] for icon in icons]
+
+    def test_duplicates_are_topped_up_to_the_target(self):
+        pages = {1: range(0, 75), 2: range(50, 125), 3: range(125, 200)}
+        for client_class in (FakeSearchClient, AsyncFakeSearchClient):
+            client = client_class(total=400, pages=pages)
+            ids = self.fetch(client)
+            self.assertEqual(ids, list(range(150)))
+            self.assertEqual(sorted(client.requested), [1, 2, 3])
+
+    def test_sync_top_ups_do_not_use_the_shared_pool(self):
+        from app import utils
+
+        pages = {1: range(0, 75), 2: range(50, 125), 3: range(125, 200)}
+        with self.settings(FETCH_ICONS_CONCURRENT=False), \
+                mock.patch.object(utils.icon_search_executor, 'submit', side_effect=AssertionError("pool used")):
+            self.assertEqual(self.fetch(FakeSearchClient(total=400, pages=pages)), list(range(150)))
+
+    def test_pages_past_the_total_are_dropped_in_both_paths(self):
+        # Freepik repeats its last page for out of range requests
+        pages = {1: range(0, 60), 2: range(0, 60)}
+        for client_class in (FakeSearchClient, AsyncFakeSearchClient):
+            self.assertEqual(self.fetch(client_class(total=60, pages=pages)), list(range(60)))
+
+    def test_known_total_skips_the_speculative_page(self):
+        for client_class in (FakeSearchClient, AsyncFakeSearchClient):
+            client = client_class(total=60, pages={1: range(0, 60)}, known_total=60)
+            self.assertEqual(self.fetch(client), list(range(60)))
+            self.assertEqual(client.requested, [1])
+
+
+class MigrateIconResultsTests(TransactionTestCase):
+    def test_history_of_deleted_project_is_migrated(self):
+        from app.models import IconResultSet, Project
+
+        user = get_user_model().objects.create(username='migrate', email='migrate@example.com')
+        project = Project(user=user, attributes={})
+        project.save_with_historical_record()
+        project_id = project.id
+        project.delete()
+        icons = [{'id': 1, 'url': 'https://cdn.example.com/1.png'}, {'id': 2, 'url': 'https://cdn.example.com/2.png'}]
+        # History written before result sets existed
+        Project.history.filter(id=project_id).update(f_icons=icons, icon_result_set=None)
+
+        call_command('migrate_icon_results', sleep=0, stdout=io.StringIO())
+
+        versions = Project.history.filter(id=project_id)
+        self.assertFalse(versions.filter(icon_result_set__isnull=True).exists())
+        result_set = IconResultSet.objects.get(pk=versions.first().icon_result_set_id)
+        self.assertEqual((result_set.project_id, result_set.count), (None, 2))
+
+
+class PaginateIconsTests(TestCase):
+    icons = [{'id': i, 'url': f'https://cdn.example.com/{i}.png'} for i in range(3)]
+
+    def project(self, username):
+        from app.models import Project
+
+        user = get_user_model().objects.create(username=username, email=f'{username}@example.com')
+        project = Project(user=user, attributes={}, f_icons=list(self.icons))
+        project.save_with_historical_record()
+        return project
+
+    def test_history_of_evicted_project_pages_through(self):
+        project = self.project('evicted')
+        history_obj = project.history.first()
+        project.delete()
+
+        page = paginate_icons(history_obj, page_size=2)
+        self.assertEqual([icon['id'] for icon in page.results], [0, 1])
+        page = paginate_icons(history_obj, page.next_cursor, page_size=2)
+        self.assertEqual(([icon['id'] for icon in page.results], page.has_more), ([2], False))
+        self.assertEqual(len(paginate_icons(history_obj, page=2, page_size=2).results), 1)
+
+    def test_legacy_page_size_covers_a_whole_result_set(self):
+        from app.models import Project
+
+        user = get_user_model().objects.create(username='legacy', email='legacy@example.com')
+        icons = [{'id': i, 'url': f'https://cdn.example.com/{i}.png'} for i in range(150)]
+        project = Project(user=user, attributes={}, f_icons=icons)
+        project.save()
+
+        page_size = page_size_param('150')
+        page = paginate_icons(project, page_size=page_size, page=1)
+        self.assertEqual((page_size, len(page.results), page.has_more), (150, 150, False))
+
+    def test_cursor_of_another_project_is_rejected(self):
+        project, other = self.project('owner'), self.project('other')
+        with self.assertRaises(InvalidCursor):
+            paginate_icons(project, encode_cursor(other.icon_result_set_id, 0))
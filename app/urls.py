@@ -14,11 +14,16 @@ from app.views import (
     DownloadIconsZip,
     GenerateIconVariationsAPIView,
     ExchangeFigmaCodeForTokenView,
-    DownloadSingleFreepikIconView
+    DownloadSingleFreepikIconView,
+    GenerationJobCreateView,
+    GenerationJobStatusView
 )
+from app.async_views import AsyncImageProcessView, AsyncFigmaLinkProcessAPI, AsyncImageLinkProcessAPI
 
 urlpatterns = [
     path('uploadImage/', ImageProcessView.as_view(), name='ImageProcessView'),
+    path('jobs/uploadImage/', GenerationJobCreateView.as_view(), name='generation_job_create'),
+    path('jobs/<uuid:job_id>/', GenerationJobStatusView.as_view(), name='generation_job_status'),
     path('figmaLink/', FigmaLinkProcessAPI.as_view(), name='testImage'),
     path('imageLink/', ImageLinkProcessAPI.as_view(), name='testImage'),
     path('similarIconSearch/', SimilarIconSearchAPI.as_view(), name='similar_icon_search'),
@@ -33,4 +38,9 @@ urlpatterns = [
     path('getHistoryByHistoryId/', GetHistoryByHistoryIdApi.as_view(), name='get_history_by_history_id'),
     path('generateIconVariations/', GenerateIconVariationsAPIView.as_view(), name='generate_icon_variations'),
     path('exchangeFigmaCodeForToken/', ExchangeFigmaCodeForTokenView.as_view(), name='exchange_figma_code_for_token'),
+
+    # ASGI-native variants of the generation endpoints
+    path('async/uploadImage/', AsyncImageProcessView.as_view(), name='AsyncImageProcessView'),
+    path('async/figmaLink/', AsyncFigmaLinkProcessAPI.as_view(), name='async_figma_link'),
+    path('async/imageLink/', AsyncImageLinkProcessAPI.as_view(), name='async_image_link'),
 ]
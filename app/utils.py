@@ -2,16 +2,30 @@ from typing import Literal
 
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain.chains import TransformChain
 from langchain_core.messages import HumanMessage
 from langchain_openai import ChatOpenAI
-from langchain_core.runnables import chain
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from asgiref.sync import sync_to_async
 from django.conf import settings
 import requests
 from difflib import get_close_matches
 from pydantic import ValidationError
+import asyncio
 import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app.cache import content_hash, get_cache_backend
+from app.chains import get_chain, register_chain
+from app.colors import match_color
+from app.freepik import (
+    MAX_PER_PAGE, FreepikError, get_async_freepik_client, get_freepik_client, last_page, merge_search_results,
+    page_windows
+)
+from app.imaging import ImagePayload, PreparedImage, prepare_image
+from app.palette import extract_palette
 
 model = ChatOpenAI(temperature=0.5, model="gpt-4o-mini", max_tokens=1024)
 
@@ -29,78 +43,77 @@ class ImageInformation(BaseModel):
 parser = JsonOutputParser(pydantic_object=ImageInformation)
 
 
-def process_image_data(image_base64: str):
-    # vision_prompt = """Instruction:
-    # Analyze the design to extract specific visual attributes. 
-    # Review the design carefully and identify the following 
-    # attributes:
+# vision_prompt = """Instruction:
+# Analyze the design to extract specific visual attributes. 
+# Review the design carefully and identify the following 
+# attributes:
     
-    # 1.Color Palette:
-    # • Identify the color used in the design.
-    # • Determine the accent color that complements the primary palette.
-    # • Note the background color.
-    # • Assess the contrast level (high contrast vs. low contrast).
-    # • Get Major color only, and it should be only one color name
-
-    # 2. Iconography:
-    # • Check if the design includes any icons.
-    # • Identify the style of the icons (choose one: Flat, Outline, Filled).
-    # • Observe the relative size of the icons (choose one: Small, Medium, Large).
-    # • Describe the shape of the icons (choose one: Rounded, Square, Freeform).
-
-    # 3.Brand Style:
-    # • Determine the overall style and tone of the design.
-    #     Categorize it as one of the following:
-    #     • Corporate: Formal, professional, typically used for business or financial services.
-    #     • Casual: Friendly, relaxed, often seen in lifestyle or personal brand designs.
-    #     • Modern: Minimalistic, clean, often characterized by simplicity and elegance.
-    #     • Playful: Vibrant, fun, colorful, often used for children’s products or entertainment brands.
-    #     If the design represents a specific industry (e.g., healthcare, technology, education), specify that \
-    #     industry as the brand style** (e.g., "Healthcare," "Technology," "Education"). Identify the industry based \
-    #     on any specific visual cues, symbols, or elements related to that field (e.g., stethoscopes for healthcare, \
-    #     computers for technology).
-
-
-    # 4. Imagery:
-    # • Note the style of imagery used (choose one: Illustrative, Photorealistic).
-    # • Identify the theme of the imagery (choose one: Nature, Technology, Abstract).
-
-    # 5. Gradient Usage:
-    # • Detect the presence of gradients in the design.
-    # • If gradients are present, identify the direction (choose one: Linear, Radial) and the dominant gradient color stop.
-    # • If no gradients are present, label this as "None".
-
-    # 6. Shadow and Depth:
-    # • Check for the use of shadows (choose one: Drop shadows, Inner shadows, None).
-    # • Determine the depth effect created by these shadows (choose one: Flat, Elevated).
-
-    # 7. Line Thickness:
-    # • Assess the consistency of line weight throughout the design (choose one: Thick, Thin, Variable).
-
-    # 8. Corner Rounding:
-    # •  Identify the degree of corner rounding in shapes (choose one: Sharp corners, Slightly rounded, Fully rounded).
-
-    # 9. Description:
-    # •  Description should contain up to 10 nouns that best describe the content. Rank the nouns for description according to how well they describe the picture. Give description as single string with list of up to 10 nouns separated by comma, without numbering and new line. Ensure the nouns cover both direct and related concepts to capture a wide variety of possible icons.
-    # •  If the design represents a specific website page or app screen, include relevant keywords (e.g., "homepage," "profile," "dashboard," "settings").
+# 1.Color Palette:
+# • Identify the color used in the design.
+# • Determine the accent color that complements the primary palette.
+# • Note the background color.
+# • Assess the contrast level (high contrast vs. low contrast).
+# • Get Major color only, and it should be only one color name
+
+# 2. Iconography:
+# • Check if the design includes any icons.
+# • Identify the style of the icons (choose one: Flat, Outline, Filled).
+# • Observe the relative size of the icons (choose one: Small, Medium, Large).
+# • Describe the shape of the icons (choose one: Rounded, Square, Freeform).
+
+# 3.Brand Style:
+# • Determine the overall style and tone of the design.
+#     Categorize it as one of the following:
+#     • Corporate: Formal, professional, typically used for business or financial services.
+#     • Casual: Friendly, relaxed, often seen in lifestyle or personal brand designs.
+#     • Modern: Minimalistic, clean, often characterized by simplicity and elegance.
+#     • Playful: Vibrant, fun, colorful, often used for children’s products or entertainment brands.
+#     If the design represents a specific industry (e.g., healthcare, technology, education), specify that \
+#     industry as the brand style** (e.g., "Healthcare," "Technology," "Education"). Identify the industry based \
+#     on any specific visual cues, symbols, or elements related to that field (e.g., stethoscopes for healthcare, \
+#     computers for technology).
+
+
+# 4. Imagery:
+# • Note the style of imagery used (choose one: Illustrative, Photorealistic).
+# • Identify the theme of the imagery (choose one: Nature, Technology, Abstract).
+
+# 5. Gradient Usage:
+# • Detect the presence of gradients in the design.
+# • If gradients are present, identify the direction (choose one: Linear, Radial) and the dominant gradient color stop.
+# • If no gradients are present, label this as "None".
+
+# 6. Shadow and Depth:
+# • Check for the use of shadows (choose one: Drop shadows, Inner shadows, None).
+# • Determine the depth effect created by these shadows (choose one: Flat, Elevated).
+
+# 7. Line Thickness:
+# • Assess the consistency of line weight throughout the design (choose one: Thick, Thin, Variable).
+
+# 8. Corner Rounding:
+# •  Identify the degree of corner rounding in shapes (choose one: Sharp corners, Slightly rounded, Fully rounded).
+
+# 9. Description:
+# •  Description should contain up to 10 nouns that best describe the content. Rank the nouns for description according to how well they describe the picture. Give description as single string with list of up to 10 nouns separated by comma, without numbering and new line. Ensure the nouns cover both direct and related concepts to capture a wide variety of possible icons.
+# •  If the design represents a specific website page or app screen, include relevant keywords (e.g., "homepage," "profile," "dashboard," "settings").
 
     
-    # Output:
-    # • For each of the above attributes, populate the results as a single keyword representing the attribute detected. \
-    # Avoid using non-descriptive answers like "Yes" or "No"; instead, specify relevant details or use "None" where \
-    # applicable.
-    # Example Output:
-    #     • Color Palette: Blue, Yellow, White, Gradient, Rainbow
-    #     • Iconography: Flat, Medium, Rounded
-    #     • Brand Style: Corporate
-    #     • Imagery: Illustrative, Technology
-    #     • Gradient Usage: Linear, Blue-Yellow
-    #     • Shadow and Depth: Drop shadows, Elevated
-    #     • Line Thickness: Thin
-    #     • Corner Rounding: Slightly rounded
-    #     • Description: boxing, gloves, club, website, training, excellence, athletes, sport, youth, sessions"""
-
-    vision_prompt = """Instruction:
+# Output:
+# • For each of the above attributes, populate the results as a single keyword representing the attribute detected. \
+# Avoid using non-descriptive answers like "Yes" or "No"; instead, specify relevant details or use "None" where \
+# applicable.
+# Example Output:
+#     • Color Palette: Blue, Yellow, White, Gradient, Rainbow
+#     • Iconography: Flat, Medium, Rounded
+#     • Brand Style: Corporate
+#     • Imagery: Illustrative, Technology
+#     • Gradient Usage: Linear, Blue-Yellow
+#     • Shadow and Depth: Drop shadows, Elevated
+#     • Line Thickness: Thin
+#     • Corner Rounding: Slightly rounded
+#     • Description: boxing, gloves, club, website, training, excellence, athletes, sport, youth, sessions"""
+
+VISION_PROMPT = """Instruction:
     Analyze the Figma design to extract detailed visual and contextual attributes. 
     Review the design carefully and identify the following elements:
 
@@ -168,34 +181,194 @@ def process_image_data(image_base64: str):
         • Corner Rounding: Slightly rounded
         • Description: boxing, gloves, club, website, training, excellence, athletes, sport, youth, sessions"""
 
-    # chain decorator to make it runnable
-    @chain
-    def image_model(inputs: dict):
-        msg = model.invoke(
-            [HumanMessage(
-                content=[
-                    {"type": "text", "text": inputs["prompt"]},
-                    {"type": "text", "text": parser.get_format_instructions()},
-                    {"type": "image_url", "image_url": {
-                        "url": f"data:image/jpeg;base64,{inputs['image']}"}},
-                ])]
-        )
-        print("Milos msg.content in utils.py")
-        print(msg.content)
-        return msg.content
-
-    load_image_chain = TransformChain(
-        input_variables=["image"],
-        output_variables=["image"],
-        transform=lambda x: {"image": image_base64}
-    )
 
-    vision_chain = load_image_chain | image_model | parser
-    milos_chain = load_image_chain | image_model
-    print("Milos load_image_chain in utils.py")
-    print(milos_chain.invoke({'image': image_base64, 'prompt': vision_prompt}))
-    return vision_chain.invoke({'image': image_base64, 'prompt': vision_prompt})
+def vision_messages(inputs: dict) -> list:
+    return [HumanMessage(
+        content=[
+            {"type": "text", "text": inputs["prompt"]},
+            {"type": "text", "text": parser.get_format_instructions()},
+            {"type": "image_url", "image_url": {"url": inputs['image_url'], "detail": inputs.get('detail', 'auto')}},
+        ])]
+
+
+def _invoke_image_model(inputs: dict):
+    return model.invoke(vision_messages(inputs)).content
+
+
+async def _ainvoke_image_model(inputs: dict):
+    msg = await model.ainvoke(vision_messages(inputs))
+    return msg.content
+
+
+# Runnable with a native async path, so ainvoke awaits the model instead of parking a thread on it
+image_model = RunnableLambda(_invoke_image_model, afunc=_ainvoke_image_model)
+
+
+# The model is invoked once; its raw text is fanned out to the parser so callers
+# can inspect the unparsed output without paying for a second vision request.
+vision_chain = image_model | RunnableParallel(raw=RunnablePassthrough(), parsed=parser)
+
+
+def run_vision_chain(image_url: str, detail: str = 'auto') -> tuple:
+    """
+    Run the vision model once over an image.
+
+    Args:
+        image_url (str): The image as a base64 data URL (see ImagePayload.data_url).
+        detail (str): Vision detail level, "low", "high" or "auto".
+
+    Returns:
+        tuple: (str, dict) - The raw model text and the parsed ImageInformation attributes.
+    """
+    output = vision_chain.invoke({'image_url': image_url, 'detail': detail, 'prompt': VISION_PROMPT})
+    if settings.VISION_DEBUG:
+        print("Raw vision output:")
+        print(output["raw"])
+    return output["raw"], output["parsed"]
+
+
+async def arun_vision_chain(image_url: str, detail: str = 'auto') -> tuple:
+    """
+    Async variant of run_vision_chain.
+    """
+    output = await vision_chain.ainvoke({'image_url': image_url, 'detail': detail, 'prompt': VISION_PROMPT})
+    if settings.VISION_DEBUG:
+        print("Raw vision output:")
+        print(output["raw"])
+    return output["raw"], output["parsed"]
+
+
+# Cached attributes are only valid for the prompt and model that produced them
+VISION_PROMPT_VERSION = content_hash(VISION_PROMPT, model.model_name)[:16]
+
+vision_cache = get_cache_backend(
+    settings.VISION_CACHE_BACKEND,
+    ttl=settings.VISION_CACHE_TTL,
+    max_entries=settings.VISION_CACHE_MAX_ENTRIES,
+    directory=settings.VISION_CACHE_DIR,
+    alias=settings.VISION_CACHE_ALIAS,
+    key_prefix='vision:',
+)
+
+
+def vision_cache_key(image: ImagePayload, detail: str = 'auto') -> str:
+    # Hashed straight from the payload's memoryview, without encoding or copying the image
+    return content_hash(image.view, detail, VISION_PROMPT_VERSION)
+
+
+def describe_cache_key(image: ImagePayload) -> str:
+    """
+    Key of describe_image's result: the upload as received plus every setting that changes how it
+    is preprocessed, so a hit skips decoding, resizing and re-encoding altogether.
+    """
+    preprocessing = json.dumps([
+        settings.VISION_IMAGE_MAX_EDGE, settings.VISION_IMAGE_SHORT_EDGE, settings.VISION_IMAGE_FORMAT,
+        settings.VISION_IMAGE_QUALITY, settings.VISION_IMAGE_DETAIL,
+        settings.PALETTE_EXTRACTION, settings.PALETTE_SIZE, settings.PALETTE_SAMPLE_EDGE,
+    ])
+    return content_hash('describe', image.view, preprocessing, VISION_PROMPT_VERSION)
+
+
+def process_image_data(image, mime_type: str = 'image/jpeg', detail: str = 'auto'):
+    """
+    Extract the ImageInformation attributes of an image, reading through the vision cache.
+
+    Args:
+        image (ImagePayload or bytes): The encoded image.
+        mime_type (str): MIME type of the image.
+        detail (str): Vision detail level, "low", "high" or "auto".
+    """
+    image = ImagePayload.wrap(image)
+    cache_key = vision_cache_key(image, detail)
+    cached = vision_cache.get(cache_key)
+    if cached is not None:
+        print("Vision attributes served from cache")
+        return cached
+
+    raw_output, image_information = run_vision_chain(image.data_url(mime_type), detail)
+    vision_cache.set(cache_key, image_information)
+    return image_information
+
+
+async def aprocess_image_data(image, mime_type: str = 'image/jpeg', detail: str = 'auto'):
+    image = ImagePayload.wrap(image)
+    cache_key = vision_cache_key(image, detail)
+    cached = await vision_cache.aget(cache_key)
+    if cached is not None:
+        print("Vision attributes served from cache")
+        return cached
+
+    raw_output, image_information = await arun_vision_chain(image.data_url(mime_type), detail)
+    await vision_cache.aset(cache_key, image_information)
+    return image_information
+
+
+def prepare_vision_image(image) -> PreparedImage:
+    prepared = prepare_image(image)
+    print(f"Vision image {prepared.width}x{prepared.height} {prepared.mime_type} detail={prepared.detail}: "
+          f"{prepared.bytes_in} -> {prepared.bytes_out} bytes ({prepared.bytes_saved} saved)")
+    return prepared
+
+
+def with_palette(image_information: dict, image) -> dict:
+    """
+    Add the palette extracted from the pixels (app.palette) as extracted_palette. The model's
+    descriptive color_palette is kept as it is; the extracted one only picks the Freepik color
+    filter (see palette_color_source). Its first entry decides the filter, so find_closest_color
+    resolves it locally.
+    """
+    if not settings.PALETTE_EXTRACTION:
+        return image_information
+    palette = extract_palette(image)
+    if not palette.colors:
+        return image_information
+    print(f"Extracted palette: {palette.summary}")
+    return {**image_information, 'extracted_palette': palette.summary}
+
+
+def describe_image(image):
+    """
+    Downscale and re-encode an image (app.imaging) and extract its ImageInformation.
+
+    The result is cached by the raw upload (see describe_cache_key) and looked up before any
+    preprocessing, so a repeated image costs one hash and one cache read.
+
+    Args:
+        image (ImagePayload or bytes): The image as uploaded or downloaded.
+
+    Returns:
+        dict: The parsed ImageInformation attributes.
+    """
+    image = ImagePayload.wrap(image)
+    cache_key = describe_cache_key(image)
+    cached = vision_cache.get(cache_key)
+    if cached is not None:
+        print("Image description served from cache")
+        return cached
 
+    prepared = prepare_vision_image(image)
+    image_information = process_image_data(prepared.payload, prepared.mime_type, prepared.detail)
+    description = with_palette(image_information, prepared.payload)
+    vision_cache.set(cache_key, description)
+    return description
+
+
+async def adescribe_image(image):
+    """
+    Async variant of describe_image; the CPU bound preprocessing runs in a worker thread.
+    """
+    image = ImagePayload.wrap(image)
+    cache_key = describe_cache_key(image)
+    cached = await vision_cache.aget(cache_key)
+    if cached is not None:
+        print("Image description served from cache")
+        return cached
+
+    prepared = await sync_to_async(prepare_vision_image, thread_sensitive=False)(image)
+    image_information = await aprocess_image_data(prepared.payload, prepared.mime_type, prepared.detail)
+    description = await sync_to_async(with_palette, thread_sensitive=False)(image_information, prepared.payload)
+    await vision_cache.aset(cache_key, description)
+    return description
 
 
 def is_image_url(self, url: str) -> bool:
@@ -243,30 +416,30 @@ def Color_Available_in_Filter(color):
     return False, color
 
 
-def process_available_color_for_filter(color: str):
-    class ResponseStructure(BaseModel):
-        color: Literal[
-        'gradient',
-        'solid-black',
-        'multicolor',
-        'blue',
-        'azure',
-        'black',
-        'chartreuse',
-        'cyan',
-        'gray',
-        'green',
-        'orange',
-        'red',
-        'rose',
-        'spring-green',
-        'violet',
-        'white',
-        'yellow',
-        ] = Field(description="Exact or closest color.")
-        is_available: bool = Field(default=False, description="True if color matches or has a close match.")
-
-    template = """
+class AvailableColor(BaseModel):
+    color: Literal[
+    'gradient',
+    'solid-black',
+    'multicolor',
+    'blue',
+    'azure',
+    'black',
+    'chartreuse',
+    'cyan',
+    'gray',
+    'green',
+    'orange',
+    'red',
+    'rose',
+    'spring-green',
+    'violet',
+    'white',
+    'yellow',
+    ] = Field(description="Exact or closest color.")
+    is_available: bool = Field(default=False, description="True if color matches or has a close match.")
+
+
+AVAILABLE_COLOR_PROMPT = """
         You are an AI assistant tasked with identifying the exact or closest match from a list of colors Literal.
 
         Instructions:
@@ -275,17 +448,21 @@ def process_available_color_for_filter(color: str):
           3. If no close match is found, return False and the original color given as input.
     """
 
-    structured_llm = model.with_structured_output(ResponseStructure)
+
+@register_chain('available_color')
+def build_available_color_chain():
+    structured_llm = model.with_structured_output(AvailableColor)
     prompt = ChatPromptTemplate.from_messages([
-        ("system", template), 
+        ("system", AVAILABLE_COLOR_PROMPT), 
         MessagesPlaceholder("history", optional=True), 
         ("human", "{question}")
     ])
-    partial_prompt = prompt.partial(language='English', query=color)
-    chain = partial_prompt | structured_llm
+    return prompt | structured_llm
 
+
+def process_available_color_for_filter(color: str):
     try:
-        response = chain.invoke({"question": color})
+        response = get_chain('available_color').invoke({"question": color})
         return response.color
     except ValidationError as e:
         # Handle unexpected errors gracefully
@@ -303,6 +480,34 @@ AVAILABLE_COLORS = [
 
 
 def find_closest_color(input_color: str) -> tuple:
+    """
+    Find the input color's match or closest match from the available color list.
+
+    The local matcher in app.colors resolves hex codes, CSS color names and common synonyms by
+    perceptual distance. OpenAI is only asked when the matcher can not resolve the input and
+    settings.COLOR_MATCH_LLM_FALLBACK is enabled.
+
+    Args:
+        input_color (str): The input color name or hex code to match.
+
+    Returns:
+        tuple: (bool, str) - A boolean indicating if the match is exact, and the matching or closest color.
+    """
+    if not input_color:
+        return (False, AVAILABLE_COLORS[0])
+
+    matched_color = match_color(input_color)
+    if matched_color:
+        return (matched_color == input_color.strip().lower(), matched_color)
+
+    if settings.COLOR_MATCH_LLM_FALLBACK:
+        return find_closest_color_llm(input_color)
+
+    print(f"No local match found. Finding closest match for '{input_color}'.")
+    return (False, find_closest_color_fallback(input_color))
+
+
+def find_closest_color_llm(input_color: str) -> tuple:
     """
     Find the input color's match or closest match from the available color list using OpenAI.
 
@@ -416,9 +621,7 @@ def levenshtein(s1, s2):
 #     response = chain.invoke({"question": color})
 #     return response.is_available, response.color
 
-def process_icons_query(inputs: str):
-
-    prompt = """
+ICONS_QUERY_PROMPT = """
     Create a brief query string incorporating the following given string. Consider the below examples output.
     
     Examples Output:
@@ -441,35 +644,116 @@ def process_icons_query(inputs: str):
     Here is the:\n\n {context}\n\n
     """
 
-    model = ChatOpenAI(temperature=0.5, model="gpt-4", max_tokens=1024)
-    class ResponseSchema(BaseModel):
-        query: str = Field(..., description="query with brief string")
 
+class IconsQuery(BaseModel):
+    query: str = Field(..., description="query with brief string")
+
+
+icons_query_model = ChatOpenAI(temperature=0.5, model="gpt-4", max_tokens=1024)
+
+
+@register_chain('icons_query')
+def build_icons_query_chain():
     question_prompt = ChatPromptTemplate.from_messages(
         [
-            ("system", prompt)
+            ("system", ICONS_QUERY_PROMPT)
         ]
     )
-    llm_with_tools = model.with_structured_output(schema=ResponseSchema)
-    query_chain = question_prompt | llm_with_tools
-    results = query_chain.invoke({'context': inputs})
+    llm_with_tools = icons_query_model.with_structured_output(schema=IconsQuery)
+    return question_prompt | llm_with_tools
+
+
+# The attribute vocabulary is small, so the same combinations come back constantly
+ICONS_QUERY_PROMPT_VERSION = content_hash(ICONS_QUERY_PROMPT, icons_query_model.model_name)[:16]
+
+icons_query_cache = get_cache_backend(
+    settings.ICONS_QUERY_CACHE_BACKEND,
+    ttl=settings.ICONS_QUERY_CACHE_TTL,
+    max_entries=settings.ICONS_QUERY_CACHE_MAX_ENTRIES,
+    directory=settings.ICONS_QUERY_CACHE_DIR,
+    alias=settings.VISION_CACHE_ALIAS,
+    key_prefix='icons_query:',
+)
+
+
+def normalize_icons_query(attributes) -> tuple:
+    """
+    Normalize the attributes of a query summary so equivalent combinations share a cache entry.
+
+    Every attribute is lowercased, stripped of punctuation and surrounding whitespace, and its
+    comma separated items are sorted, so "Flat, Modern" and "modern,flat" normalize alike.
+
+    Args:
+        attributes (tuple or str): The attribute values, or a single attribute string.
+
+    Returns:
+        tuple: The normalized attributes.
+    """
+    if isinstance(attributes, str):
+        attributes = (attributes,)
+    normalized = []
+    for value in attributes:
+        items = []
+        for item in re.split(r'[,;/]', format_value(value or "").lower()):
+            item = ' '.join(re.sub(r"[^\w\s#-]", ' ', item).split())
+            if item:
+                items.append(item)
+        normalized.append(', '.join(sorted(items)))
+    return tuple(normalized)
+
+
+def icons_query_context(attributes) -> str:
+    if isinstance(attributes, str):
+        return attributes
+    return ' '.join(format_value(value) for value in attributes if format_value(value))
+
+
+def icons_query_cache_key(attributes) -> str:
+    return content_hash(*normalize_icons_query(attributes), ICONS_QUERY_PROMPT_VERSION)
+
+
+def process_icons_query(inputs):
+    """
+    Summarize icon attributes into a brief query string, memoized by the normalized attributes.
+
+    Args:
+        inputs (tuple or str): The attribute values (see build_icon_search) or an attribute string.
+
+    Returns:
+        str: The query string.
+    """
+    cache_key = icons_query_cache_key(inputs)
+    cached = icons_query_cache.get(cache_key)
+    if cached is not None:
+        print("Icons query served from cache")
+        return cached
+
+    results = get_chain('icons_query').invoke({'context': icons_query_context(inputs)})
+    icons_query_cache.set(cache_key, results.query)
     return results.query
 
 
-# Function to fetch icons based on filters
-def fetch_icons(color_filter, style_filter, color_palette, iconography, brand_style,
-                gradient_usage, imagery, shadow_and_depth, line_thickness, corner_rounding, description,
-                icon_color_name=None, icon_style=None):
-    f_icons_list = []
-    is_above_100_icons = False
-    base_url = "https://api.freepik.com/v1/icons"
-    headers = {
-        "x-freepik-api-key": settings.FREE_PICK_API_KEY
-    }
+async def aprocess_icons_query(inputs):
+    cache_key = icons_query_cache_key(inputs)
+    cached = await icons_query_cache.aget(cache_key)
+    if cached is not None:
+        print("Icons query served from cache")
+        return cached
+
+    results = await get_chain('icons_query').ainvoke({'context': icons_query_context(inputs)})
+    await icons_query_cache.aset(cache_key, results.query)
+    return results.query
+
+
+# Shared pool for the independent network stages of fetch_icons
+icon_search_executor = ThreadPoolExecutor(max_workers=settings.FETCH_ICONS_MAX_WORKERS,
+                                          thread_name_prefix='fetch_icons')
 
-    # if not color_filter and not style_filter:
-    #     description = format_value(imagery)
 
+def resolve_color_filter(color_palette, icon_color_name=None) -> str:
+    """
+    Pick the Freepik color filter: the requested icon color, or the closest match of the palette.
+    """
     # Process icon color name if provided
     if icon_color_name or not "None":
         color_filter_value = icon_color_name
@@ -486,22 +770,36 @@ def fetch_icons(color_filter, style_filter, color_palette, iconography, brand_st
 
     color_filter_value = format_value(color_filter_value)
     print("color_filter_value-->", color_filter_value)
+    return color_filter_value
 
-    # Process attributes and query icons
-    result = process_icons_query(
-        f"{color_filter_value} {iconography} {brand_style} {gradient_usage} {imagery} {shadow_and_depth} "
-        f"{line_thickness} {corner_rounding}"
-    )
-    # print("Result of process_icons_query-->", result)
 
+def icon_search_base(description) -> str:
+    """
+    The part of the Freepik search term that comes from the description. Stored in the project
+    attributes as search_term, so later refinements can search again without the LLM summary.
+    """
     # description_terms = " ".join(description.split(","))
-    description += " minimalist, UI icon"
+    return f"{format_value(description)} minimalist, UI icon"
+
+
+def remember_search(attributes, query_by_llm):
+    """
+    Store the search a project's icons came from in its attributes: the query summary and the
+    search_term that color/shape refinements reuse (build_incremental_icon_search).
+    """
+    attributes['query_by_llm'] = query_by_llm
+    attributes['search_term'] = icon_search_base(attributes.get('description', ''))
+
 
+def icon_search_params(search_term, color_filter_value, icon_style, imagery, style_filter) -> dict:
+    """
+    Build the Freepik /icons querystring for page 1, see icon_page_querystrings for more pages.
+    """
     # Construct querystring based on provided filters
     querystring = {
-        "term": f"{description}, {color_filter_value if color_filter_value else ''} {icon_style if icon_style else ''}, {imagery}",
+        "term": f"{search_term}, {color_filter_value if color_filter_value else ''} {icon_style if icon_style else ''}, {imagery}",
         "thumbnail_size": "256", 
-        "per_page": "100",  # Ensure only 150 icons are fetched
+        "per_page": str(MAX_PER_PAGE),
         "page": "1",       # Fetch the first page
         "order": 'relevance'
     }
@@ -513,51 +811,296 @@ def fetch_icons(color_filter, style_filter, color_palette, iconography, brand_st
         querystring["filters[shape]"] = icon_style
     if style_filter:  # Only include style filter if it's True
         querystring["filters[style]"] = style_filter
+    return querystring
 
-    # Fetch the first batch of 100 icons
-    print("Milos querystring in fetch_icons in utils.py")
-    print(querystring)
-    response = requests.get(base_url, headers=headers, params=querystring)
-    print(response)
-    json_data = response.json()
 
-    if response.status_code != 200:
-        return f_icons_list, result, "Something Wrong with the FreePik API"
-    if response.status_code == 200:
-        try:
-            print("Response-->", json_data)
-            meta = json_data.get("meta")
-            per_page = meta["pagination"]["per_page"]
-            total = meta["pagination"]["total"]
-            print("Total Icons-->", per_page)
-            if total > 100:
-                is_above_100_icons = True
-        except:
-            is_above_100_icons = False
-
-        # Extract Freepik icon data
-        for icon in json_data.get('data', []):
-            if icon.get('thumbnails'):
-                f_icons_list.append({
-                    'id': icon.get('id'),
-                    'url': icon['thumbnails'][0].get('url')
-                })
-
-        if is_above_100_icons:
-            querystring['page'] = '2'
-            querystring['per_page'] = '50'
-            response = requests.get(base_url, headers=headers, params=querystring)
-            json_data = response.json()
-
-            for icon in json_data.get('data', []):
-                if icon.get('thumbnails'):
-                    f_icons_list.append({
-                        'id': icon.get('id'),
-                        'url': icon['thumbnails'][0].get('url')
-                    })
-        return f_icons_list, result, None
+def build_icon_search(style_filter, color_palette, iconography, brand_style, gradient_usage, imagery,
+                      shadow_and_depth, line_thickness, corner_rounding, description,
+                      icon_color_name=None, icon_style=None) -> tuple:
+    """
+    Resolve the color filter and build the inputs shared by fetch_icons and afetch_icons.
+
+    Returns:
+        tuple: (tuple, list) - The attributes for the query summary (process_icons_query) and the
+        Freepik querystrings of the result pages.
+    """
+    # if not color_filter and not style_filter:
+    #     description = format_value(imagery)
+
+    color_filter_value = resolve_color_filter(color_palette, icon_color_name)
+
+    icons_query = (color_filter_value, iconography, brand_style, gradient_usage, imagery, shadow_and_depth,
+                   line_thickness, corner_rounding)
+
+    querystring = icon_search_params(icon_search_base(description), color_filter_value, icon_style, imagery,
+                                     style_filter)
+    print("querystring in fetch_icons-->", querystring)
+    return icons_query, icon_page_querystrings(querystring)
+
+
+def icon_page_querystrings(querystring, target=None) -> list:
+    """
+    Expand a querystring into the non-overlapping pages that together hold the target number of
+    icons (settings.FETCH_ICONS_TARGET by default).
+    """
+    target = target or settings.FETCH_ICONS_TARGET
+    return [{**querystring, 'page': str(page), 'per_page': str(per_page)}
+            for page, per_page in page_windows(target)]
+
+
+def pages_within(page_querystrings, total) -> list:
+    """
+    The querystrings whose page holds results when the search has total results. Page 1 is always
+    kept, since it is the one that reports the total.
+    """
+    return [querystring for querystring in page_querystrings
+            if querystring['page'] == '1' or int(querystring['page']) <= last_page(total, int(querystring['per_page']))]
+
+
+def topup_querystrings(fetched, total, merged, target=None) -> list:
+    """
+    When duplicates across pages left merged short of the target, the pages after the fetched ones
+    (same per_page, so they do not overlap) that hold the missing icons. Empty when the target is
+    met or the search has no more results.
+    """
+    shortfall = (target or settings.FETCH_ICONS_TARGET) - len(merged.icons)
+    if shortfall <= 0 or not fetched:
+        return []
+    last = fetched[-1]
+    per_page, next_page = int(last['per_page']), int(last['page']) + 1
+    end = min(last_page(total, per_page), next_page - 1 + -(-shortfall // per_page))
+    return [{**last, 'page': str(page)} for page in range(next_page, end + 1)]
+
+
+def build_incremental_icon_search(attributes, style_filter, icon_color_name=None, icon_style=None):
+    """
+    Build the search for a refinement that only changes the color or shape filter.
+
+    The search term and the query summary (query_by_llm) of the previous search are reused from the
+    project attributes, so only the color/shape filters differ and no LLM call is made.
+
+    Args:
+        attributes (dict): The project attributes.
+        style_filter (bool): Whether the shape changed, as for fetch_icons.
+        icon_color_name (str): The new color filter, or None to keep the palette color.
+        icon_style (str): The new shape filter, or None for no shape filter.
+
+    Returns:
+        tuple or None: (querystring, query_by_llm), or None when the project has no previous search
+        to refine and a full fetch_icons is needed.
+    """
+    if not settings.FETCH_ICONS_INCREMENTAL or not attributes.get('query_by_llm'):
+        return None
+    search_term = attributes.get('search_term') or icon_search_base(attributes.get('description', ''))
+    color_filter_value = resolve_color_filter(palette_color_source(attributes), icon_color_name)
+    querystring = icon_search_params(search_term, color_filter_value, icon_style, attributes.get('imagery', ''),
+                                     style_filter)
+    print("incremental querystring-->", querystring)
+    return querystring, attributes['query_by_llm']
+
+
+def fetch_icons_incremental(attributes, style_filter, icon_color_name=None, icon_style=None):
+    """
+    Refine the previous search with a new color or shape in a single Freepik request.
+
+    Returns:
+        tuple or None: (f_icons_list, query_by_llm, error) like fetch_icons, or None when the
+        project has no previous search to refine.
+    """
+    search = build_incremental_icon_search(attributes, style_filter, icon_color_name, icon_style)
+    if search is None:
+        return None
+    querystring, result = search
+    try:
+        page = get_freepik_client().search_icons(querystring)
+    except FreepikError as e:
+        print("Freepik search failed:", e)
+        return [], result, "Something Wrong with the FreePik API"
+    return [icon.as_dict() for icon in page.icons], result, None
+
+
+async def afetch_icons_incremental(attributes, style_filter, icon_color_name=None, icon_style=None):
+    """
+    Async variant of fetch_icons_incremental.
+    """
+    # The color match may fall back to a blocking LLM call, so the builder runs off the event loop
+    search = await sync_to_async(build_incremental_icon_search, thread_sensitive=False)(
+        attributes, style_filter, icon_color_name, icon_style
+    )
+    if search is None:
+        return None
+    querystring, result = search
+    try:
+        page = await get_async_freepik_client().search_icons(querystring)
+    except FreepikError as e:
+        print("Freepik search failed:", e)
+        return [], result, "Something Wrong with the FreePik API"
+    return [icon.as_dict() for icon in page.icons], result, None
+
+
+# Function to fetch icons based on filters
+def fetch_icons(color_filter, style_filter, color_palette, iconography, brand_style,
+                gradient_usage, imagery, shadow_and_depth, line_thickness, corner_rounding, description,
+                icon_color_name=None, icon_style=None):
+    """
+    Search Freepik for settings.FETCH_ICONS_TARGET unique icons.
+
+    The result pages are requested together with the query summary. When the search was seen
+    before, its remembered total keeps pages past the end from being requested; the first time,
+    page 2 is requested speculatively and dropped if page 1 shows it is empty. Icons repeated across
+    pages are dropped, and up to FETCH_ICONS_MAX_TOPUPS rounds of following pages make up for them.
+    Fewer icons are returned only when the search has no more, or the top-ups ran out.
+    """
+    client = get_freepik_client()
+    icons_query, page_querystrings = build_icon_search(
+        style_filter, color_palette, iconography, brand_style, gradient_usage, imagery, shadow_and_depth,
+        line_thickness, corner_rounding, description, icon_color_name, icon_style
+    )
+    known_total = client.known_total(page_querystrings[0])
+    if known_total is not None:
+        page_querystrings = pages_within(page_querystrings, known_total)
+
+    if settings.FETCH_ICONS_CONCURRENT:
+        # Neither search depends on the query summary, and the pages never overlap, so every request
+        # is sent at once and the whole stage takes as long as the slowest call
+        result_future = icon_search_executor.submit(process_icons_query, icons_query)
+        page_futures = [icon_search_executor.submit(client.search_icons, querystring)
+                        for querystring in page_querystrings]
+        result = result_future.result()
+        pages = [future.result for future in page_futures]
     else:
-        return f_icons_list, result, "Something Wrong with the FreePik API"
+        result = process_icons_query(icons_query)
+        pages = [partial(client.search_icons, querystring) for querystring in page_querystrings]
+
+    try:
+        page_1 = pages[0]()
+    except FreepikError as e:
+        print("Freepik search failed:", e)
+        return [], result, "Something Wrong with the FreePik API"
+    print("Total Icons-->", page_1.total)
+
+    results = [page_1]
+    fetched = pages_within(page_querystrings, page_1.total)
+    for page, querystring in zip(pages[1:], page_querystrings[1:]):
+        if querystring not in fetched:
+            # Past the last page of results; a speculative request is simply dropped
+            continue
+        try:
+            results.append(page())
+        except FreepikError as e:
+            print(f"Freepik page {querystring['page']} search failed:", e)
+
+    merged = merge_search_results(results, settings.FETCH_ICONS_TARGET)
+    for _ in range(settings.FETCH_ICONS_MAX_TOPUPS):
+        topups = topup_querystrings(fetched, page_1.total, merged)
+        if not topups:
+            break
+        print("Icons short after dedupe, fetching pages", [querystring['page'] for querystring in topups])
+        # Requested inline: a top-up is usually a single page, and a caller already running on
+        # icon_search_executor would otherwise wait on its own saturated pool
+        for querystring in topups:
+            try:
+                results.append(client.search_icons(querystring))
+            except FreepikError as e:
+                print(f"Freepik page {querystring['page']} search failed:", e)
+        fetched += topups
+        merged = merge_search_results(results, settings.FETCH_ICONS_TARGET)
+    return [icon.as_dict() for icon in merged.icons], result, None
+
+
+async def afetch_icons(color_filter, style_filter, color_palette, iconography, brand_style,
+                       gradient_usage, imagery, shadow_and_depth, line_thickness, corner_rounding, description,
+                       icon_color_name=None, icon_style=None):
+    """
+    Async variant of fetch_icons. The query summary and every result page are awaited together on
+    the event loop.
+    """
+    client = get_async_freepik_client()
+    # The color match may fall back to a blocking LLM call, so the builder runs off the event loop
+    icons_query, page_querystrings = await sync_to_async(build_icon_search, thread_sensitive=False)(
+        style_filter, color_palette, iconography, brand_style, gradient_usage, imagery, shadow_and_depth,
+        line_thickness, corner_rounding, description, icon_color_name, icon_style
+    )
+    known_total = await client.known_total(page_querystrings[0])
+    if known_total is not None:
+        page_querystrings = pages_within(page_querystrings, known_total)
+
+    result, *pages = await asyncio.gather(
+        aprocess_icons_query(icons_query),
+        *(client.search_icons(querystring) for querystring in page_querystrings),
+        return_exceptions=True,
+    )
+    if isinstance(result, BaseException):
+        raise result
+    page_1 = pages[0]
+    if isinstance(page_1, FreepikError):
+        print("Freepik search failed:", page_1)
+        return [], result, "Something Wrong with the FreePik API"
+    if isinstance(page_1, BaseException):
+        raise page_1
+    print("Total Icons-->", page_1.total)
+
+    results = [page_1]
+    fetched = pages_within(page_querystrings, page_1.total)
+    add_pages(results, pages[1:], page_querystrings[1:], fetched)
+
+    merged = merge_search_results(results, settings.FETCH_ICONS_TARGET)
+    for _ in range(settings.FETCH_ICONS_MAX_TOPUPS):
+        topups = topup_querystrings(fetched, page_1.total, merged)
+        if not topups:
+            break
+        print("Icons short after dedupe, fetching pages", [querystring['page'] for querystring in topups])
+        pages = await asyncio.gather(*(client.search_icons(querystring) for querystring in topups),
+                                     return_exceptions=True)
+        add_pages(results, pages, topups, topups)
+        fetched += topups
+        merged = merge_search_results(results, settings.FETCH_ICONS_TARGET)
+    return [icon.as_dict() for icon in merged.icons], result, None
+
+
+def add_pages(results, pages, querystrings, fetched):
+    """
+    Append the gathered pages of afetch_icons to results, skipping failed pages and pages past the
+    end of the results (see pages_within).
+    """
+    for page, querystring in zip(pages, querystrings):
+        if querystring not in fetched:
+            # Past the last page of results; a speculative request is simply dropped
+            continue
+        if isinstance(page, FreepikError):
+            print(f"Freepik page {querystring['page']} search failed:", page)
+        elif isinstance(page, BaseException):
+            raise page
+        else:
+            results.append(page)
+
+
+def palette_color_source(attributes) -> str:
+    """
+    What the Freepik color filter is matched against when no icon color is given: the extracted
+    pixel palette when there is one, the model's color_palette description otherwise.
+    """
+    return attributes.get('extracted_palette') or attributes.get('color_palette', '')
+
+
+def image_attributes(result) -> dict:
+    """
+    Pick the formatted ImageInformation attributes out of a vision result.
+    """
+    attributes = {
+        'color_palette': format_value(result.get("color_palette", "")),
+        'iconography': format_value(result.get("iconography", "")),
+        'brand_style': format_value(result.get("brand_style", "")),
+        'gradient_usage': format_value(result.get("gradient_usage", "")),
+        'imagery': format_value(result.get("imagery", "")),
+        'shadow_and_depth': format_value(result.get("shadow_and_depth", "")),
+        'line_thickness': format_value(result.get("line_thickness", "")),
+        'corner_rounding': format_value(result.get("corner_rounding", "")),
+        'description': format_value(result.get("description", "")),
+    }
+    if result.get('extracted_palette'):
+        attributes['extracted_palette'] = result['extracted_palette']
+    return attributes
 
 
 def format_value(value):
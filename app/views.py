@@ -1,24 +1,32 @@
 import base64
-import io
 
 from langchain_openai import ChatOpenAI
-import zipfile
 from io import BytesIO
 from PIL import Image
 
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
-from app.utils import process_image_data, custom_error_message, Color_Available_in_Filter, fetch_icons, format_value, \
-    process_available_color_for_filter, find_closest_color
-from app.serializers import ProjectSerializer, ProjectListSerializer, ProjectIconListSerializer, ProjectHistorySerializer, IconSerializer
+from app.utils import describe_image, Color_Available_in_Filter, fetch_icons, format_value, \
+    process_available_color_for_filter, remember_search
+from app.serializers import ProjectSerializer, ProjectListSerializer, ProjectIconListSerializer, ProjectHistorySerializer, IconSerializer, \
+    GenerationJobSerializer
 import re
 import requests
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
-from app.models import Project
+from django.urls import reverse
+from app.models import Project, GenerationJob, load_icon_lists
+from app.pagination import InvalidCursor, page_size_param, paginate_icons
+from app.freepik import FreepikError, get_freepik_client
+from app.icon_cache import get_icon_cache
+from app.archive import ArchiveBuilder, sniff_extension
+from app.downloads import fetch_icons_concurrently, IconDownloadError, ON_ERROR_ABORT, ON_ERROR_SKIP
+from app.pipeline import generate_project
+from app.imaging import ImagePayload, ImageTooLarge
+from app.jobs import enqueue_generation_job, InvalidCallbackURL, validate_callback_url
 from auth_app.token_auth import CustomTokenAuthentication
 import webcolors
 from langchain.schema import HumanMessage
@@ -43,80 +51,67 @@ class ImageProcessView(APIView):
 
     def post(self, request, *args, **kwargs):
         try:
-            # final_response_by_llm = None
             image_file = request.FILES.get('image')
-            icon_color_hex, icon_color_name = request.data.get('icon_color'), None
+            icon_color_hex = request.data.get('icon_color')
             icon_style = request.data.get('icon_style')
-            color_filter, style_filter = False, True if icon_style else False
             if not image_file:
                 return Response({"error": "No image file provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-            image_data = image_file.read()
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            result = process_image_data(image_base64)
-            print("Result of process_image_data")
-            print(result)
-            color_palette = format_value(result.get("color_palette", ""))
-            iconography = format_value(result.get("iconography", ""))
-            brand_style = format_value(result.get("brand_style", ""))
-            gradient_usage = format_value(result.get("gradient_usage", ""))
-            imagery = format_value(result.get("imagery", ""))
-            shadow_and_depth = format_value(result.get("shadow_and_depth", ""))
-            line_thickness = format_value(result.get("line_thickness", ""))
-            corner_rounding = format_value(result.get("corner_rounding", ""))
-            description = format_value(result.get("description", ""))
-
-            #Extract Color from Hex Code
-            if icon_color_hex:
-                print("icon_color_hex provided")
-                try:
-                    color_name = webcolors.hex_to_name(icon_color_hex)
-                    print("color_name")
-                    print(color_name)
-                    color_filter, icon_color_name = find_closest_color(color_name)
-                except ValueError:
-                    color_filter = False
-                    icon_color_name = None
-            else:
-                print("icon_color_hex not provided")
-                color_filter, icon_color_name = find_closest_color(color_palette)
-
-            #fetch Icons from free pik Api
-            f_icons_list, result, error = fetch_icons(color_filter, style_filter, color_palette,
-                                iconography, brand_style, gradient_usage, imagery,
-                                shadow_and_depth, line_thickness, corner_rounding, description,
-                                icon_color_name, icon_style)
+            data, error = generate_project(ImagePayload.from_file(image_file), request.user, icon_color_hex,
+                                           icon_style)
             if error:
-                return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
-
-            #Save data in Project Modal
-            attributes = {
-                'color_palette': color_palette,
-                'iconography': iconography,
-                'brand_style': brand_style,
-                'gradient_usage': gradient_usage,
-                'imagery': imagery,
-                'shadow_and_depth': shadow_and_depth,
-                'line_thickness': line_thickness,
-                'corner_rounding': corner_rounding,
-                'description': description,
-                'query_by_llm': result,
-            }
-            project_data = {
-                'attributes' : attributes,
-                'f_icons': f_icons_list,
-            }
-
-            project_serializer_obj = ProjectSerializer(data=project_data)
-            if project_serializer_obj.is_valid():
-                project_serializer_obj.save(user=request.user)
-                return Response(project_serializer_obj.data, status=status.HTTP_200_OK)
-            return Response(custom_error_message(project_serializer_obj.errors), status=status.HTTP_400_BAD_REQUEST)
+                return Response(error, status=status.HTTP_400_BAD_REQUEST)
+            return Response(data, status=status.HTTP_200_OK)
         except Exception as e:
             print(str(e))
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class GenerationJobCreateView(APIView):
+    """
+    Queue ImageProcessView's pipeline as a background job and return the job ID right away.
+
+    Send an Idempotency-Key header (or idempotency_key field) so a retried upload returns the
+    existing job instead of running the pipeline again.
+    """
+    authentication_classes = [CustomTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        image_file = request.FILES.get('image')
+        if not image_file:
+            return Response({"error": "No image file provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+        callback_url = request.data.get('callback_url', '')
+        if callback_url:
+            try:
+                validate_callback_url(callback_url)
+            except InvalidCallbackURL as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        idempotency_key = request.headers.get('Idempotency-Key') or request.data.get('idempotency_key', '')
+        job, created = enqueue_generation_job(
+            request.user, image_file, icon_color=request.data.get('icon_color'),
+            icon_style=request.data.get('icon_style'), callback_url=callback_url,
+            idempotency_key=idempotency_key[:255],
+        )
+        data = GenerationJobSerializer(job).data
+        data['status_url'] = request.build_absolute_uri(reverse('generation_job_status', args=[job.id]))
+        return Response(data, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+
+class GenerationJobStatusView(APIView):
+    authentication_classes = [CustomTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id, *args, **kwargs):
+        try:
+            job = GenerationJob.objects.get(id=job_id, user=request.user)
+        except GenerationJob.DoesNotExist:
+            return Response({"error": "Job Does Not Exist"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(GenerationJobSerializer(job).data, status=status.HTTP_200_OK)
+
+
 class ImageDownloadView(APIView):
     authentication_classes = [CustomTokenAuthentication]
     permission_classes = [IsAuthenticated]
@@ -129,18 +124,57 @@ class ImageDownloadView(APIView):
         headers = {
             "Authorization": f"Bearer {settings.ICON_FINDER_KEY}"
         }
-        response = requests.get(download_url, headers=headers)
-
-        if response.status_code != 200:
-            return Response({"error": "Failed to download image"}, status=response.status_code)
+        try:
+            image_content = get_icon_cache().fetch(download_url, download_url, variant='download', headers=headers)
+        except requests.HTTPError as e:
+            return Response({"error": "Failed to download image"}, status=e.response.status_code)
+        except (requests.RequestException, FreepikError):
+            return Response({"error": "Failed to download image"}, status=status.HTTP_502_BAD_GATEWAY)
+        except ImageTooLarge as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        image_content = response.content
         response = HttpResponse(
             image_content, content_type='application/octet-stream')
         response['Content-Disposition'] = 'attachment; filename=image.svg'
         return response
 
 
+def icon_zip_response(icons, on_error):
+    """
+    Stream a ZIP of the given icons. Each member is sent as soon as its download completes, so only
+    the icons in flight are held in memory and the first bytes leave immediately. PNG/JPEG members
+    are stored as-is and SVG/text members are deflated (see app.archive).
+
+    Skipped icons are listed in a trailing failed_icons.txt member. With on_error="abort", a failure
+    on the first icon to arrive returns a 400. Once streaming has started, a failure can only end the
+    stream, which leaves the client with an incomplete archive.
+    """
+    failures = []
+    downloads = fetch_icons_concurrently(icons, on_error=on_error, failures=failures)
+    try:
+        first = next(downloads, None)
+    except IconDownloadError as e:
+        return Response({"error": str(e), "icon_id": e.icon_id}, status=status.HTTP_400_BAD_REQUEST)
+
+    builder = ArchiveBuilder()
+
+    def members():
+        if first is not None:
+            yield f"{first[0]['id']}{sniff_extension(first[1], '.png')}", first[1]
+        for icon, content in downloads:
+            yield f"{icon['id']}{sniff_extension(content, '.png')}", content
+        if failures:
+            yield "failed_icons.txt", "\n".join(f"{failure.icon_id}: {failure.reason}" for failure in failures)
+
+    def stream():
+        yield from builder.stream(members())
+        print("Icon archive stats-->", builder.stats)
+
+    response = StreamingHttpResponse(stream(), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename=icons.zip'
+    return response
+
+
 class DownloadFreePikView(APIView):
     authentication_classes = [CustomTokenAuthentication]
     # permission_classes = [IsAuthenticated]
@@ -148,53 +182,30 @@ class DownloadFreePikView(APIView):
     def get(self, request, *args, **kwargs):
         page_size = request.GET.get('page_size', '5')
         page = request.GET.get('page', '1')
+        cursor = request.GET.get('cursor')
         history_id = request.GET.get('history_id')
-        if not page_size or not page or not history_id:
+        if not page_size or not (page or cursor) or not history_id:
             return Response({"error": "No page size or page number provided"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
             history_obj = Project.history.get(pk=history_id)
-            serializer = ProjectHistorySerializer(history_obj)
-            f_icons = serializer.data["f_icons"]
-            page = int(page) if page else 1
-            page_size = int(page_size) if page_size else 10
+            page_size = page_size_param(page_size)
 
-            start_index = (page - 1) * page_size
-            end_index = start_index + page_size
-            icons_list = f_icons[start_index:end_index]
+            # Only the requested page is read from the icon result set
+            icons_list = paginate_icons(history_obj, cursor, page_size, page).results
 
         except Project.history.model.DoesNotExist:
             return Response({"error": "History does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 
-        zip_buffer = io.BytesIO()
-
-        with zipfile.ZipFile(zip_buffer, 'w') as zf:
-            for icon in icons_list:
-                icon_id = icon["id"]
-                icon_url = icon["url"]
-                try:
-                    # Download the actual image
-                    image_response = requests.get(icon_url, timeout=10)
-                    if image_response.status_code != 200:
-                        continue  # Skip this icon if download fails
-
-                    # Write the image to the zip file
-                    zf.writestr(f"{icon_id}.png", image_response.content)
-
-                except requests.exceptions.RequestException as e:
-                    # Log the error and continue
-                    print(f"Error while downloading icon {icon_id}: {str(e)}")
-                    continue
-
-        # Finalize the zip buffer
-        zip_buffer.seek(0)
+        on_error = request.GET.get('on_error', ON_ERROR_SKIP)
+        if on_error not in (ON_ERROR_SKIP, ON_ERROR_ABORT):
+            return Response({"error": "on_error must be 'skip' or 'abort'"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Return the zip file as an HTTP response
-        response = HttpResponse(zip_buffer, content_type='application/zip')
-        response['Content-Disposition'] = 'attachment; filename=icons.zip'
-        return response
+        return icon_zip_response(icons_list, on_error)
 
 
 class DownloadIconsZip(APIView):
@@ -204,31 +215,11 @@ class DownloadIconsZip(APIView):
         if not serializer.is_valid():
             return Response({"error": "Invalid data", "details": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Prepare an in-memory ZIP file
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for icon in serializer.validated_data:
-                icon_id = icon['id']
-                icon_url = icon['url']
+        on_error = request.data.get('on_error', ON_ERROR_ABORT)
+        if on_error not in (ON_ERROR_SKIP, ON_ERROR_ABORT):
+            return Response({"error": "on_error must be 'skip' or 'abort'"}, status=status.HTTP_400_BAD_REQUEST)
 
-                # Download the image
-                try:
-                    response = requests.get(icon_url)
-                    response.raise_for_status()  # Raise an error for bad responses
-
-                    # Get image content and write it to the ZIP file
-                    image_content = response.content
-                    zip_file.writestr(f"{icon_id}.png", image_content)
-                except requests.RequestException as e:
-                    return Response({"error": f"Failed to download {icon_url}: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Make sure we seek to the beginning of the buffer
-        zip_buffer.seek(0)
-
-        # Return the ZIP file as a response
-        response = HttpResponse(zip_buffer.read(), content_type='application/zip')
-        response['Content-Disposition'] = 'attachment; filename=icons.zip'
-        return response
+        return icon_zip_response(serializer.validated_data, on_error)
 
 
 class DownloadSingleFreepikIconView(APIView):
@@ -236,36 +227,22 @@ class DownloadSingleFreepikIconView(APIView):
         icon_id = request.GET.get('icon_id')
         format = request.GET.get('format', default='svg')
 
-        api_key = settings.FREE_PICK_API_KEY  # Replace with your actual API key
-
         if not icon_id:
             return Response({"error": "icon_id is required"}, status=400)
 
-        url = f"https://api.freepik.com/v1/icons/{icon_id}/download"
-        params = {"format": format}
-        headers = {
-            "x-freepik-api-key": api_key,
-            # Optionally specify language if needed (e.g., en-US)
-            # "Accept-Language": "en-US"
-        }
-        
         try:
-            response = requests.get(url, params=params, headers=headers)
+            download = get_freepik_client().download_icon(icon_id, format=format)
 
-            if response.status_code == 200:
-                data = response.json()
-                filename = data["filename"]
-                file_url = data["url"]
-
-                return Response({
-                    "message": f"Icon downloaded successfully: {filename}",
-                    "file_url": file_url,
-                    # Optionally include more details here.
-                })
-            
-            else:
-                return Response({"error": f"Failed to download icon. Status Code: {response.status_code}"}, status=500)
-        
+            return Response({
+                "message": f"Icon downloaded successfully: {download.filename}",
+                "file_url": download.url,
+                # Optionally include more details here.
+            })
+
+        except FreepikError as e:
+            if e.status_code:
+                return Response({"error": f"Failed to download icon. Status Code: {e.status_code}"}, status=500)
+            return Response({"error": str(e)}, status=500)
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
@@ -325,11 +302,9 @@ class FigmaLinkProcessAPI(APIView):
                         except requests.exceptions.RequestException as e:
                             return Response({"error": "You don't have access rights to the figma screen"}, status=status.HTTP_400_BAD_REQUEST)
                         image_url = response.json()['images'][NODE_ID.replace('-', ':')]
-                        image_response = requests.get(image_url)
+                        image_response = requests.get(image_url, stream=True)
                         if image_response.status_code == 200:
-                            image_data = image_response.content
-                            image_base64 = base64.b64encode(image_data).decode('utf-8')
-                            result = process_image_data(image_base64)
+                            result = describe_image(ImagePayload.from_response(image_response))
                     return Response({
                         "error": "The link appears to be private. Please authorize access to your Figma files.",
                         "oauth_url": f"https://www.figma.com/oauth?client_id={FIGMA_CLIENT_ID}&redirect_uri={REDIRECT_URL}&scope=file_read&state=US&response_type=code"
@@ -340,11 +315,9 @@ class FigmaLinkProcessAPI(APIView):
                     #     return Response({"error": "Detected multiple screens in the link. Please provide a single screen link for more efficient result."}, status=status.HTTP_400_BAD_REQUEST)
                     
                     image_url = response.json()['images'][NODE_ID.replace('-', ':')]
-                    image_response = requests.get(image_url)
+                    image_response = requests.get(image_url, stream=True)
                     if image_response.status_code == 200:
-                        image_data = image_response.content
-                        image_base64 = base64.b64encode(image_data).decode('utf-8')
-                        result = process_image_data(image_base64)
+                        result = describe_image(ImagePayload.from_response(image_response))
 
             if figma_link:
                 pattern = r'/design/([^/]+)/.*\?node-id=([^&]+)'
@@ -370,6 +343,8 @@ class FigmaLinkProcessAPI(APIView):
             line_thickness = format_value(result.get("line_thickness", ""))
             corner_rounding = format_value(result.get("corner_rounding", ""))
             description = format_value(result.get("description", ""))
+            # Pixel palette (app.palette); only used to pick the color filter
+            extracted_palette = result.get("extracted_palette", "")
 
             # Extract Color from Hex Code
             if icon_color_hex:
@@ -380,7 +355,7 @@ class FigmaLinkProcessAPI(APIView):
                 except ValueError:
                     color_filter = False
 
-            f_icons_list, result, error = fetch_icons(color_filter, style_filter, color_palette,
+            f_icons_list, result, error = fetch_icons(color_filter, style_filter, extracted_palette or color_palette,
                                        iconography, brand_style, gradient_usage, imagery,
                                        shadow_and_depth, line_thickness, corner_rounding,
                                        description, icon_color_name, icon_style)
@@ -397,10 +372,11 @@ class FigmaLinkProcessAPI(APIView):
                 'shadow_and_depth': shadow_and_depth,
                 'line_thickness': line_thickness,
                 'corner_rounding': corner_rounding,
-                'query_by_llm': result,
-                'description': description
+                'description': description,
+                'extracted_palette': extracted_palette,
                 
             }
+            remember_search(attributes, result)
             project_data = {
                 'attributes' : attributes,
                 'f_icons': f_icons_list,
@@ -411,6 +387,8 @@ class FigmaLinkProcessAPI(APIView):
             if project_serializer_obj.is_valid():
                 project_serializer_obj.save(user=request.user)
             return Response(project_serializer_obj.data, status=status.HTTP_200_OK)
+        except ImageTooLarge as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             print(str(e))
             return Response({"error": "Internal Server Error"}, status=status.HTTP_400_BAD_REQUEST)
@@ -532,22 +510,17 @@ class ImageLinkProcessAPI(APIView):
                     
                 if response.status_code == 200:
                     image_url = response.json()['images'][NODE_ID.replace('-', ':')]
-                    image_response = requests.get(image_url)
+                    image_response = requests.get(image_url, stream=True)
                     if image_response.status_code == 200:
-                        image_data = image_response.content
-                        image_base64 = base64.b64encode(image_data).decode('utf-8')
-                        result = process_image_data(image_base64)
+                        result = describe_image(ImagePayload.from_response(image_response))
 
             if is_image:
                 # Fetch the image data
-                response = requests.get(image_url)
+                response = requests.get(image_url, stream=True)
                 if response.status_code != 200:
                     return Response({"error": "Failed to retrieve the image from the URL."}, status=status.HTTP_400_BAD_REQUEST)
 
-                # Convert image to base64
-                image_data = response.content
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-                result = process_image_data(image_base64)
+                result = describe_image(ImagePayload.from_response(response))
 
             # Process and save attributes
             color_palette = format_value(result.get("color_palette", ""))
@@ -559,6 +532,8 @@ class ImageLinkProcessAPI(APIView):
             line_thickness = format_value(result.get("line_thickness", ""))
             corner_rounding = format_value(result.get("corner_rounding", ""))
             description = format_value(result.get("description", ""))
+            # Pixel palette (app.palette); only used to pick the color filter
+            extracted_palette = result.get("extracted_palette", "")
 
             # Extract color from hex code if provided
             if icon_color_hex:
@@ -570,7 +545,7 @@ class ImageLinkProcessAPI(APIView):
 
             # Fetch icons with specified filters
             f_icons_list, result, error = fetch_icons(
-                color_filter, style_filter, color_palette, iconography,
+                color_filter, style_filter, extracted_palette or color_palette, iconography,
                 brand_style, gradient_usage, imagery, shadow_and_depth,
                 line_thickness, corner_rounding, description, icon_color_name, icon_style
             )
@@ -588,9 +563,10 @@ class ImageLinkProcessAPI(APIView):
                 'line_thickness': line_thickness,
                 'corner_rounding': corner_rounding,
                 'description': description,
-                'query_by_llm': result,
+                'extracted_palette': extracted_palette,
                 
             }
+            remember_search(attributes, result)
             project_data = {
                 'attributes': attributes,
                 'f_icons': f_icons_list,
@@ -602,6 +578,8 @@ class ImageLinkProcessAPI(APIView):
             if project_serializer_obj.is_valid():
                 project_serializer_obj.save(user=request.user)
             return Response(project_serializer_obj.data, status=status.HTTP_200_OK)
+        except ImageTooLarge as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             print(str(e))
             return Response({"error": "Internal Server Error"}, status=status.HTTP_400_BAD_REQUEST)
@@ -640,16 +618,16 @@ class SimilarIconSearchAPI(APIView):
                 return Response({"error": "Icon not found."}, status=status.HTTP_404_NOT_FOUND)
 
             # Get related icons from the response
-            related_icons = icon_details.get("data", {}).get("related", {}).get("style", [])
+            related_icons = icon_details.related_style
             if not related_icons:
                 return Response({"error": "No related icons found."}, status=status.HTTP_404_NOT_FOUND)
 
             similar_icons = [
                 {
                     "icon_id": icon_id,
-                    "similar_icon_id": icon["id"],
-                    "similar_icon_family_id": icon["family"]["id"],
-                    "url": icon.get("thumbnails", [{}])[0].get("url", "")  # The first thumbnail URL is selected
+                    "similar_icon_id": icon.id,
+                    "similar_icon_family_id": icon.family_id,
+                    "url": icon.url  # The first thumbnail URL is selected
                 }
                 for icon in related_icons
             ]
@@ -662,15 +640,8 @@ class SimilarIconSearchAPI(APIView):
 
     def get_icon_details(self, icon_id):
         try:
-            headers = {"x-freepik-api-key": f"{FREE_PIK_API_KEY}"}
-            response = requests.get(
-                f"https://api.freepik.com/v1/icons/{icon_id}", headers=headers
-            )
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return None
-        except requests.RequestException as e:
+            return get_freepik_client().get_icon(icon_id)
+        except (FreepikError, requests.RequestException) as e:
             print("Error fetching icon details:", e)
             return None
 
@@ -692,12 +663,15 @@ class GenerateIconVariationsAPIView(APIView):
             if variation_count < 1:
                 return Response({"error": "Invalid variation count."}, status=status.HTTP_400_BAD_REQUEST) 
             
-            icon_response = requests.get(icon_url)
-            if icon_response.status_code != 200:
+            try:
+                icon_content = get_icon_cache().fetch(icon_url, icon_url, variant='source')
+            except (requests.RequestException, FreepikError):
                 return Response({"error": "Failed to fetch the icon from the URL."}, status=status.HTTP_400_BAD_REQUEST)
+            except ImageTooLarge as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             
             # Convert image to PNG format
-            icon_image = Image.open(BytesIO(icon_response.content))
+            icon_image = Image.open(BytesIO(icon_content))
             png_image_buffer = BytesIO()
             icon_image = icon_image.convert("RGBA")  # Ensure compatibility
             icon_image.save(png_image_buffer, format="PNG")
@@ -750,6 +724,7 @@ class GetProjectIconListApi(APIView):
             project_id = request.data.get('project_id')
             page = request.data.get('page')
             page_size = request.data.get('page_size')
+            cursor = request.data.get('cursor')
 
             if not project_id:
                 return Response({"error": "Project ID is required"}, status=status.HTTP_400_BAD_REQUEST)
@@ -758,22 +733,14 @@ class GetProjectIconListApi(APIView):
             except Project.DoesNotExist:
                 return Response({"error": "Project does not exist"}, status=status.HTTP_400_BAD_REQUEST)
 
-            serializer = ProjectIconListSerializer(project_list)
+            page_size = page_size_param(page_size)
 
-            f_icons = serializer.data["f_icons"]
-            page = int(page) if page else 1
-            page_size = int(page_size) if page_size else 10
+            # Keyset page from the icon result set; page is still accepted when no cursor is sent
+            icon_page = paginate_icons(project_list, cursor, page_size, page)
 
-            start_index = (page - 1) * page_size
-            end_index = start_index + page_size
-            paginated_f_icons = f_icons[start_index:end_index]
-
-            response_data = {
-                "count": len(f_icons),
-                "results": paginated_f_icons
-            }
-
-            return Response(response_data, status=status.HTTP_200_OK)
+            return Response(icon_page.as_response(), status=status.HTTP_200_OK)
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -811,7 +778,9 @@ class GetProjectHistoryListApi(APIView):
             return Response({"detail": "Project Does Not Exist"}, status=status.HTTP_404_NOT_FOUND)
 
         history = project_obj.history.all()
-        serializer = ProjectHistorySerializer(history, many=True)
+        # Versions share result sets, so each set is loaded once for the whole list
+        icon_lists = load_icon_lists({record.icon_result_set_id for record in history if record.icon_result_set_id})
+        serializer = ProjectHistorySerializer(history, many=True, context={'icon_lists': icon_lists})
         return Response(serializer.data, status=status.HTTP_200_OK)
     
 
@@ -824,26 +793,21 @@ class GetHistoryByHistoryIdApi(APIView):
         history_id = request.data.get('history_id')
         page = request.data.get('page')
         page_size = request.data.get('page_size')
+        cursor = request.data.get('cursor')
         if not history_id:
             return Response({"error": "History ID is required"}, status.HTTP_400_BAD_REQUEST)
         try:
             history_obj = Project.history.get(pk=history_id)
-            serializer = ProjectHistorySerializer(history_obj)
-            f_icons = serializer.data["f_icons"]
-            page = int(page) if page else 1
-            page_size = int(page_size) if page_size else 10
-
-            start_index = (page - 1) * page_size
-            end_index = start_index + page_size
-            paginated_f_icons = f_icons[start_index:end_index]
-
-            response_data = {
-                "count": len(f_icons),
-                "results": paginated_f_icons
-            }
-            return Response(response_data, status=status.HTTP_200_OK)
+            page_size = page_size_param(page_size)
+
+            # Keyset page from the icon result set; page is still accepted when no cursor is sent
+            icon_page = paginate_icons(history_obj, cursor, page_size, page)
+
+            return Response(icon_page.as_response(), status=status.HTTP_200_OK)
         except Project.history.model.DoesNotExist:
             return Response([], status=status.HTTP_200_OK)
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, *args, **kwargs):
         history_id = request.data.get('history_id')
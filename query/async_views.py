@@ -0,0 +1,111 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework import status
+
+from app.async_views import AsyncAPIView
+from app.models import Project
+from app.serializers import ProjectIconAttributesSerializer
+from app.utils import afetch_icons, afetch_icons_incremental, format_value, icon_search_base, \
+    palette_color_source
+from query.utils import aroute_query
+
+
+class AsyncUpdateIconAttributesByQuery(AsyncAPIView):
+    """
+    Async variant of UpdateIconAttributesByQuery; the LLM and Freepik calls are awaited on the event
+    loop instead of blocking a worker thread.
+    """
+
+    async def post(self, request):
+        attributes = {}
+        isRelatedColor, isRelatedShape = False, False
+        general_response = None
+        project_id = request.data.get('project_id')
+        query = request.data.get('query')
+
+        if not query:
+            return JsonResponse({'error': 'Please Provide Query'}, status=400)
+        if not project_id:
+            return JsonResponse({'error': 'Please Provide Project Id'}, status=400)
+
+        try:
+            icon_style = None
+            icon_color_name = None
+            project_instance = await Project.objects.aget(id=project_id, user=request.user)
+            project_attributes = ProjectIconAttributesSerializer(project_instance).data["attributes"]
+            # One routing step: local for a bare color/shape word, otherwise a single model call
+            response = await aroute_query(query, project_attributes)
+
+            # Check if the response path is valid and has the necessary data
+            if not response or not response.path:
+                return JsonResponse({'error': 'Invalid query response, path is missing'}, status=400)
+
+            # Process the response based on the path
+            if response.path == 'general':
+                if response.style:
+                    isRelatedShape = True
+                    icon_style = response.style
+                general_response = response.general_response
+                attributes['color_palette'] = format_value(response.color_palette)
+                attributes['iconography'] = format_value(response.iconography)
+                attributes['brand_style'] = format_value(response.brand_style)
+                attributes['gradient_usage'] = format_value(response.gradient_usage)
+                attributes['imagery'] = format_value(response.imagery)
+                attributes['shadow_and_depth'] = format_value(response.shadow_and_depth)
+                attributes['line_thickness'] = format_value(response.line_thickness)
+                attributes['corner_rounding'] = format_value(response.corner_rounding)
+                attributes['description'] = response.description
+
+            if response.path == 'color':
+                isRelatedColor = True
+                icon_color_name = response.color if response.color else ""
+                general_response = response.general_response
+                attributes = project_attributes
+                icon_style = None
+
+            if response.path == 'shape':
+                isRelatedShape = True
+                icon_style = response.shape if response.shape else ""
+                general_response = response.general_response
+                attributes = project_attributes
+                icon_color_name = None
+
+            search = None
+            if response.path in ('color', 'shape'):
+                # Only a filter changed: reuse the previous search term and summary, one Freepik call
+                search = await afetch_icons_incremental(attributes, isRelatedShape, icon_color_name, icon_style)
+            if search is None:
+                search = await afetch_icons(
+                    isRelatedColor, isRelatedShape, palette_color_source(attributes),
+                    attributes["iconography"], attributes["brand_style"], attributes["gradient_usage"],
+                    attributes["imagery"], attributes["shadow_and_depth"], attributes["line_thickness"],
+                    attributes["corner_rounding"], attributes["description"], icon_color_name, icon_style
+                )
+            f_icons_list, result, error = search
+            if error:
+                return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Check if the 'attributes' has meaningful data (non-empty values)
+            if any(value != "" for value in attributes.values()):
+                # The search the next color/shape refinement builds on
+                attributes['query_by_llm'] = result
+                if response.path == 'general' or not attributes.get('search_term'):
+                    attributes['search_term'] = icon_search_base(attributes['description'])
+                project_instance.attributes = attributes
+
+            if f_icons_list:
+                project_instance.f_icons = f_icons_list
+
+            # Save the project instance and record changes in history
+            await sync_to_async(project_instance.save_with_historical_record)()
+            await project_instance.arefresh_from_db()
+            project_instance.skip_history_when_saving = True
+
+            data = ProjectIconAttributesSerializer(project_instance).data
+            data['query_response'] = general_response
+            data['query_string'] = result
+            return JsonResponse(data, status=status.HTTP_200_OK)
+        except Project.DoesNotExist:
+            return JsonResponse({'error': "Project Does Not Exist"}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -1,3 +1,21 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from query.utils import preclassify_query
+
+
+class PreclassifyQueryTests(SimpleTestCase):
+    def test_tone_words_go_to_the_model(self):
+        for query in ("turn it dark", "make it light", "Make the icons brighter!", "dark"):
+            self.assertIsNone(preclassify_query(query), query)
+
+    def test_colors_and_shapes_are_routed_locally(self):
+        cases = {
+            "make it red": ('color', 'red'),
+            "light blue": ('color', 'azure'),
+            "dark blue please": ('color', 'blue'),
+            "change to outline": ('shape', 'outline'),
+            "lineal-color": ('shape', 'lineal-color'),
+        }
+        for query, (path, value) in cases.items():
+            route = preclassify_query(query)
+            self.assertEqual((route.path, route.color or route.shape), (path, value), query)
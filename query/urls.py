@@ -1,6 +1,8 @@
 from django.urls import path
 from query.views import *
+from query.async_views import AsyncUpdateIconAttributesByQuery
 
 urlpatterns = [
     path('UpdateIconsByQuery/', UpdateIconAttributesByQuery.as_view(), name='UpdateIconsByQuery'),
+    path('async/UpdateIconsByQuery/', AsyncUpdateIconAttributesByQuery.as_view(), name='AsyncUpdateIconsByQuery'),
 ]
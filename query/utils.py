@@ -1,4 +1,5 @@
 import os
+import re
 from typing import Literal
 
 from langchain_core.pydantic_v1 import BaseModel, Field
@@ -6,45 +7,28 @@ from langchain_openai import ChatOpenAI
 from django.conf import settings
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
+from app.chains import get_chain, register_chain
+from app.colors import match_color, resolve_color_phrase
+
 os.environ["OPENAI_API_KEY"]= settings.OPENAI_API_KEY
 llm = ChatOpenAI(model="gpt-4o-mini")
 
 
-def GeneralQueryAnswer(message, icon_attributes):
-    class Output_Structure(BaseModel):
-        color_palette: str = Field(description="The color palette of the picture")
-        iconography: str = Field(description="The iconography of the picture")
-        brand_style: str = Field(description="The band style of the picture")
-        gradient_usage: str = Field(description="The gradient usage of the picture")
-        imagery: str = Field(description="The imagery of the picture")
-        shadow_and_depth: str = Field(description="The shadow and depth of the picture")
-        line_thickness: str = Field(description="The line thickness of the picture")
-        corner_rounding: str = Field(description="The corner rounding of the picture")
-        description: str = Field(description="Description used as a keyword for the icons")
-        style: str = Field(description="The style of the icon")
-        general_response: str = Field(default=None, description="General response of the input query")
-
-    # def refine_description(message: str, current_description: str) -> str:
-    #     """
-    #     Refines the description field based on the user's query. 
-    #     If the query contains the genral word like "bull", "Make it Bike icons" it extracts relevant keywords; otherwise, it retains the current description.
-    #     """
-    #     keywords = [word.lower() for word in message.split()]
-    #     if "icons" in keywords:
-    #         return " ".join(keywords).replace("icons", "").strip()
-    #     return current_description
-
-    # new_description = refine_description(message, icon_attributes.get("description", ""))
-    # description_updated = new_description != icon_attributes.get("description", "")
-
-    # # Update description and adjust general response if changed
-    # icon_attributes["description"] = new_description
-    # if description_updated:
-    #     icon_attributes["general_response"] = f"The design has been updated to match your query for '{new_description}' icons. The settings are now focused on this theme. Let me know if you'd like further adjustments."
+class GeneralQueryOutput(BaseModel):
+    color_palette: str = Field(description="The color palette of the picture")
+    iconography: str = Field(description="The iconography of the picture")
+    brand_style: str = Field(description="The band style of the picture")
+    gradient_usage: str = Field(description="The gradient usage of the picture")
+    imagery: str = Field(description="The imagery of the picture")
+    shadow_and_depth: str = Field(description="The shadow and depth of the picture")
+    line_thickness: str = Field(description="The line thickness of the picture")
+    corner_rounding: str = Field(description="The corner rounding of the picture")
+    description: str = Field(description="Description used as a keyword for the icons")
+    style: str = Field(description="The style of the icon")
+    general_response: str = Field(default=None, description="General response of the input query")
 
-    structured_llm = llm.with_structured_output(Output_Structure)
 
-    sys_prompt = """
+GENERAL_QUERY_PROMPT = """
    You are an AI expert in refining icon designs based on user inputs. Using the current design settings provided below, analyze the user's query and adjust the settings as required.  
 
 ### **Current Icon Design Settings:**  
@@ -173,35 +157,62 @@ Case: For any query use logicand creativity to update the design
 - You should never add shape/color in description field.
 
     """
-    prompt = ChatPromptTemplate.from_messages([("system", sys_prompt), MessagesPlaceholder("history", optional=True), ("human", "{question}")])
-    partial_prompt = prompt.partial(
-                        color_palette=icon_attributes.get("color_palette", " "),
-                        iconography=icon_attributes.get("iconography", " "),
-                        brand_style=icon_attributes.get("brand_style", " "),
-                        gradient_usage=icon_attributes.get("gradient_usage", " "),
-                        imagery=icon_attributes.get("imagery", " "),
-                        shadow_and_depth=icon_attributes.get("shadow_and_depth", " "),
-                        line_thickness=icon_attributes.get("line_thickness", " "),
-                        corner_rounding=icon_attributes.get("corner_rounding", " "),
-                        description=icon_attributes.get("description", " "),
-    )
 
-    chain = partial_prompt | structured_llm
-    response = chain.invoke({"history": [], "question": message})
-    return response
 
+# Current design settings the general query prompt is filled with
+GENERAL_QUERY_ATTRIBUTES = ('color_palette', 'iconography', 'brand_style', 'gradient_usage', 'imagery',
+                            'shadow_and_depth', 'line_thickness', 'corner_rounding', 'description')
 
-def IdentifyQuery(query):
 
-    class Output_Structure(BaseModel):
-        color: str = Field(default=None, description="Color name detected from input query")
-        shape: str = Field(default=None, description="Shape name detected from input query")
-        path: Literal['color', 'shape', 'general'] = Field(description="general query from input query")
+@register_chain('general_query')
+def build_general_query_chain():
+    structured_llm = llm.with_structured_output(GeneralQueryOutput)
+    prompt = ChatPromptTemplate.from_messages([("system", GENERAL_QUERY_PROMPT), MessagesPlaceholder("history", optional=True), ("human", "{question}")])
+    return prompt | structured_llm
 
-    if not query or query.strip() == "":
-        return {"error": "Query cannot be empty or None"}
 
-    structured_llm = llm.with_structured_output(Output_Structure)
+def general_query_inputs(message, icon_attributes):
+    # def refine_description(message: str, current_description: str) -> str:
+    #     """
+    #     Refines the description field based on the user's query. 
+    #     If the query contains the genral word like "bull", "Make it Bike icons" it extracts relevant keywords; otherwise, it retains the current description.
+    #     """
+    #     keywords = [word.lower() for word in message.split()]
+    #     if "icons" in keywords:
+    #         return " ".join(keywords).replace("icons", "").strip()
+    #     return current_description
+
+    # new_description = refine_description(message, icon_attributes.get("description", ""))
+    # description_updated = new_description != icon_attributes.get("description", "")
+
+    # # Update description and adjust general response if changed
+    # icon_attributes["description"] = new_description
+    # if description_updated:
+    #     icon_attributes["general_response"] = f"The design has been updated to match your query for '{new_description}' icons. The settings are now focused on this theme. Let me know if you'd like further adjustments."
+
+    # The design settings are prompt inputs, so the compiled chain is shared by every project
+    inputs = {key: icon_attributes.get(key, " ") for key in GENERAL_QUERY_ATTRIBUTES}
+    inputs.update({"history": [], "question": message})
+    return inputs
+
+
+def GeneralQueryAnswer(message, icon_attributes):
+    return get_chain('general_query').invoke(general_query_inputs(message, icon_attributes))
+
+
+async def aGeneralQueryAnswer(message, icon_attributes):
+    return await get_chain('general_query').ainvoke(general_query_inputs(message, icon_attributes))
+
+
+class IdentifiedQuery(BaseModel):
+    color: str = Field(default=None, description="Color name detected from input query")
+    shape: str = Field(default=None, description="Shape name detected from input query")
+    path: Literal['color', 'shape', 'general'] = Field(description="general query from input query")
+
+
+@register_chain('identify_query')
+def build_identify_query_chain():
+    structured_llm = llm.with_structured_output(IdentifiedQuery)
     # sys_prompt = """
     #     You are an AI designed to classify queries based on their content, specifically detecting colors, shapes, or general topics. 
     #     For each query, determine if it is related to color, shape, or a general topic, and respond with the appropriate classification.
@@ -227,8 +238,10 @@ def IdentifyQuery(query):
             MessagesPlaceholder("history", optional=True), ("human", "{question}")
         ]
     )
-    chain = prompt | structured_llm
-    response = chain.invoke({"history": [], "question": query})
+    return prompt | structured_llm
+
+
+def normalize_identified_query(response):
     # Ensure expected attributes exist in response before accessing them
     if 'color' in response and response['color']:
         response['color'] = response['color'].lower()  # Safely call lower() if color exists
@@ -238,16 +251,31 @@ def IdentifyQuery(query):
     return response
 
 
-def changeIconColorAndShapeQueryBot(query):
+def IdentifyQuery(query):
+    if not query or query.strip() == "":
+        return {"error": "Query cannot be empty or None"}
+    response = get_chain('identify_query').invoke({"history": [], "question": query})
+    return normalize_identified_query(response)
+
+
+async def aIdentifyQuery(query):
+    if not query or query.strip() == "":
+        return {"error": "Query cannot be empty or None"}
+    response = await get_chain('identify_query').ainvoke({"history": [], "question": query})
+    return normalize_identified_query(response)
+
+
+class ColorAndShapeOutput(BaseModel):
+    color: str = Field(default=None, description="Color name detected from input query")
+    shape: str = Field(default=None, description="Shape name detected from input query")
+    isRelatedColor: bool = Field(default=False, description="if query is related to available color return True, else return False")
+    isRelatedShape: bool = Field(default=False, description="if query is related to available shape return True, else return False")
+    general_response: str = Field(default=None, description="General response of the input query")
 
-    class Output_Structure(BaseModel):
-        color: str = Field(default=None, description="Color name detected from input query")
-        shape: str = Field(default=None, description="Shape name detected from input query")
-        isRelatedColor: bool = Field(default=False, description="if query is related to available color return True, else return False")
-        isRelatedShape: bool = Field(default=False, description="if query is related to available shape return True, else return False")
-        general_response: str = Field(default=None, description="General response of the input query")
 
-    structured_llm = llm.with_structured_output(Output_Structure)
+@register_chain('color_and_shape')
+def build_color_and_shape_chain():
+    structured_llm = llm.with_structured_output(ColorAndShapeOutput)
     sys_prompt = """You are interacting with an AI that helps you change the design of an icon. Below are the current \
         design settings of the icon. You can adjust them by giving simple instructions, like "make the icon color blue" \
         or "make the icon bigger."
@@ -305,7 +333,163 @@ def changeIconColorAndShapeQueryBot(query):
             MessagesPlaceholder("history", optional=True), ("human", "{question}")
         ]
     )
-    partial_prompt = prompt.partial(language='English', query=query)
-    chain = partial_prompt | structured_llm
-    response = chain.invoke({"history": [], "question": query})
-    return response
\ No newline at end of file
+    return prompt | structured_llm
+
+
+def changeIconColorAndShapeQueryBot(query):
+    return get_chain('color_and_shape').invoke({"history": [], "question": query})
+
+
+async def achangeIconColorAndShapeQueryBot(query):
+    return await get_chain('color_and_shape').ainvoke({"history": [], "question": query})
+
+
+
+# Freepik icon styles and the words users call them by
+SHAPE_KEYWORDS = {
+    'outline': 'outline',
+    'outlined': 'outline',
+    'outlines': 'outline',
+    'line': 'outline',
+    'fill': 'fill',
+    'filled': 'fill',
+    'solid': 'fill',
+    'lineal-color': 'lineal-color',
+    'lineal': 'lineal-color',
+    'linear': 'lineal-color',
+    'hand-drawn': 'hand-drawn',
+    'hand drawn': 'hand-drawn',
+    'handdrawn': 'hand-drawn',
+    'sketch': 'hand-drawn',
+}
+
+# Instruction words around a bare color or shape, e.g. "make the icons red please"
+# Bare tone words ask for a theme ("turn it dark", "make it lighter"), which the model handles as a
+# general query; they only name a color together with a hue ("dark blue")
+TONE_WORDS = frozenset({
+    'dark', 'darker', 'light', 'lighter', 'bright', 'brighter', 'pale', 'deep', 'dim', 'muted', 'soft',
+    'vivid', 'pastel', 'neon', 'warm', 'warmer', 'cool', 'cooler',
+})
+
+QUERY_FILLER_PATTERN = re.compile(
+    r"\b(please|can you|could you|make|change|set|turn|switch|use|update|them|it|the|all|my|icons?|"
+    r"colou?rs?|styles?|shapes?|to|into|in|with|a|an|version)\b"
+)
+
+
+class QueryRoute(BaseModel):
+    path: Literal['color', 'shape', 'general'] = Field(description="Category of the input query")
+    color: str = Field(default=None, description="Closest Freepik color for a color query")
+    shape: str = Field(default=None, description="Closest Freepik shape for a shape query")
+    color_palette: str = Field(default=None, description="Updated color palette for a general query")
+    iconography: str = Field(default=None, description="Updated iconography for a general query")
+    brand_style: str = Field(default=None, description="Updated brand style for a general query")
+    gradient_usage: str = Field(default=None, description="Updated gradient usage for a general query")
+    imagery: str = Field(default=None, description="Updated imagery for a general query")
+    shadow_and_depth: str = Field(default=None, description="Updated shadow and depth for a general query")
+    line_thickness: str = Field(default=None, description="Updated line thickness for a general query")
+    corner_rounding: str = Field(default=None, description="Updated corner rounding for a general query")
+    description: str = Field(default=None, description="Keyword for the icons for a general query")
+    style: str = Field(default=None, description="Style of the icon mentioned in a general query")
+    general_response: str = Field(default=None, description="General response of the input query")
+
+
+QUERY_ROUTE_PROMPT = """
+   You route and answer icon design queries in a single step.
+
+### **Step 1: Classify the query into "color", "shape" or "general":**  
+1. If the query mentions only a color, classify it as "color."  
+2. If the query mentions only a shape, classify it as "shape," ensuring the shape matches one of the following: *outline, fill, lineal-color, hand-drawn.*  
+3. If the query combines colors or shapes with general terms (e.g., "theme," "view," "style", "red cow", "outline, blue") or describes a combination of both, classify it as "general."  
+4. If the query contains descriptive terms without a clear color or shape, classify it as "general."  
+5. Always prioritize "general" if both a color and shape are mentioned.  
+
+### **Step 2: Fill the fields for the path:**  
+- **color:** Set `color` to the closest or exact match of gradient, solid-black, multicolor, azure, black, blue, chartreuse, \
+cyan, gray, green, orange, red, rose, spring-green, violet, white, yellow (e.g. "pink" -> "rose", "gold" -> "yellow", \
+"purple" -> "violet", "silver" -> "gray", "sky blue" -> "azure", "lime" -> "chartreuse"). Set `general_response` to \
+'The icon color has been updated to <color>.' Leave the design settings empty.
+- **shape:** Set `shape` to the closest or exact match of outline, fill, lineal-color, hand-drawn. Set `general_response` \
+to 'The shape has been updated to <shape>.' Leave the design settings empty.
+- **general:** Follow the instructions below and return every design setting and the style.
+
+""" + GENERAL_QUERY_PROMPT
+
+
+@register_chain('query_route')
+def build_query_route_chain():
+    structured_llm = llm.with_structured_output(QueryRoute)
+    prompt = ChatPromptTemplate.from_messages([("system", QUERY_ROUTE_PROMPT), MessagesPlaceholder("history", optional=True), ("human", "{question}")])
+    return prompt | structured_llm
+
+
+def preclassify_query(query):
+    """
+    Route a query that is only a color or only a shape word ("red", "make it outline") without the
+    model. Anything else, including a color together with a shape, is left to the router chain.
+
+    Args:
+        query (str): The user query.
+
+    Returns:
+        QueryRoute or None: The route, or None when the query needs the model.
+    """
+    phrase = re.sub(r"[^a-z\s-]", " ", query.lower())
+    # "lineal-color" loses its filler half, so hyphens left dangling are trimmed
+    phrase = " ".join(word.strip('-') for word in QUERY_FILLER_PATTERN.sub(" ", phrase).split())
+    phrase = " ".join(phrase.split())
+    if not phrase:
+        return None
+    if all(word in TONE_WORDS for word in phrase.split()):
+        return None
+    if phrase in SHAPE_KEYWORDS:
+        shape = SHAPE_KEYWORDS[phrase]
+        return QueryRoute(path='shape', shape=shape, general_response=f"The shape has been updated to {shape}.")
+    color = resolve_color_phrase(phrase)
+    if color:
+        return QueryRoute(path='color', color=color, general_response=f"The icon color has been updated to {color}.")
+    return None
+
+
+def normalize_query_route(route):
+    if route.color:
+        # Keeps the color on a Freepik filter even when the model answers "pink" or "#ff0000"
+        route.color = match_color(route.color) or route.color.lower()
+    if route.shape:
+        shape = route.shape.lower()
+        route.shape = SHAPE_KEYWORDS.get(shape, shape)
+    return route
+
+
+def route_query(query, icon_attributes):
+    """
+    Classify a query and extract its color, shape or updated design settings in one model call.
+    Replaces IdentifyQuery followed by changeIconColorAndShapeQueryBot or GeneralQueryAnswer.
+
+    Args:
+        query (str): The user query.
+        icon_attributes (dict): Current design settings of the project.
+
+    Returns:
+        QueryRoute: The path and the fields for it.
+    """
+    if settings.QUERY_LOCAL_ROUTING:
+        route = preclassify_query(query)
+        if route:
+            print("query routed locally-->", route)
+            return route
+    route = get_chain('query_route').invoke(general_query_inputs(query, icon_attributes))
+    return normalize_query_route(route)
+
+
+async def aroute_query(query, icon_attributes):
+    """
+    Async variant of route_query.
+    """
+    if settings.QUERY_LOCAL_ROUTING:
+        route = preclassify_query(query)
+        if route:
+            print("query routed locally-->", route)
+            return route
+    route = await get_chain('query_route').ainvoke(general_query_inputs(query, icon_attributes))
+    return normalize_query_route(route)
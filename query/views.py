@@ -7,8 +7,8 @@ from rest_framework.response import Response
 from app.models import Project
 from app.serializers import ProjectIconAttributesSerializer, ProjectSerializer
 from auth_app.token_auth import CustomTokenAuthentication
-from query.utils import GeneralQueryAnswer, IdentifyQuery, changeIconColorAndShapeQueryBot
-from app.utils import fetch_icons, format_value
+from query.utils import route_query
+from app.utils import fetch_icons, fetch_icons_incremental, format_value, icon_search_base, palette_color_source
 
 
 class UpdateIconAttributesByQuery(APIView):
@@ -39,9 +39,10 @@ class UpdateIconAttributesByQuery(APIView):
             # print("serializer data:", serializer.data)
             project_attributes = serializer.data["attributes"]
             print("before attributes-->", project_attributes)
-            print("before f_icons-->", project_instance.f_icons[0])
-            response = IdentifyQuery(query)
-            
+            print("before icon_result_set-->", project_instance.icon_result_set_id)
+            # One routing step: local for a bare color/shape word, otherwise a single model call
+            response = route_query(query, project_attributes)
+
             print("response-->", response)
 
             # Check if the response path is valid and has the necessary data
@@ -50,65 +51,60 @@ class UpdateIconAttributesByQuery(APIView):
 
             # Process the response based on the path
             if response.path == 'general':
-                actual_response = GeneralQueryAnswer(query, project_attributes)
-                if not actual_response:
-                    return Response({'error': 'General query processing failed'}, status=400)
-                
-                if actual_response.style:
+                if response.style:
                     isRelatedShape = True
-                    icon_style = actual_response.style
-                print(f"Actual response from LLM: {actual_response}")
-                general_response = actual_response.general_response
-                # icon_style = actual_response.shape if actual_response.shape else None
-                # if icon_style:
-                #     isRelatedShape = True
-                # icon_color_name = actual_response.color if actual_response.color else None
-                attributes['color_palette'] = format_value(actual_response.color_palette)
-                attributes['iconography'] = format_value(actual_response.iconography)
-                attributes['brand_style'] = format_value(actual_response.brand_style)
-                attributes['gradient_usage'] = format_value(actual_response.gradient_usage)
-                attributes['imagery'] = format_value(actual_response.imagery)
-                attributes['shadow_and_depth'] = format_value(actual_response.shadow_and_depth)
-                attributes['line_thickness'] = format_value(actual_response.line_thickness)
-                attributes['corner_rounding'] = format_value(actual_response.corner_rounding)
-                attributes['description'] = actual_response.description
-                # attributes = project_attributes
+                    icon_style = response.style
+                general_response = response.general_response
+                attributes['color_palette'] = format_value(response.color_palette)
+                attributes['iconography'] = format_value(response.iconography)
+                attributes['brand_style'] = format_value(response.brand_style)
+                attributes['gradient_usage'] = format_value(response.gradient_usage)
+                attributes['imagery'] = format_value(response.imagery)
+                attributes['shadow_and_depth'] = format_value(response.shadow_and_depth)
+                attributes['line_thickness'] = format_value(response.line_thickness)
+                attributes['corner_rounding'] = format_value(response.corner_rounding)
+                attributes['description'] = response.description
 
             if response.path == 'color':
                 isRelatedColor = True
-                actual_response = changeIconColorAndShapeQueryBot(query)
-                print("actual_response for color-->", actual_response)
-                icon_color_name = actual_response.color if actual_response.color else ""
-                attributes['color_palette'] = response.color
-                general_response = actual_response.general_response
+                icon_color_name = response.color if response.color else ""
+                general_response = response.general_response
                 attributes = project_attributes
-                icon_style = None               
+                icon_style = None
 
             if response.path == 'shape':
                 isRelatedShape = True
-                actual_response = changeIconColorAndShapeQueryBot(query)
-                print("actual_response for shape-->", actual_response)
-                icon_style = actual_response.shape if actual_response.shape else ""
-                general_response = actual_response.general_response
+                icon_style = response.shape if response.shape else ""
+                general_response = response.general_response
                 attributes = project_attributes
                 icon_color_name = None
 
             print("after attributes-->", attributes)
-            f_icons_list, result, error = fetch_icons(
-                isRelatedColor, isRelatedShape, attributes["color_palette"],
-                attributes["iconography"], attributes["brand_style"] , attributes["gradient_usage"],
-                attributes["imagery"], attributes["shadow_and_depth"], attributes["line_thickness"],
-                attributes["corner_rounding"], attributes["description"], icon_color_name, icon_style
-            )
+            search = None
+            if response.path in ('color', 'shape'):
+                # Only a filter changed: reuse the previous search term and summary, one Freepik call
+                search = fetch_icons_incremental(attributes, isRelatedShape, icon_color_name, icon_style)
+            if search is None:
+                search = fetch_icons(
+                    isRelatedColor, isRelatedShape, palette_color_source(attributes),
+                    attributes["iconography"], attributes["brand_style"] , attributes["gradient_usage"],
+                    attributes["imagery"], attributes["shadow_and_depth"], attributes["line_thickness"],
+                    attributes["corner_rounding"], attributes["description"], icon_color_name, icon_style
+                )
+            f_icons_list, result, error = search
             if error:
                 return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
 
             # Check if the 'attributes' has meaningful data (non-empty values)
             if any(value != "" for value in attributes.values()):
+                # The search the next color/shape refinement builds on
+                attributes['query_by_llm'] = result
+                if response.path == 'general' or not attributes.get('search_term'):
+                    attributes['search_term'] = icon_search_base(attributes['description'])
                 project_instance.attributes = attributes
 
             if f_icons_list:
-                print("f_icons_list_old-->", project_instance.f_icons[0])
+                print("icon_result_set_old-->", project_instance.icon_result_set_id)
                 project_instance.f_icons = f_icons_list
                 print("f_icons_list_new-->", f_icons_list[0])
 